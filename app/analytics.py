@@ -0,0 +1,379 @@
+"""
+In-process analytics engine answering the reports from a snapshot of the employees held as NumPy arrays,
+enabled with ANALYTICS_ENGINE. The hire dates are kept as int64 epoch seconds, the department and job ids
+as int32, and the names of the departments and jobs are dictionary encoded in sorted order, so the
+reports are vectorized group-bys that don't query the database.
+
+The snapshot is tagged with the data generation of the report cache: the uploads of this worker apply their rows
+to it once committed, including the columnar and parallel uploads and the datasets, any other change of the data
+(the uploads of other workers sharing the cache backend or a detached partition) makes the next report reload it.
+The snapshot reads the employees table, like the hiring summary it leaves out the hires of the detached partitions.
+"""
+from collections import namedtuple
+from threading import Lock
+from sqlalchemy import BigInteger, select, func, cast, extract
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+import pandas as pd
+from .db_models import Departments, Jobs, Employees
+from .report_cache import report_cache
+from .upload_file_utils import ISO_TIMESTAMP_FORMAT
+
+# Placeholders of the null hire dates and ids in the arrays
+NULL_TIMESTAMP = np.iinfo(np.int64).min
+NULL_ID = np.iinfo(np.int32).min
+
+EmployeesPerQuarterRow = namedtuple("EmployeesPerQuarterRow", ["year", "department", "job", "Q1", "Q2", "Q3", "Q4"])
+HiringMoreThanAvgRow = namedtuple("HiringMoreThanAvgRow", ["year", "id", "department", "hired"])
+
+
+def encode_names(names: np.ndarray) -> tuple:
+    """
+    Dictionary encode names, the dictionary is sorted with the null name last so the order of the codes
+    is the order of the names.
+
+    Returns:
+    tuple: The code of every name and the dictionary of names.
+    """
+    is_null = np.array([name is None for name in names], dtype=bool)
+    dictionary, codes = np.unique(names[~is_null].astype(str), return_inverse=True)
+    dictionary = np.append(dictionary.astype(object), None) if is_null.any() else dictionary.astype(object)
+
+    all_codes = np.full(len(names), len(dictionary) - 1, dtype=np.int32)
+    all_codes[~is_null] = codes
+    return all_codes, dictionary
+
+def lookup_codes(ids: np.ndarray, dictionary_ids: np.ndarray) -> np.ndarray:
+    """
+    Get the position of every id in the sorted ids of a dictionary, -1 for the ids that aren't in it.
+    """
+    positions = np.searchsorted(dictionary_ids, ids)
+    found = positions < len(dictionary_ids)
+    found[found] = dictionary_ids[positions[found]] == ids[found]
+    return np.where(found, positions, -1)
+
+def upsert_arrays(ids: np.ndarray, columns: list, new_ids: np.ndarray, new_columns: list) -> tuple:
+    """
+    Upsert rows by id into columns sorted by id, the last row of a repeated id wins as in the uploads.
+
+    Returns:
+    tuple: The sorted ids and the columns with the new rows.
+    """
+    # Keep the last occurrence of each id
+    reversed_ids = new_ids[::-1]
+    new_ids, last = np.unique(reversed_ids, return_index=True)
+    new_columns = [values[::-1][last] for values in new_columns]
+
+    positions = np.searchsorted(ids, new_ids)
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == new_ids[found]
+
+    columns = [values.copy() for values in columns]
+    for values, new_values in zip(columns, new_columns):
+        values[positions[found]] = new_values[found]
+
+    # The new ids are inserted at their sorted positions
+    inserted = positions[~found]
+    return (
+        np.insert(ids, inserted, new_ids[~found]),
+        [np.insert(values, inserted, new_values[~found]) for values, new_values in zip(columns, new_columns)]
+    )
+
+
+class Dictionary:
+    """
+    The names of the departments or jobs sorted by id, dictionary encoded.
+    """
+
+    def __init__(self, ids: np.ndarray, names: np.ndarray):
+        self.ids = ids.astype(np.int32)
+        self.names = names
+        self.name_codes, self.dictionary = encode_names(names)
+
+    def upsert(self, ids: np.ndarray, names: np.ndarray) -> 'Dictionary':
+        ids, (names,) = upsert_arrays(self.ids, [self.names], ids.astype(np.int32), [names])
+        return Dictionary(ids, names)
+
+class AnalyticsSnapshot:
+    """
+    Immutable snapshot of the employees, departments and jobs. The hires are aggregated once when the snapshot
+    is built into sorted group keys starting with the year, so a report only slices the years it requests:
+    its cost depends on the number of groups of those years, not on the number of employees.
+    """
+
+    def __init__(self, employee_ids, hire_seconds, department_ids, job_ids, departments: Dictionary, jobs: Dictionary, generation: int):
+        self.employee_ids = employee_ids.astype(np.int64)
+        self.hire_seconds = hire_seconds.astype(np.int64)
+        self.department_ids = department_ids.astype(np.int32)
+        self.job_ids = job_ids.astype(np.int32)
+        self.departments = departments
+        self.jobs = jobs
+        self.generation = generation
+
+        # The hire dates are grouped in UTC, as the hiring summary groups them
+        has_hire_date = self.hire_seconds != NULL_TIMESTAMP
+        dates = self.hire_seconds[has_hire_date].astype('datetime64[s]')
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        quarters = (dates.astype('datetime64[M]').astype(np.int64) % 12) // 3
+        self.first_year = int(years.min()) if len(years) else 0
+        year_offsets = years - self.first_year
+
+        # Position of the department and job of every hired employee in the dictionaries, -1 without one
+        department_positions = lookup_codes(self.department_ids[has_hire_date], departments.ids)
+        job_positions = lookup_codes(self.job_ids[has_hire_date], jobs.ids)
+
+        # Hires by year, department name, job name and quarter, of the employees with department and job
+        with_job = (department_positions >= 0) & (job_positions >= 0)
+        self.quarter_group_size = 4 * len(departments.dictionary) * len(jobs.dictionary)
+        self.quarter_keys, self.quarter_hires = np.unique(
+            year_offsets[with_job] * self.quarter_group_size
+            + (departments.name_codes[department_positions[with_job]] * len(jobs.dictionary)
+               + jobs.name_codes[job_positions[with_job]]) * 4
+            + quarters[with_job],
+            return_counts=True
+        )
+
+        # Hires by year and department, of the employees with department
+        with_department = department_positions >= 0
+        self.department_group_size = len(departments.ids)
+        self.department_keys, self.department_hires = np.unique(
+            year_offsets[with_department] * self.department_group_size + department_positions[with_department],
+            return_counts=True
+        )
+
+    def slice_years(self, keys: np.ndarray, group_size: int, year_from: int, year_to: int) -> slice:
+        """
+        Get the slice of the sorted group keys of the years between year_from and year_to (both included).
+        """
+        first = max(year_from - self.first_year, 0)
+        last = max(year_to - self.first_year + 1, 0)
+        return slice(
+            np.searchsorted(keys, first * group_size),
+            np.searchsorted(keys, last * group_size)
+        )
+
+    def employees_per_quarter(self, year_from: int, year_to: int) -> list:
+        """
+        The employees hired per quarter between two years (both included), by year, department and job names,
+        sorted by them. The employees without department or job aren't counted.
+        """
+        years = self.slice_years(self.quarter_keys, self.quarter_group_size, year_from, year_to)
+        keys = self.quarter_keys[years]
+        if not len(keys):
+            return []
+
+        # The quarters of every group are consecutive sorted keys
+        groups = keys // 4
+        rows = np.concatenate(([0], np.cumsum(groups[1:] != groups[:-1])))
+        groups = groups[np.concatenate(([True], groups[1:] != groups[:-1]))]
+        quarters = np.zeros((len(groups), 4), dtype=np.int64)
+        quarters[rows, keys % 4] = self.quarter_hires[years]
+
+        department_names = self.departments.dictionary
+        job_names = self.jobs.dictionary
+        job_codes = groups % len(job_names)
+        department_codes = (groups // len(job_names)) % len(department_names)
+        group_years = groups // (len(job_names) * len(department_names)) + self.first_year
+
+        return [
+            EmployeesPerQuarterRow(year, department_names[department], job_names[job], *counts)
+            for year, department, job, counts in zip(
+                group_years.tolist(), department_codes.tolist(), job_codes.tolist(), quarters.tolist()
+            )
+        ]
+
+    def hiring_more_than_avg(self, year_from: int, year_to: int) -> list:
+        """
+        The departments that hired more employees than the average of the departments in the same year,
+        by year and hires in descending order. The years with hires where no department hired more than
+        the average have a single row with null id, department and hired.
+        """
+        years = self.slice_years(self.department_keys, self.department_group_size, year_from, year_to)
+        keys = self.department_keys[years]
+        if not len(keys):
+            return []
+
+        hired = self.department_hires[years]
+        year_offsets, year_indexes = np.unique(keys // self.department_group_size, return_inverse=True)
+        positions = keys % self.department_group_size
+
+        # The average of the departments hiring in each year
+        averages = np.bincount(year_indexes, weights=hired) / np.bincount(year_indexes)
+        above = hired > averages[year_indexes]
+
+        # Sorted by year and hires in descending order
+        order = np.lexsort((-hired, year_indexes))
+        order = order[above[order]]
+
+        rows = []
+        for year_index, year_offset in enumerate(year_offsets.tolist()):
+            year = year_offset + self.first_year
+            year_rows = order[year_indexes[order] == year_index].tolist()
+            if not year_rows:
+                rows.append(HiringMoreThanAvgRow(year, None, None, None))
+
+            rows += [
+                HiringMoreThanAvgRow(
+                    year,
+                    int(self.departments.ids[positions[index]]),
+                    self.departments.names[positions[index]],
+                    int(hired[index])
+                )
+                for index in year_rows
+            ]
+
+        return rows
+
+class AnalyticsEngine:
+    """
+    Holder of the current snapshot, replaced as a whole so the reports never see a partial upload.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.reloads = 0
+        self.deltas = 0
+        self._lock = Lock()
+
+    def load(self, db, generation: int = None) -> AnalyticsSnapshot:
+        """
+        Load the snapshot from the database.
+        Params:
+        db (Session): The database session.
+        generation (int): The data generation the snapshot is read in, the current one by default.
+        """
+        if generation is None:
+            generation = report_cache.backend.get_generation()
+
+        # The hire dates are read as epoch seconds and the nulls as their placeholders
+        hire_seconds = func.coalesce(cast(func.floor(extract("epoch", Employees.datetime)), BigInteger), NULL_TIMESTAMP)
+        employees = db.execute(select(
+            Employees.id,
+            hire_seconds,
+            func.coalesce(Employees.department_id, NULL_ID),
+            func.coalesce(Employees.job_id, NULL_ID)
+        ).order_by(Employees.id)).all()
+        departments = db.execute(select(Departments.id, Departments.department).order_by(Departments.id)).all()
+        jobs = db.execute(select(Jobs.id, Jobs.job).order_by(Jobs.id)).all()
+        db.rollback()
+
+        snapshot = AnalyticsSnapshot(
+            *[np.array([row[i] for row in employees], dtype=np.int64) for i in range(4)],
+            Dictionary(
+                np.array([row[0] for row in departments], dtype=np.int32),
+                np.array([row[1] for row in departments], dtype=object)
+            ),
+            Dictionary(
+                np.array([row[0] for row in jobs], dtype=np.int32),
+                np.array([row[1] for row in jobs], dtype=object)
+            ),
+            generation
+        )
+
+        with self._lock:
+            self.snapshot = snapshot
+            self.reloads += 1
+
+        return snapshot
+
+    def get_snapshot(self, generation: int = None) -> AnalyticsSnapshot:
+        """
+        Get the snapshot of the current data generation, reloading it from the primary when
+        the data changed since it was built.
+        """
+        if generation is None:
+            generation = report_cache.backend.get_generation()
+
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.generation == generation:
+            return snapshot
+
+        # Imported on the first reload, the sessions of the primary see every committed upload
+        from .database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            return self.load(db, generation)
+        finally:
+            db.close()
+
+    def apply_upload(self, file_type: str, df: pd.DataFrame, generation: int):
+        """
+        Apply the rows of an upload committed by this worker to the snapshot.
+        Params:
+        file_type (str): Type of the file uploaded.
+        df (pd.DataFrame): The validated rows upserted.
+        generation (int): The data generation started by the commit of the upload.
+        """
+        with self._lock:
+            snapshot = self.snapshot
+
+            # Any other change since the snapshot was built is only visible by reloading it
+            if snapshot is None or snapshot.generation != generation - 1:
+                self.snapshot = None
+                return
+
+            ids = df["id"].astype("int64").to_numpy()
+            if file_type == "departments":
+                snapshot = AnalyticsSnapshot(
+                    snapshot.employee_ids, snapshot.hire_seconds, snapshot.department_ids, snapshot.job_ids,
+                    snapshot.departments.upsert(ids, df["department"].astype(object).where(df["department"].notna(), None).to_numpy()),
+                    snapshot.jobs,
+                    generation
+                )
+            elif file_type == "jobs":
+                snapshot = AnalyticsSnapshot(
+                    snapshot.employee_ids, snapshot.hire_seconds, snapshot.department_ids, snapshot.job_ids,
+                    snapshot.departments,
+                    snapshot.jobs.upsert(ids, df["job"].astype(object).where(df["job"].notna(), None).to_numpy()),
+                    generation
+                )
+            else:
+                hire_dates = pd.to_datetime(df["datetime"], utc=True, format=ISO_TIMESTAMP_FORMAT)
+                # The null hire dates (NaT) become NULL_TIMESTAMP as int64
+                hire_seconds = hire_dates.dt.tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
+                employee_ids, columns = upsert_arrays(
+                    snapshot.employee_ids,
+                    [snapshot.hire_seconds, snapshot.department_ids, snapshot.job_ids],
+                    ids,
+                    [
+                        hire_seconds,
+                        df["department_id"].astype("Int64").fillna(NULL_ID).to_numpy(dtype=np.int32),
+                        df["job_id"].astype("Int64").fillna(NULL_ID).to_numpy(dtype=np.int32)
+                    ]
+                )
+                snapshot = AnalyticsSnapshot(employee_ids, *columns, snapshot.departments, snapshot.jobs, generation)
+
+            self.snapshot = snapshot
+            self.deltas += 1
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "loaded": snapshot is not None,
+            "generation": snapshot.generation if snapshot is not None else None,
+            "employees": len(snapshot.employee_ids) if snapshot is not None else 0,
+            "reloads": self.reloads,
+            "deltas": self.deltas
+        }
+
+# Snapshot of this worker
+analytics_engine = AnalyticsEngine()
+
+# Reports answered by the snapshot by the name of their cache entries
+ANALYTICS_REPORTS = {
+    "employees_per_quarter": AnalyticsSnapshot.employees_per_quarter,
+    "hiring_more_than_avg": AnalyticsSnapshot.hiring_more_than_avg
+}
+
+def get_analytics_report(report: str, year_from: int, year_to: int) -> list:
+    return ANALYTICS_REPORTS[report](analytics_engine.get_snapshot(), year_from, year_to)
+
+async def stream_analytics_report(report: str, year_from: int, year_to: int):
+    """
+    Yield the rows of a report computed from the snapshot as a single batch, as stream_report_batches
+    yields the rows of the database. A reload of the snapshot runs in the threadpool.
+    """
+    rows = await run_in_threadpool(get_analytics_report, report, year_from, year_to)
+    if rows:
+        yield rows
@@ -0,0 +1,288 @@
+from fastapi import HTTPException, UploadFile
+from pandas_schema import Schema
+from sqlalchemy import Table, Integer, DateTime
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+import psycopg2
+import io
+import time
+from .db_models import get_upsert_counts
+from .copy_loader import COPY_ROWS_PER_STATEMENT, get_staging_table, create_temp_staging_table, merge_staging_table
+from .queries import get_file_type_model
+from .upload_file_utils import get_file_schema, ValidationReport
+from .report_cache import report_cache
+from .database import ANALYTICS_ENGINE
+from .ingestion import ingestion_stage, INTEGRITY_ERRORS, get_integrity_error_detail
+from .metrics import ingest_rows, ingest_seconds, ingest_bytes_read, ingest_errors
+
+
+def import_pyarrow():
+    """
+    Import pyarrow, only required by the Parquet and Arrow IPC uploads.
+    """
+    try:
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(
+            status_code=400,
+            detail="Parquet and Arrow IPC files are not supported by this server, please use CSV files!"
+        )
+
+    return pyarrow
+
+def read_columnar_file(file: UploadFile, file_format: str):
+    """
+    Read a Parquet or Arrow IPC (file or stream format) file uploaded by the user.
+    Params:
+    file (Upload File): The file uploaded by the user.
+    file_format (str): 'parquet' or 'arrow'.
+
+    Returns:
+    pyarrow.Table: The content of the file with the types it was written with.
+    """
+    pa = import_pyarrow()
+
+    try:
+        if file_format == 'parquet':
+            table = pa.parquet.read_table(file.file)
+        else:
+            try:
+                table = pa.ipc.open_file(file.file).read_all()
+            except pa.ArrowInvalid:
+                # Not the random access format, read it as a stream
+                file.file.seek(0)
+                table = pa.ipc.open_stream(file.file).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail="Parsing error reading the {} file, please verify the file content!".format(
+                "Parquet" if file_format == 'parquet' else "Arrow IPC"
+            )
+        )
+
+    if table.num_rows == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="The file provided was empty, please verify the uploaded file!"
+        )
+
+    return table
+
+def validate_columnar_columns(arrow_table, schema: Schema):
+    """
+    The columnar files contain the name of their columns, they must be the columns of the schema in any order.
+    """
+    file_cols = [col.name for col in schema.columns]
+
+    if sorted(arrow_table.column_names) != sorted(file_cols):
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "status": "Upload Failure",
+                "error_message": "The file provided doesn't match the expected schema!",
+                "suggestion": "Please provide file with the following schema: {}".format(str(file_cols))
+            }
+        )
+
+def decode_dictionary(values):
+    """
+    Decode the dictionary encoded columns (e.g. Parquet categoricals) into their value type.
+    """
+    pa = import_pyarrow()
+    if pa.types.is_dictionary(values.type):
+        return values.cast(values.type.value_type)
+
+    return values
+
+def has_column_type(values, column_type) -> bool:
+    """
+    Check if the values of a column have the Arrow type matching the type of the database column,
+    then every value is valid without checking them one by one.
+    """
+    pa = import_pyarrow()
+
+    if isinstance(column_type, Integer):
+        return pa.types.is_integer(values.type)
+    if isinstance(column_type, DateTime):
+        return pa.types.is_timestamp(values.type)
+
+    return pa.types.is_string(values.type) or pa.types.is_large_string(values.type)
+
+def validate_columnar_content(file_type: str, arrow_table):
+    """
+    Validate a columnar file against the schema of its file_type using the types of its columns.
+    The columns with the type of their database column only have to check the nulls of the columns
+    that don't accept them, the other columns (e.g. integers written as floats, ISO timestamps written as strings)
+    are validated value by value with the validations of the schema.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    arrow_table (pyarrow.Table): The content of the uploaded file.
+    """
+    schema = get_file_schema(file_type)
+    table = get_file_type_model(file_type).__table__
+
+    report = ValidationReport()
+    for schema_column in schema.columns:
+        # Stop once the maximum number of errors was found
+        if report.is_full:
+            report.aborted = True
+            break
+
+        values = decode_dictionary(arrow_table.column(schema_column.name))
+        column = table.columns[schema_column.name]
+
+        if has_column_type(values, column.type) and (column.nullable or values.null_count == 0):
+            continue
+
+        report.validate_column(schema_column, values.to_pandas())
+
+    if report.error_count > 0:
+        raise HTTPException(
+            status_code=400,
+            detail=report.detail()
+        )
+
+def prepare_arrow_table_for_copy(table: Table, arrow_table):
+    """
+    Order the columns as the table and cast them to the types written by the Arrow CSV writer as COPY expects:
+    integers without decimals and timestamps in UTC (the timestamps without timezone are UTC).
+    Params:
+    table (Table): The target table of the load.
+    arrow_table (pyarrow.Table): The validated content of the uploaded file.
+    """
+    pa = import_pyarrow()
+
+    columns = []
+    for column in table.columns:
+        values = decode_dictionary(arrow_table.column(column.name))
+
+        if isinstance(column.type, Integer):
+            # The floats were validated as whole numbers
+            values = values.cast(pa.int64())
+        elif isinstance(column.type, DateTime) and pa.types.is_timestamp(values.type):
+            if values.type.tz is None:
+                values = values.cast(pa.timestamp(values.type.unit, tz="UTC"))
+        elif not pa.types.is_timestamp(values.type):
+            values = values.cast(pa.string())
+
+        columns.append(values)
+
+    return pa.table(columns, names=[column.name for column in table.columns])
+
+def copy_arrow_table_to_table(cursor, table_name: str, arrow_table):
+    """
+    Stream the rows of an Arrow table into a table using COPY FROM STDIN. The rows are serialized by the
+    Arrow CSV writer, at most COPY_ROWS_PER_STATEMENT rows at a time, without building python objects.
+    Params:
+    cursor: A DBAPI (psycopg2) cursor.
+    table_name (str): Name of the table receiving the rows.
+    arrow_table (pyarrow.Table): The rows to copy, with the columns in the table order.
+    """
+    pa = import_pyarrow()
+    copy_sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        table_name,
+        ", ".join(arrow_table.column_names)
+    )
+    write_options = pa.csv.WriteOptions(include_header=False)
+
+    for start in range(0, arrow_table.num_rows, COPY_ROWS_PER_STATEMENT):
+        buffer = io.BytesIO()
+        pa.csv.write_csv(arrow_table.slice(start, COPY_ROWS_PER_STATEMENT), buffer, write_options)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+def copy_upsert_arrow_table(model, arrow_table, db: Session) -> dict:
+    """
+    Create or update the records of a model from an Arrow table, copying it into a temporary staging table
+    merged into the target table.
+    Params:
+    model: The ORM model of the target table (Employees, Jobs or Departments).
+    arrow_table (pyarrow.Table): The validated content of the uploaded file.
+    db (Session): The database session.
+
+    Returns:
+    dict: The number of records inserted, updated and unchanged once committed, None if the upsert was rolled back.
+        The IntegrityError of the rows violating a constraint is raised once rolled back.
+    """
+    table = model.__table__
+    staging_table = get_staging_table(table)
+
+    try:
+        cursor = db.connection().connection.cursor()
+        create_temp_staging_table(cursor, table, staging_table)
+
+        copy_arrow_table_to_table(cursor, staging_table.name, prepare_arrow_table_for_copy(table, arrow_table))
+
+        # Merge the staging table into the target table
+        inserted, updated = merge_staging_table(model, staging_table, db)
+        db.commit()
+
+    except (SQLAlchemyError, psycopg2.Error) as e:
+        db.rollback()
+        # The rows violating a constraint are an error of the upload, reported by the caller
+        if isinstance(e, INTEGRITY_ERRORS):
+            raise
+        return None
+
+    return get_upsert_counts(arrow_table.num_rows, inserted, updated)
+
+def ingest_columnar_file(file_type: str, file: UploadFile, db: Session, file_format: str) -> dict:
+    """
+    Read, validate and upsert a Parquet or Arrow IPC file, keeping its columns in Arrow from the file to COPY.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    file (UploadFile): The file uploaded by the user.
+    db (Session): The database session.
+    file_format (str): 'parquet' or 'arrow'.
+
+    Returns:
+    dict: The rows of the file, the number of records inserted, updated and unchanged and the format of the file.
+    """
+    start = time.perf_counter()
+
+    # Read the columns of the file with their types
+    with ingestion_stage(file_type, "read"):
+        arrow_table = read_columnar_file(file, file_format)
+    ingest_bytes_read.inc(file.file.seek(0, io.SEEK_END), file_type=file_type)
+
+    # The columns are matched by name
+    with ingestion_stage(file_type, "assign_columns"):
+        validate_columnar_columns(arrow_table, get_file_schema(file_type))
+
+    # Validate file content based on the types of the columns and the restrictions of the schema
+    with ingestion_stage(file_type, "validate"):
+        validate_columnar_content(file_type, arrow_table)
+
+    # Load the file content into SQL
+    try:
+        with ingestion_stage(file_type, "load"):
+            upserted = copy_upsert_arrow_table(get_file_type_model(file_type), arrow_table, db)
+    except INTEGRITY_ERRORS as e:
+        raise HTTPException(status_code=400, detail=get_integrity_error_detail(e))
+
+    if not upserted:
+        ingest_errors.inc(file_type=file_type, stage="load")
+        raise HTTPException(
+            status_code=500,
+            detail="The file could not be loaded into the database"
+        )
+
+    if upserted["inserted"] or upserted["updated"]:
+        # The cached reports were computed with the previous data
+        generation = report_cache.bump_generation()
+
+        if ANALYTICS_ENGINE:
+            # The snapshot of the reports of this worker gets the committed rows without reloading it, with the
+            # columns decoded and cast as they were copied
+            from .analytics import analytics_engine
+            model = get_file_type_model(file_type)
+            analytics_engine.apply_upload(
+                file_type, prepare_arrow_table_for_copy(model.__table__, arrow_table).to_pandas(), generation
+            )
+    ingest_rows.inc(arrow_table.num_rows, file_type=file_type)
+    ingest_seconds.inc(time.perf_counter() - start, file_type=file_type)
+
+    return {"rows": arrow_table.num_rows, **upserted, "format": file_format}
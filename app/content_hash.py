@@ -0,0 +1,84 @@
+from fastapi import UploadFile
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import hashlib
+from .db_models import IngestedFiles
+
+# Number of bytes hashed at once
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def compute_file_sha256(file) -> str:
+    """
+    Hash the content of a binary file block by block and rewind it for the ingestion.
+    Params:
+    file: A seekable binary file, e.g. the file of an UploadFile.
+    """
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+        sha256.update(block)
+    file.seek(0)
+
+    return sha256.hexdigest()
+
+def get_ingested_file_rows(db: Session, file_type: str, sha256: str):
+    """
+    Get the rows of the last file ingested of a file_type when it has the same content as the file.
+
+    Returns:
+    int: The rows of the last file ingested, None if it's another file.
+    """
+    rows = db.execute(
+        select(IngestedFiles.rows).where(IngestedFiles.file_type == file_type, IngestedFiles.sha256 == sha256)
+    ).scalar()
+    # Don't keep the transaction of the lookup open during the ingestion
+    db.rollback()
+
+    return rows
+
+def record_ingested_file(db: Session, file_type: str, sha256: str, rows: int):
+    """
+    Store the hash of the last file ingested of a file_type, once all its rows are committed.
+    """
+    stmt = insert(IngestedFiles).values(file_type=file_type, sha256=sha256, rows=rows)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[IngestedFiles.file_type],
+            set_={"sha256": stmt.excluded.sha256, "rows": stmt.excluded.rows, "ingested_at": func.now()}
+        )
+    )
+    db.commit()
+
+def ingest_if_changed(file_type: str, file: UploadFile, db: Session, ingest, *args, force: bool = False) -> dict:
+    """
+    Ingest an uploaded file unless it's identical to the last file ingested of its file_type.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    file (UploadFile): The file uploaded by the user.
+    db (Session): The database session.
+    ingest (callable): The ingestion function, called with the file_type, the file, the session and args,
+        returning the rows and the number of records inserted, updated and unchanged.
+    force (bool): Ingest the file even if it's identical to the last one.
+
+    Returns:
+    dict: The result of the ingestion, or the rows of the file as unchanged when it's skipped.
+    """
+    sha256 = compute_file_sha256(file.file)
+
+    if not force:
+        rows = get_ingested_file_rows(db, file_type, sha256)
+        if rows is not None:
+            return {"skipped": True, "sha256": sha256, "rows": rows, "inserted": 0, "updated": 0, "unchanged": rows}
+
+    result = ingest(file_type, file, db, *args)
+    record_ingested_file(db, file_type, sha256, result["rows"])
+
+    return {"skipped": False, "sha256": sha256, **result}
+
+def get_upload_message(result: dict) -> str:
+    if result["skipped"]:
+        return "File already ingested, skipped"
+
+    return "File uploaded correctly"
@@ -0,0 +1,170 @@
+from sqlalchemy import Table, Column, MetaData, Integer, select
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert
+from contextlib import nullcontext
+from .db_models import (
+    Employees,
+    maintain_hiring_summary,
+    values_changed,
+    execute_counting_upsert,
+    execute_replacing_upsert,
+    get_upsert_counts
+)
+from .partitions import EMPLOYEES_PARTITIONED, create_staged_year_partitions
+import pandas as pd
+import psycopg2
+import io
+
+# Number of rows serialized and sent in each COPY statement
+COPY_ROWS_PER_STATEMENT = 100000
+
+
+def get_staging_table(table: Table, name: str = None, schema: str = None) -> Table:
+    """
+    Build the description of the staging table used to load a table with COPY.
+    Params:
+    table (Table): The target table of the load.
+    name (str): Name of the staging table, staging_<table name> by default.
+    schema (str): Schema of the staging table, None for the temporary tables (they live in their own schema).
+
+    Returns:
+    Table: A table with the same columns as the target table.
+    """
+    return Table(
+        name or "staging_{}".format(table.name),
+        MetaData(),
+        *[Column(column.name, column.type) for column in table.columns],
+        schema=schema
+    )
+
+def prepare_dataframe_for_copy(table: Table, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Order the columns as the table and cast the integer columns to nullable integers,
+    otherwise columns containing nulls are written as floats ('1.0') and rejected by COPY.
+    Params:
+    table (Table): The target table of the load.
+    df (pd.DataFrame): The validated content of the uploaded file.
+    """
+    df = df[[column.name for column in table.columns]].copy()
+    for column in table.columns:
+        if isinstance(column.type, Integer):
+            df[column.name] = df[column.name].astype('Int64')
+
+    return df
+
+def copy_dataframe_to_table(cursor, table_name: str, df: pd.DataFrame):
+    """
+    Stream the DataFrame rows into a table using COPY FROM STDIN, serializing at most
+    COPY_ROWS_PER_STATEMENT rows at a time to keep the CSV buffer small.
+    Params:
+    cursor: A DBAPI (psycopg2) cursor.
+    table_name (str): Name of the table receiving the rows.
+    df (pd.DataFrame): The rows to copy, with the columns in the table order.
+    """
+    copy_sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        table_name,
+        ", ".join(df.columns)
+    )
+
+    for start in range(0, len(df), COPY_ROWS_PER_STATEMENT):
+        buffer = io.StringIO()
+        df.iloc[start:start + COPY_ROWS_PER_STATEMENT].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+def create_temp_staging_table(cursor, table: Table, staging_table: Table):
+    """
+    Create the temporary staging table of a load in the current transaction of the cursor.
+    The staging table is dropped with the transaction, it's truncated in case it was already used in it.
+    """
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP".format(
+            staging_table.name,
+            table.fullname
+        )
+    )
+    cursor.execute("TRUNCATE {}".format(staging_table.name))
+
+def merge_staging_table(model, staging_table: Table, db: Session):
+    """
+    Upsert the rows of a staging table into the table of the model with a single set-based statement
+    based on the primary key, keeping the hiring summary up to date when loading employees.
+    Only the rows whose values changed are updated. The changes are left uncommitted.
+    Params:
+    model: The ORM model of the target table (Employees, Jobs or Departments).
+    staging_table (Table): The staging table with the loaded rows.
+    db (Session): The database session.
+
+    Returns:
+    tuple: The number of rows inserted and updated.
+    """
+    table = model.__table__
+
+    stmt = insert(table).from_select(
+        [column.name for column in table.columns],
+        select(staging_table)
+    )
+    on_conflict_stmt = stmt.on_conflict_do_update(
+        constraint="{}_pkey".format(table.name),
+        set_={
+            column.name: stmt.excluded[column.name]
+            for column in table.columns if not column.primary_key
+        },
+        where=values_changed(table, stmt.excluded)
+    )
+    if model is Employees:
+        # Keep the hiring summary up to date with the staged employees
+        maintain_summary = maintain_hiring_summary(Employees.id.in_(select(staging_table.c.id)), db)
+    else:
+        maintain_summary = nullcontext()
+
+    if model is Employees and EMPLOYEES_PARTITIONED:
+        with maintain_summary:
+            # Create the partitions of the new hire years, the partitioned table can't be upserted with ON CONFLICT
+            create_staged_year_partitions(db, staging_table)
+            return execute_replacing_upsert(table, staging_table, db)
+
+    with maintain_summary:
+        return execute_counting_upsert(on_conflict_stmt, db)
+
+def copy_upsert_dataframe(model, df: pd.DataFrame, db: Session, commit: bool = True):
+    """
+    Create or update the records of a model using COPY. The rows are streamed into a temporary
+    staging table and then merged into the target table with a single set-based upsert
+    based on the primary key.
+    Params:
+    model: The ORM model of the target table (Employees, Jobs or Departments).
+    df (pd.DataFrame): The validated content of the uploaded file.
+    db (Session): The database session.
+    commit (bool): Commit the records, otherwise they are left in the transaction of the caller
+        and the database errors are raised instead of rolled back.
+
+    Returns:
+    dict: The number of records inserted, updated and unchanged once committed, None if the upsert was rolled back.
+        The IntegrityError of the rows violating a constraint is raised once rolled back.
+    """
+    table = model.__table__
+    staging_table = get_staging_table(table)
+
+    try:
+        cursor = db.connection().connection.cursor()
+        create_temp_staging_table(cursor, table, staging_table)
+
+        copy_dataframe_to_table(cursor, staging_table.name, prepare_dataframe_for_copy(table, df))
+
+        # Merge the staging table into the target table
+        inserted, updated = merge_staging_table(model, staging_table, db)
+        if commit:
+            db.commit()
+
+    except (SQLAlchemyError, psycopg2.Error) as e:
+        if not commit:
+            raise
+        db.rollback()
+        # The rows violating a constraint are an error of the upload, reported by the caller
+        if isinstance(e, (IntegrityError, psycopg2.IntegrityError)):
+            raise
+        return None
+
+    return get_upsert_counts(len(df), inserted, updated)
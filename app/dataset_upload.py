@@ -0,0 +1,222 @@
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+import asyncio
+import os
+import psycopg2
+import time
+import zipfile
+from .upload_params import get_upload_file_format, get_upload_compression
+from .ingestion import (
+    read_and_validate_csv,
+    run_in_ingest_executor,
+    ingestion_stage,
+    INTEGRITY_ERRORS,
+    get_integrity_error_detail
+)
+from .loaders import bulk_upsert_data_to_db
+from .content_hash import compute_file_sha256, record_ingested_file
+from .report_cache import report_cache
+from .database import ANALYTICS_ENGINE
+from .metrics import ingest_rows, ingest_seconds, ingest_errors
+
+# The file types of a dataset in the order they are loaded, the employees reference the departments and jobs
+DATASET_FILE_TYPES = ("departments", "jobs", "employees")
+
+
+def get_dataset_file_type(filename: str):
+    """
+    Get the file_type of a .csv file (optionally compressed) of a dataset from its name, which must end with
+    the file_type (e.g. departments.csv, hired_employees.csv.gz). None if it isn't a file of the dataset.
+    """
+    name = os.path.basename(filename)
+    if get_upload_file_format(name) != 'csv':
+        return None
+
+    # Remove the extensions of the file and of its compression
+    if get_upload_compression(name) is not None:
+        name = os.path.splitext(name)[0]
+    name = os.path.splitext(name)[0]
+
+    for file_type in DATASET_FILE_TYPES:
+        if name.lower().endswith(file_type):
+            return file_type
+
+    return None
+
+def open_dataset_zip(file: UploadFile) -> dict:
+    """
+    Open the .csv files of a dataset uploaded as a zip file.
+    Params:
+    file (UploadFile): The .zip file uploaded by the user.
+
+    Returns:
+    dict: An UploadFile reading the member of each file_type found in the zip file.
+    """
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(
+            status_code=400,
+            detail="The dataset provided is not a valid zip file!"
+        )
+
+    files = {}
+    for member in archive.infolist():
+        file_type = None if member.is_dir() else get_dataset_file_type(member.filename)
+        if file_type is None:
+            continue
+
+        if file_type in files:
+            raise HTTPException(
+                status_code=400,
+                detail="The dataset contains more than one {} file".format(file_type)
+            )
+        files[file_type] = UploadFile(archive.open(member), filename=member.filename)
+
+    return files
+
+def validate_dataset_files(files: dict):
+    """
+    Validate a dataset contains at least one file, every file of a multipart upload must be a .csv file,
+    optionally compressed.
+    """
+    if not files:
+        raise HTTPException(
+            status_code=400,
+            detail="The dataset must contain a departments, jobs or employees .csv file!"
+        )
+
+    for file_type, file in files.items():
+        if get_upload_file_format(file.filename) != 'csv':
+            raise HTTPException(
+                status_code=400,
+                detail="The {} file format is not allowed, please use CSV (.csv, .csv.gz or .csv.zst) files!".format(file_type)
+            )
+
+def read_dataset_file(file_type: str, file: UploadFile) -> tuple:
+    """
+    Hash, read and validate a file of a dataset.
+
+    Returns:
+    tuple: The validated DataFrame and the SHA-256 of the file.
+    """
+    sha256 = compute_file_sha256(file.file)
+
+    return read_and_validate_csv(file_type, file), sha256
+
+async def read_dataset_files(files: dict) -> dict:
+    """
+    Read and validate the files of a dataset concurrently in the ingestion executor.
+    Every file is validated, the validation errors of every failed file are reported together.
+
+    Returns:
+    dict: The validated DataFrame and the SHA-256 of each file_type.
+    """
+    file_types = list(files)
+    results = await asyncio.gather(
+        *[run_in_ingest_executor(read_dataset_file, file_type, files[file_type]) for file_type in file_types],
+        return_exceptions=True
+    )
+
+    errors = {}
+    for file_type, result in zip(file_types, results):
+        if isinstance(result, HTTPException):
+            errors[file_type] = result.detail
+        elif isinstance(result, BaseException):
+            raise result
+
+    if errors:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "status": "Upload Failure",
+                "files": errors
+            }
+        )
+
+    return dict(zip(file_types, results))
+
+def load_dataset(dataset: dict, db: Session, loader: str = 'insert') -> dict:
+    """
+    Upsert the validated files of a dataset in foreign key order within a single transaction.
+    The foreign keys of the employees are checked on the commit, so either every file is loaded or none of them.
+    Params:
+    dataset (dict): The validated DataFrame and the SHA-256 of each file_type.
+    db (Session): The database session.
+    loader (str): Strategy used to load the rows, 'insert' or 'copy'.
+
+    Returns:
+    dict: The rows and the number of records inserted, updated and unchanged of each file_type.
+    """
+    start = time.perf_counter()
+    results = {}
+    file_type = None
+
+    try:
+        db.execute(text("SET CONSTRAINTS ALL DEFERRED"))
+
+        for file_type in DATASET_FILE_TYPES:
+            if file_type not in dataset:
+                continue
+
+            df, sha256 = dataset[file_type]
+            with ingestion_stage(file_type, "load"):
+                counts = bulk_upsert_data_to_db(file_type, db, df, loader, commit=False)
+            results[file_type] = {"rows": len(df), **counts}
+
+        # The deferred foreign keys are checked by the commit, its errors are counted for the last file loaded
+        db.commit()
+
+    except INTEGRITY_ERRORS as e:
+        db.rollback()
+        ingest_errors.inc(file_type=file_type, stage="load")
+        raise HTTPException(
+            status_code=400,
+            detail=get_integrity_error_detail(e, "The dataset doesn't satisfy the references between the files!")
+        )
+
+    except (SQLAlchemyError, psycopg2.Error):
+        db.rollback()
+        ingest_errors.inc(file_type=file_type, stage="load")
+        raise HTTPException(
+            status_code=500,
+            detail="The dataset could not be loaded into the database"
+        )
+
+    for file_type, result in results.items():
+        if not (result["inserted"] or result["updated"]):
+            continue
+
+        # The cached reports were computed with the previous data, each changed file starts a generation
+        generation = report_cache.bump_generation()
+
+        if ANALYTICS_ENGINE:
+            # The snapshot of the reports of this worker gets the committed rows in foreign key order without reloading it
+            from .analytics import analytics_engine
+            analytics_engine.apply_upload(file_type, dataset[file_type][0], generation)
+
+    # The seconds of the transaction are split between the files by their rows
+    seconds = time.perf_counter() - start
+    total_rows = sum(result["rows"] for result in results.values())
+    for file_type, result in results.items():
+        ingest_rows.inc(result["rows"], file_type=file_type)
+        ingest_seconds.inc(seconds * result["rows"] / total_rows, file_type=file_type)
+
+        # The files of the dataset are the last ingested of their file_type
+        record_ingested_file(db, file_type, dataset[file_type][1], result["rows"])
+
+    return results
+
+async def ingest_dataset(files: dict, db: Session, loader: str = 'insert') -> dict:
+    """
+    Read and validate the files of a dataset concurrently, then load them with a single commit.
+    Params:
+    files (dict): The UploadFile of each file_type of the dataset.
+    db (Session): The database session.
+    loader (str): Strategy used to load the rows, 'insert' or 'copy'.
+    """
+    dataset = await read_dataset_files(files)
+
+    return await run_in_ingest_executor(load_dataset, dataset, db, loader)
@@ -1,8 +1,135 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, UniqueConstraint, Boolean
+from sqlalchemy import select, update, delete, func, extract, cast, any_, bindparam, literal_column, tuple_
+from sqlalchemy import values, column, exists, Sequence
 from sqlalchemy.orm import Session
 from .database import Base
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert, ARRAY, JSONB
+from contextlib import contextmanager
+from itertools import islice
+from datetime import timezone
+from .partitions import EMPLOYEES_PARTITIONED, create_year_partitions
+
+# PostgreSQL accepts at most 65535 bind parameters in a single statement
+MAX_BIND_PARAMETERS = 65535
+
+# Key of the advisory lock serializing the upserts of the employees, which maintain the hiring summary
+EMPLOYEES_UPSERT_LOCK_KEY = "challenge_app.employees upserts"
+
+
+def batched_records(records, columns_count: int):
+    """
+    Split the records into batches small enough to fit in a single INSERT statement.
+    Parameters:
+        records (iterable): The dictionaries to be inserted, consumed lazily.
+        columns_count (int): Number of columns bound for each record.
+
+    Yields: Lists of records with at most MAX_BIND_PARAMETERS bind parameters each.
+    """
+    batch_size = max(MAX_BIND_PARAMETERS // columns_count, 1)
+    iterator = iter(records)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+def values_changed(table, excluded):
+    """
+    Condition of the ON CONFLICT DO UPDATE of an upsert, true only for the rows whose values differ
+    from the proposed ones, so the unchanged rows aren't rewritten.
+    Parameters:
+        table (Table): The target table of the upsert.
+        excluded: The excluded columns of the insert statement.
+    """
+    columns = [column for column in table.columns if not column.primary_key]
+
+    return tuple_(*columns).is_distinct_from(tuple_(*[excluded[column.name] for column in columns]))
+
+def execute_counting_upsert(on_conflict_stmt, db) -> tuple:
+    """
+    Execute an upsert counting the rows it inserted and updated, the rows skipped by the condition
+    of the update aren't returned. The xmax system column of a freshly inserted row is 0.
+    Parameters:
+        on_conflict_stmt: The INSERT ... ON CONFLICT DO UPDATE statement.
+        db (Session or Connection): The database session.
+
+    Returns:
+        tuple: The number of rows inserted and updated.
+    """
+    upserted = on_conflict_stmt.returning(literal_column("xmax = 0", Boolean).label("inserted")).cte("upserted")
+
+    return tuple(db.execute(select(
+        func.count().filter(upserted.c.inserted),
+        func.count().filter(~upserted.c.inserted)
+    )).one())
+
+def get_records_values(table, records: list):
+    """
+    VALUES list of records with the columns of a table, the incoming rows of a replacing upsert.
+    The values are cast to the types of the columns, a column of nulls would be typed as text.
+    """
+    records_values = values(
+        *[column(table_column.name, table_column.type) for table_column in table.columns],
+        name="records"
+    ).data([tuple(record[table_column.name] for table_column in table.columns) for record in records])
+
+    return select(*[
+        cast(records_values.c[table_column.name], table_column.type).label(table_column.name)
+        for table_column in table.columns
+    ]).subquery("incoming")
+
+def lock_employees_upserts(db):
+    """
+    Serialize the upserts of the employees until the end of the transaction. The advisory lock is reentrant,
+    it must be taken before the partitions lock of the partitioned loads, always in this order.
+    Parameters:
+        db (Session or Connection): The database session.
+    """
+    db.execute(select(func.pg_advisory_xact_lock(func.hashtext(EMPLOYEES_UPSERT_LOCK_KEY))))
+
+def execute_replacing_upsert(table, incoming, db) -> tuple:
+    """
+    Upsert the rows of a partitioned table, whose primary key can't be used by ON CONFLICT as it doesn't contain
+    the partition key: the rows whose values differ from the incoming ones are deleted, then the incoming rows
+    whose id isn't in the table are inserted, into the partition of their new values.
+    Two concurrent upserts of a new id would both insert it, as no unique constraint rejects the second one,
+    so the upserts hold the lock of lock_employees_upserts (already held when the hiring summary is maintained),
+    and the incoming rows repeating an id are rejected with an IntegrityError, as ON CONFLICT rejects them.
+    Parameters:
+        table (Table): The target table of the upsert.
+        incoming: A selectable with the incoming rows and the columns of the table.
+        db (Session or Connection): The database session.
+
+    Returns:
+        tuple: The number of rows inserted and updated.
+    """
+    lock_employees_upserts(db)
+
+    # Both rows of a repeated id would be inserted and counted in the hiring summary
+    repeated_id = db.execute(
+        select(incoming.c.id).group_by(incoming.c.id).having(func.count() > 1).limit(1)
+    ).scalar()
+    if repeated_id is not None:
+        raise IntegrityError(
+            None, None, ValueError("The id {} is repeated in the rows of {}".format(repeated_id, table.name))
+        )
+
+    deleted = db.execute(
+        delete(table).where(table.c.id == incoming.c.id, values_changed(table, incoming.c))
+    ).rowcount
+    written = db.execute(
+        insert(table).from_select(
+            [column.name for column in table.columns],
+            select(*[incoming.c[column.name] for column in table.columns]).where(
+                ~exists().where(table.c.id == incoming.c.id)
+            )
+        )
+    ).rowcount
+
+    return written - deleted, deleted
+
+def get_upsert_counts(rows: int, inserted: int, updated: int) -> dict:
+    return {"inserted": inserted, "updated": updated, "unchanged": rows - inserted - updated}
 
 
 class Employees(Base):
@@ -10,34 +137,82 @@ class Employees(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    datetime = Column(String)
-    department_id = Column(Integer, ForeignKey("departments.id"), nullable=True)
-    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=True)
+    datetime = Column(DateTime(timezone=True))
+    # The foreign keys can be deferred to the commit of a transaction loading the departments, jobs and employees
+    department_id = Column(Integer, ForeignKey("departments.id", deferrable=True, initially="IMMEDIATE"), nullable=True)
+    job_id = Column(Integer, ForeignKey("jobs.id", deferrable=True, initially="IMMEDIATE"), nullable=True)
+
+    __table_args__ = (
+        # Covers the aggregation of the hires by department and job (the backfill of the hiring summary)
+        # and the checks of the foreign key of the departments
+        Index("ix_employees_department_id_job_id", "department_id", "job_id", postgresql_include=["datetime"]),
+        # Supports the checks of the foreign key of the jobs
+        Index("ix_employees_job_id", "job_id"),
+    )
 
-    def create_employees(cls, employees: list, db: Session):
+    def create_employees(cls, employees: list, db: Session, commit: bool = True):
         """
         Create or update employees records in the database .
         This function performs an "upsert" operation (insert or update) based on the employees's primary key.
         Parameters:
-            employees (list): A list of dictionaries representing employees to be inserted or updated.
+            employees (iterable): The dictionaries representing employees to be inserted or updated, consumed lazily.
             db (Session): The database session.
+            commit (bool): Commit the records, otherwise they are left in the transaction of the caller
+                and the database errors are raised instead of rolled back.
+
+        Returns:
+            dict: The number of records inserted, updated and unchanged once committed, None if the upsert was rolled back.
+                The IntegrityError of the records violating a constraint is raised once rolled back.
         """
+        rows = inserted = updated = 0
         try:
-            stmt = insert(Employees).values(employees)
-            on_conflict_stmt = stmt.on_conflict_do_update(
-                constraint="employees_pkey",
-                set_={
-                    "name": stmt.excluded.name,
-                    "datetime": stmt.excluded.datetime,
-                    "department_id": stmt.excluded.department_id,
-                    "job_id": stmt.excluded.job_id
-                }
-            )
-            db.execute(on_conflict_stmt)
-            db.commit()
+            for batch in batched_records(employees, len(Employees.__table__.columns)):
+                employee_ids = bindparam("employee_ids", [record["id"] for record in batch], type_=ARRAY(Integer))
+                if EMPLOYEES_PARTITIONED:
+                    with maintain_hiring_summary(Employees.id == any_(employee_ids), db):
+                        # Create the partitions of the new hire years before loading their employees
+                        create_year_partitions(db, {
+                            record["datetime"].astimezone(timezone.utc).year
+                            for record in batch if record["datetime"] is not None
+                        })
+                        batch_inserted, batch_updated = execute_replacing_upsert(
+                            Employees.__table__, get_records_values(Employees.__table__, batch), db
+                        )
+                    rows += len(batch)
+                    inserted += batch_inserted
+                    updated += batch_updated
+                    continue
+
+                stmt = insert(Employees).values(batch)
+                on_conflict_stmt = stmt.on_conflict_do_update(
+                    constraint="employees_pkey",
+                    set_={
+                        "name": stmt.excluded.name,
+                        "datetime": stmt.excluded.datetime,
+                        "department_id": stmt.excluded.department_id,
+                        "job_id": stmt.excluded.job_id
+                    },
+                    # Only rewrite the employees that changed
+                    where=values_changed(Employees.__table__, stmt.excluded)
+                )
+                with maintain_hiring_summary(Employees.id == any_(employee_ids), db):
+                    batch_inserted, batch_updated = execute_counting_upsert(on_conflict_stmt, db)
+                rows += len(batch)
+                inserted += batch_inserted
+                updated += batch_updated
+            if commit:
+                db.commit()
 
         except SQLAlchemyError as e:
+            if not commit:
+                raise
             db.rollback()
+            # The records violating a constraint are an error of the upload, reported by the caller
+            if isinstance(e, IntegrityError):
+                raise
+            return None
+
+        return get_upsert_counts(rows, inserted, updated)
 
 class Jobs(Base):
     __tablename__ = "jobs"
@@ -45,27 +220,48 @@ class Jobs(Base):
     id = Column(Integer, primary_key=True)
     job = Column(String)
 
-    def create_jobs(cls, jobs: list, db: Session):
+    def create_jobs(cls, jobs: list, db: Session, commit: bool = True):
         """
         Create or update jobs records in the database .
         This function performs an "upsert" operation (insert or update) based on the job's primary key.
         Parameters:
-            jobs (list): A list of dictionaries representing jobs to be inserted or updated.
+            jobs (iterable): The dictionaries representing jobs to be inserted or updated, consumed lazily.
             db (Session): The database session.
+            commit (bool): Commit the records, otherwise they are left in the transaction of the caller
+                and the database errors are raised instead of rolled back.
+
+        Returns:
+            dict: The number of records inserted, updated and unchanged once committed, None if the upsert was rolled back.
+                The IntegrityError of the records violating a constraint is raised once rolled back.
         """
+        rows = inserted = updated = 0
         try:
-            stmt = insert(Jobs).values(jobs)
-            on_conflict_stmt = stmt.on_conflict_do_update(
-                constraint="jobs_pkey",
-                set_={
-                    "job": stmt.excluded.job,
-                }
-            )
-            db.execute(on_conflict_stmt)
-            db.commit()
+            for batch in batched_records(jobs, len(Jobs.__table__.columns)):
+                stmt = insert(Jobs).values(batch)
+                on_conflict_stmt = stmt.on_conflict_do_update(
+                    constraint="jobs_pkey",
+                    set_={
+                        "job": stmt.excluded.job,
+                    },
+                    where=values_changed(Jobs.__table__, stmt.excluded)
+                )
+                batch_inserted, batch_updated = execute_counting_upsert(on_conflict_stmt, db)
+                rows += len(batch)
+                inserted += batch_inserted
+                updated += batch_updated
+            if commit:
+                db.commit()
 
         except SQLAlchemyError as e:
+            if not commit:
+                raise
             db.rollback()
+            # The records violating a constraint are an error of the upload, reported by the caller
+            if isinstance(e, IntegrityError):
+                raise
+            return None
+
+        return get_upsert_counts(rows, inserted, updated)
 
 class Departments(Base):
     __tablename__ = "departments"
@@ -73,24 +269,177 @@ class Departments(Base):
     id = Column(Integer, primary_key=True)
     department = Column(String)
 
-    def create_departments(cls, departments: list, db: Session):
+    def create_departments(cls, departments: list, db: Session, commit: bool = True):
         """
         Create or update department records in the database .
         This function performs an "upsert" operation (insert or update) based on the department's primary key.
         Parameters:
-            departments (list): A list of dictionaries representing departments to be inserted or updated.
+            departments (iterable): The dictionaries representing departments to be inserted or updated, consumed lazily.
             db (Session): The database session.
+            commit (bool): Commit the records, otherwise they are left in the transaction of the caller
+                and the database errors are raised instead of rolled back.
+
+        Returns:
+            dict: The number of records inserted, updated and unchanged once committed, None if the upsert was rolled back.
+                The IntegrityError of the records violating a constraint is raised once rolled back.
         """
+        rows = inserted = updated = 0
         try:
-            stmt = insert(Departments).values(departments)
-            on_conflict_stmt = stmt.on_conflict_do_update(
-                constraint="departments_pkey",
-                set_={
-                    "department": stmt.excluded.department,
-                }
-            )
-            db.execute(on_conflict_stmt)
-            db.commit()
+            for batch in batched_records(departments, len(Departments.__table__.columns)):
+                stmt = insert(Departments).values(batch)
+                on_conflict_stmt = stmt.on_conflict_do_update(
+                    constraint="departments_pkey",
+                    set_={
+                        "department": stmt.excluded.department,
+                    },
+                    where=values_changed(Departments.__table__, stmt.excluded)
+                )
+                batch_inserted, batch_updated = execute_counting_upsert(on_conflict_stmt, db)
+                rows += len(batch)
+                inserted += batch_inserted
+                updated += batch_updated
+            if commit:
+                db.commit()
 
         except SQLAlchemyError as e:
+            if not commit:
+                raise
             db.rollback()
+            # The records violating a constraint are an error of the upload, reported by the caller
+            if isinstance(e, IntegrityError):
+                raise
+            return None
+
+        return get_upsert_counts(rows, inserted, updated)
+
+# Data generation of the cached reports shared by the workers, each change of the data takes its next value
+report_generation = Sequence("report_generation", metadata=Base.metadata)
+
+class IngestedFiles(Base):
+    """
+    Content hash of the last file ingested of each file_type, an upload identical to it is skipped.
+    """
+    __tablename__ = "ingested_files"
+
+    file_type = Column(String, primary_key=True)
+    sha256 = Column(String(64), nullable=False)
+    rows = Column(Integer, nullable=False)
+    ingested_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class IngestionJobs(Base):
+    """
+    Status of the uploads processed in the background, saved by the worker running the job
+    so that any worker can answer its polling.
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String(32), primary_key=True)
+    state = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class HiringSummary(Base):
+    """
+    Count of the employees hired by department, job, year and quarter, maintained on every upsert
+    of employees so the reports don't need to aggregate the employees table.
+    The keys are null for the employees without department, job or hire date.
+    """
+    __tablename__ = "hiring_summary"
+
+    id = Column(Integer, primary_key=True)
+    department_id = Column(Integer, nullable=True)
+    job_id = Column(Integer, nullable=True)
+    year = Column(Integer, nullable=True)
+    quarter = Column(Integer, nullable=True)
+    hired = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "department_id", "job_id", "year", "quarter",
+            name="hiring_summary_key",
+            postgresql_nulls_not_distinct=True
+        ),
+        # Covers the reports filtering the years: they are answered by an index only scan
+        Index("ix_hiring_summary_year", "year", postgresql_include=["department_id", "job_id", "quarter", "hired"]),
+    )
+
+def select_hires_by_summary_key(employees_filter):
+    """
+    Aggregate the employees matching a filter by the keys of the hiring summary.
+    The hire dates are grouped in UTC, as they were uploaded.
+    Parameters:
+        employees_filter: SQL expression selecting the employees to aggregate.
+    """
+    hire_date = func.timezone(literal_column("'UTC'"), Employees.datetime)
+    year = cast(extract("year", hire_date), Integer).label("year")
+    quarter = cast(extract("quarter", hire_date), Integer).label("quarter")
+
+    return select(
+        Employees.department_id,
+        Employees.job_id,
+        year,
+        quarter,
+        func.count().label("hired")
+    ).where(
+        employees_filter
+    ).group_by(
+        Employees.department_id, Employees.job_id, year, quarter
+    )
+
+def add_hires_to_summary(hires, db):
+    """
+    Add the hires aggregated by select_hires_by_summary_key to the hiring summary.
+    Parameters:
+        hires: The select statement with the aggregated hires.
+        db (Session or Connection): The database session.
+    """
+    stmt = insert(HiringSummary).from_select(
+        ["department_id", "job_id", "year", "quarter", "hired"],
+        hires
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            constraint="hiring_summary_key",
+            set_={"hired": HiringSummary.hired + stmt.excluded.hired}
+        )
+    )
+
+def subtract_hires_from_summary(hires, db):
+    """
+    Subtract the hires aggregated by select_hires_by_summary_key from the hiring summary,
+    removing the keys left without hires.
+    Parameters:
+        hires: The select statement with the aggregated hires.
+        db (Session or Connection): The database session.
+    """
+    previous = hires.subquery()
+    db.execute(
+        update(HiringSummary).where(
+            HiringSummary.department_id.is_not_distinct_from(previous.c.department_id),
+            HiringSummary.job_id.is_not_distinct_from(previous.c.job_id),
+            HiringSummary.year.is_not_distinct_from(previous.c.year),
+            HiringSummary.quarter.is_not_distinct_from(previous.c.quarter)
+        ).values(hired=HiringSummary.hired - previous.c.hired)
+    )
+    db.execute(delete(HiringSummary).where(HiringSummary.hired <= 0))
+
+@contextmanager
+def maintain_hiring_summary(employees_filter, db: Session):
+    """
+    Keep the hiring summary up to date while the employees matching a filter are upserted.
+    The current hires of those employees are subtracted before the upsert and their new values added after it,
+    so the employees moving between departments, jobs or dates are counted once in their new key.
+    The upserts of the employees are serialized until the commit: a concurrent upsert of the same employees
+    would subtract their hires again, or count twice an employee inserted by both.
+    Parameters:
+        employees_filter: SQL expression selecting the upserted employees.
+        db (Session): The database session.
+    """
+    # Taken before the partitions lock of the partitioned loads, always in this order
+    lock_employees_upserts(db)
+
+    subtract_hires_from_summary(select_hires_by_summary_key(employees_filter), db)
+
+    yield
+
+    add_hires_to_summary(select_hires_by_summary_key(employees_filter), db)
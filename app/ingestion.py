@@ -0,0 +1,305 @@
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import asyncio
+import json
+import os
+import psycopg2
+import time
+from .upload_file_utils import (
+    get_file_schema,
+    read_comma_separated_no_header,
+    read_comma_separated_no_header_chunks,
+    assign_columns_no_header_file,
+    decompress_upload,
+    validate_file_content,
+    get_validation_report,
+    ValidationReport
+)
+from .upload_params import UPLOAD_CHUNK_SIZE
+from .loaders import bulk_upsert_data_to_db
+from .metrics import (
+    counting_reader,
+    ingest_stage_seconds,
+    ingest_rows,
+    ingest_seconds,
+    ingest_bytes_read,
+    ingest_errors
+)
+
+# Number of uploads parsed, validated and loaded at the same time, outside of the event loop
+INGEST_EXECUTOR_WORKERS = int(os.environ.get('INGEST_EXECUTOR_WORKERS', 4))
+
+# Executor of the CPU heavy ingestion work, separated from the threadpool serving the sync endpoints
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_EXECUTOR_WORKERS, thread_name_prefix="ingest")
+
+# Errors of the rows violating a constraint of the database, e.g. employees of a department that doesn't exist
+INTEGRITY_ERRORS = (IntegrityError, psycopg2.IntegrityError)
+
+
+async def run_in_ingest_executor(func, *args, **kwargs):
+    """
+    Run an ingestion function in the ingestion executor so the event loop never blocks on it.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ingest_executor, partial(func, *args, **kwargs))
+
+@contextmanager
+def ingestion_stage(file_type: str, stage: str):
+    """
+    Time a stage of the ingestion ('read', 'assign_columns', 'validate' or 'load') and count the uploads failing in it.
+    """
+    try:
+        with ingest_stage_seconds.time(file_type=file_type, stage=stage):
+            yield
+    except Exception:
+        ingest_errors.inc(file_type=file_type, stage=stage)
+        raise
+
+def get_integrity_error_detail(e: Exception, error_message: str = "The file doesn't satisfy the constraints of the database!") -> dict:
+    """
+    Detail of the 400 response of an upload whose rows violate a constraint, with the message of the database.
+    """
+    return {
+        "status": "Upload Failure",
+        "error_message": error_message,
+        "suggestion": str(getattr(e, "orig", e)).strip()
+    }
+
+def load_dataframe(file_type: str, db: Session, df, loader: str) -> dict:
+    """
+    Upsert the validated rows, counting the failed loads and the rows loaded.
+    The rows violating a constraint of the database fail the upload with a 400.
+
+    Returns:
+    dict: The number of records inserted, updated and unchanged.
+    """
+    try:
+        with ingestion_stage(file_type, "load"):
+            upserted = bulk_upsert_data_to_db(file_type, db, df, loader)
+    except INTEGRITY_ERRORS as e:
+        raise HTTPException(status_code=400, detail=get_integrity_error_detail(e))
+
+    if not upserted:
+        ingest_errors.inc(file_type=file_type, stage="load")
+        raise HTTPException(
+            status_code=500,
+            detail="The file could not be loaded into the database"
+        )
+
+    ingest_rows.inc(len(df), file_type=file_type)
+
+    return upserted
+
+def add_upsert_counts(total: dict, counts: dict):
+    for key in ("inserted", "updated", "unchanged"):
+        total[key] += counts[key]
+
+def count_bytes_read(file_type: str, file: UploadFile) -> UploadFile:
+    """
+    Wrap the uploaded file so the bytes read from it are counted by the metrics,
+    the bytes of the compressed files are counted before decompressing them.
+    """
+    return UploadFile(
+        counting_reader(file.file, partial(ingest_bytes_read.inc, file_type=file_type)),
+        filename=file.filename
+    )
+
+def read_and_validate_csv(file_type: str, file: UploadFile):
+    """
+    Read and validate a whole comma separated file without headers.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    file (UploadFile): The .csv file uploaded by the user.
+
+    Returns:
+    pd.DataFrame: The validated content of the file.
+    """
+    # Get the schema with the restrictions for the file
+    schema = get_file_schema(file_type)
+    
+    # Read a comma separated file without headers
+    with ingestion_stage(file_type, "read"):
+        df = read_comma_separated_no_header(decompress_upload(count_bytes_read(file_type, file)))
+
+    # Add column names for a file without headers
+    with ingestion_stage(file_type, "assign_columns"):
+        assign_columns_no_header_file(df, schema)
+
+    # Validate file content based on the restrictions defined in the schema configuration
+    with ingestion_stage(file_type, "validate"):
+        validate_file_content(schema, df)
+
+    return df
+
+def ingest_csv(file_type: str, file: UploadFile, db: Session, loader: str = 'insert') -> dict:
+    """
+    Read, validate and upsert a whole comma separated file without headers.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    file (UploadFile): The .csv file uploaded by the user.
+    db (Session): The database session.
+    loader (str): Strategy used to load the rows, 'insert' or 'copy'.
+
+    Returns:
+    dict: The rows of the file and the number of records inserted, updated and unchanged.
+    """
+    start = time.perf_counter()
+
+    df = read_and_validate_csv(file_type, file)
+
+    # Load the file content into SQL
+    counts = load_dataframe(file_type, db, df, loader)
+
+    ingest_seconds.inc(time.perf_counter() - start, file_type=file_type)
+
+    return {"rows": len(df), **counts}
+
+
+def ingest_csv_in_chunks(
+    file_type: str,
+    file: UploadFile,
+    db: Session,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    loader: str = 'insert',
+    progress=None
+) -> dict:
+    """
+    Read, validate and upsert a comma separated file without headers chunk by chunk,
+    the memory used stays bounded by chunk_size regardless of the size of the file.
+    Every chunk is committed once loaded, if a chunk fails the validation the previous ones remain loaded
+    and the error reports how many rows were loaded before the failure.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    file (UploadFile): The .csv file uploaded by the user.
+    db (Session): The database session.
+    chunk_size (int): Number of rows processed in each chunk.
+    loader (str): Strategy used to load the rows, 'insert' or 'copy'.
+    progress (callable): Optional function called with the stage ('parsing', 'validating' or 'loading')
+        and the rows loaded so far every time the processing of a chunk moves to another stage.
+
+    Returns:
+    dict: The progress of every chunk, the total of rows loaded and of records inserted, updated and unchanged.
+    """
+    schema = get_file_schema(file_type)
+
+    chunks = []
+    rows_loaded = 0
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0}
+    start = time.perf_counter()
+
+    def report(stage: str):
+        if progress is not None:
+            progress(stage, rows_loaded)
+
+    try:
+        report("parsing")
+        reader = read_comma_separated_no_header_chunks(decompress_upload(count_bytes_read(file_type, file)), chunk_size)
+        chunk_number = 0
+
+        while True:
+            # Read the next chunk, the time spent parsing it is part of the read stage
+            with ingestion_stage(file_type, "read"):
+                df = next(reader, None)
+            if df is None:
+                break
+            chunk_number += 1
+
+            report("validating")
+
+            # Add column names for a file without headers
+            with ingestion_stage(file_type, "assign_columns"):
+                assign_columns_no_header_file(df, schema)
+
+            # Validate the chunk content based on the restrictions defined in the schema configuration
+            with ingestion_stage(file_type, "validate"):
+                validate_file_content(schema, df)
+
+            report("loading")
+
+            # Load the chunk content into SQL
+            counts = load_dataframe(file_type, db, df, loader)
+
+            rows_loaded += len(df)
+            add_upsert_counts(totals, counts)
+            chunks.append({
+                "chunk": chunk_number,
+                "rows": len(df),
+                "rows_loaded": rows_loaded,
+                **counts
+            })
+
+            report("parsing")
+
+    except HTTPException as e:
+        if isinstance(e.detail, dict):
+            e.detail["rows_loaded"] = rows_loaded
+        raise
+
+    finally:
+        ingest_seconds.inc(time.perf_counter() - start, file_type=file_type)
+
+    return {
+        "rows": rows_loaded,
+        **totals,
+        "chunk_size": chunk_size,
+        "chunks": chunks
+    }
+
+
+def iter_dry_run_report(file_type: str, file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Validate a comma separated file without headers chunk by chunk without loading it, yielding the
+    full validation report as NDJSON: a line with the row, column and message of every error, then a line
+    with the summary of the errors of every column. The errors stopping the reading of the file
+    after the first chunk are reported as a last line with its error.
+    Params:
+    file_type (str): Type of the file being validated.
+    file (UploadFile): The .csv file uploaded by the user.
+    chunk_size (int): Number of rows validated in each chunk.
+
+    Yields: The NDJSON lines of the errors of each chunk, then the summary line.
+    """
+    schema = get_file_schema(file_type)
+
+    # Only the counts and the summaries of the whole file are kept, the errors are streamed chunk by chunk
+    total = ValidationReport(max_errors=0)
+    rows = 0
+    reader = read_comma_separated_no_header_chunks(decompress_upload(count_bytes_read(file_type, file)), chunk_size)
+
+    while True:
+        try:
+            with ingestion_stage(file_type, "read"):
+                df = next(reader, None)
+            if df is None:
+                break
+
+            with ingestion_stage(file_type, "assign_columns"):
+                assign_columns_no_header_file(df, schema)
+
+            with ingestion_stage(file_type, "validate"):
+                report = get_validation_report(schema, df, max_errors=None)
+
+        except HTTPException as e:
+            # The status of the response was already sent with the first chunk
+            if rows == 0:
+                raise
+            yield json.dumps({"error": e.detail, "rows_validated": rows}) + "\n"
+            return
+
+        # The index of the chunks continues the rows of the previous ones
+        total.extend(report)
+        rows += len(df)
+        yield "".join(json.dumps(error) + "\n" for error in report.detail()["content_validation_error"])
+
+    yield json.dumps({
+        "summary": {
+            "rows": rows,
+            "valid": total.error_count == 0,
+            "error_count": total.error_count,
+            "column_summaries": list(total.summaries.values())
+        }
+    }) + "\n"
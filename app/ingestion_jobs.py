@@ -0,0 +1,239 @@
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from .database import SessionLocal
+from .db_models import IngestionJobs
+from .ingestion import ingest_csv_in_chunks
+from .content_hash import ingest_if_changed
+
+# Number of background ingestion jobs processed at the same time
+INGEST_JOB_WORKERS = int(os.environ.get('INGEST_JOB_WORKERS', 2))
+
+# Maximum number of background ingestion jobs waiting or running, further uploads are rejected
+INGEST_JOB_QUEUE_SIZE = int(os.environ.get('INGEST_JOB_QUEUE_SIZE', 20))
+
+# Number of finished jobs whose status is kept
+INGEST_JOB_HISTORY = int(os.environ.get('INGEST_JOB_HISTORY', 1000))
+
+# Minimum seconds between the saves of the progress of a running job, its status changes are always saved
+INGEST_JOB_SAVE_SECONDS = float(os.environ.get('INGEST_JOB_SAVE_SECONDS', 1))
+
+# Directory where the uploads are spooled until they are processed, the system temporary directory by default
+INGEST_SPOOL_DIR = os.environ.get('INGEST_SPOOL_DIR')
+
+
+class IngestionJob:
+    """
+    Status of an upload processed in the background.
+    """
+
+    def __init__(self, file_type: str, filename: str, path: str, chunk_size: int, loader: str, force: bool = False):
+        self.id = uuid.uuid4().hex
+        self.file_type = file_type
+        self.filename = filename
+        self.path = path
+        self.chunk_size = chunk_size
+        self.loader = loader
+        self.force = force
+        self.status = "queued"
+        self.stage = "queued"
+        self.rows_processed = 0
+        self.created_at = time.time()
+        self.saved_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.errors = None
+        self.result = None
+
+    def update_progress(self, stage: str, rows_processed: int):
+        self.stage = stage
+        self.rows_processed = rows_processed
+
+    def to_dict(self) -> dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        return {
+            "job_id": self.id,
+            "file_type": self.file_type,
+            "filename": self.filename,
+            "loader": self.loader,
+            "status": self.status,
+            "stage": self.stage,
+            "rows_processed": self.rows_processed,
+            "elapsed_seconds": elapsed,
+            "rows_per_second": self.rows_processed / elapsed if elapsed else None,
+            "errors": self.errors,
+            "result": self.result
+        }
+
+def to_timestamp(seconds: float):
+    return datetime.fromtimestamp(seconds, timezone.utc) if seconds is not None else None
+
+def save_ingestion_job(job: IngestionJob):
+    """
+    Save the status of a job, and forget the oldest finished jobs beyond INGEST_JOB_HISTORY once it finishes.
+    """
+    stmt = insert(IngestionJobs).values(
+        id=job.id,
+        state=job.to_dict(),
+        created_at=to_timestamp(job.created_at),
+        finished_at=to_timestamp(job.finished_at)
+    )
+
+    with SessionLocal() as db:
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[IngestionJobs.id],
+            set_={"state": stmt.excluded.state, "finished_at": stmt.excluded.finished_at}
+        ))
+        if job.finished_at is not None:
+            db.execute(delete(IngestionJobs).where(IngestionJobs.id.in_(
+                select(IngestionJobs.id).where(IngestionJobs.finished_at.is_not(None))
+                .order_by(IngestionJobs.finished_at.desc()).offset(INGEST_JOB_HISTORY)
+            )))
+        db.commit()
+
+def get_saved_ingestion_job(job_id: str):
+    """
+    Get the saved status of a job, None if it doesn't exist.
+    """
+    with SessionLocal() as db:
+        return db.execute(select(IngestionJobs.state).where(IngestionJobs.id == job_id)).scalar()
+
+class IngestionJobManager:
+    """
+    Bounded pool processing the uploads spooled to disk with the chunked ingestion. The status of the jobs is saved
+    in the database, the job of an upload runs in the worker that accepted it but any worker answers its polling.
+    A job whose worker stopped while running stays running.
+    """
+
+    def __init__(self, workers: int = INGEST_JOB_WORKERS, queue_size: int = INGEST_JOB_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-job")
+        self._jobs = OrderedDict()
+        self._lock = Lock()
+
+    def pending_jobs(self) -> int:
+        return sum(job.status in ("queued", "running") for job in self._jobs.values())
+
+    def submit(self, file_type: str, file: UploadFile, chunk_size: int, loader: str, force: bool = False) -> IngestionJob:
+        """
+        Spool the uploaded file to disk and queue its ingestion.
+        Params:
+        file_type (str): Type of the file being uploaded.
+        file (UploadFile): The .csv file uploaded by the user.
+        chunk_size (int): Number of rows processed in each chunk.
+        loader (str): Strategy used to load the rows, 'insert' or 'copy'.
+        force (bool): Ingest the file even if it's identical to the last file ingested of its file_type.
+        """
+        with self._lock:
+            if self.pending_jobs() >= self.queue_size:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many uploads are being processed, please retry later!"
+                )
+
+            spool = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".csv", dir=INGEST_SPOOL_DIR, delete=False)
+            job = IngestionJob(file_type, file.filename, spool.name, chunk_size, loader, force)
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+
+        try:
+            with spool:
+                shutil.copyfileobj(file.file, spool)
+            # The job can be polled from any worker once it's accepted
+            save_ingestion_job(job)
+        except (OSError, SQLAlchemyError):
+            os.remove(job.path)
+            job.status = "failed"
+            job.finished_at = time.time()
+            raise
+
+        self._executor.submit(self._run, job)
+
+        return job
+
+    def get(self, job_id: str) -> dict:
+        """
+        Get the status of a job, the jobs of this worker are answered without reading the database.
+        """
+        job = self._jobs.get(job_id)
+        state = job.to_dict() if job is not None else get_saved_ingestion_job(job_id)
+        if state is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Upload job: '{}' doesn't exist".format(job_id)
+            )
+
+        return state
+
+    def _save(self, job: IngestionJob):
+        job.saved_at = time.time()
+        try:
+            save_ingestion_job(job)
+        except SQLAlchemyError:
+            # The job goes on, its status is saved again on its next change
+            logging.getLogger(__name__).warning("The status of the upload job %s wasn't saved", job.id, exc_info=True)
+
+    def _update_progress(self, job: IngestionJob, stage: str, rows_processed: int):
+        job.update_progress(stage, rows_processed)
+        if time.time() - job.saved_at >= INGEST_JOB_SAVE_SECONDS:
+            self._save(job)
+
+    def _run(self, job: IngestionJob):
+        job.status = "running"
+        job.started_at = time.time()
+        self._save(job)
+        db = SessionLocal()
+
+        try:
+            with open(job.path, "rb") as file:
+                result = ingest_if_changed(
+                    job.file_type,
+                    UploadFile(file, filename=job.filename),
+                    db,
+                    ingest_csv_in_chunks,
+                    job.chunk_size,
+                    job.loader,
+                    lambda stage, rows_processed: self._update_progress(job, stage, rows_processed),
+                    force=job.force
+                )
+            # The progress of every chunk is already reported while running
+            result.pop("chunks", None)
+            job.result = result
+            job.status = "succeeded"
+            job.stage = "done"
+
+        except HTTPException as e:
+            job.status = "failed"
+            job.errors = e.detail
+
+        except Exception as e:
+            job.status = "failed"
+            job.errors = str(e)
+
+        finally:
+            job.finished_at = time.time()
+            db.close()
+            os.remove(job.path)
+            self._save(job)
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(len(finished) - INGEST_JOB_HISTORY, 0)]:
+            del self._jobs[job_id]
+
+# Background ingestion jobs of this worker
+ingestion_jobs = IngestionJobManager()
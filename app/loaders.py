@@ -0,0 +1,91 @@
+from sqlalchemy import Integer, DateTime
+from sqlalchemy.orm import Session
+import pandas as pd
+import numpy as np
+from .db_models import Departments, Jobs, Employees
+from .copy_loader import copy_upsert_dataframe
+from .queries import get_file_type_model
+from .upload_file_utils import ISO_TIMESTAMP_FORMAT
+from .report_cache import report_cache
+from .database import ANALYTICS_ENGINE
+
+# Number of rows converted at once into records for the upsert
+RECORDS_BATCH_SIZE = 10000
+
+
+def column_to_db_values(series: pd.Series, column_type) -> np.ndarray:
+    """
+    Convert a validated column into an array of python values accepted by the database driver,
+    replacing the nulls with None. The integer columns are converted through the nullable integer type,
+    so the nullable foreign keys (read as floats when they contain nulls) become python ints or None,
+    and the ISO timestamps are parsed into timezone aware datetimes.
+    Params:
+    series (pd.Series): The validated column.
+    column_type: The SQLAlchemy type of the target column.
+    """
+    if isinstance(column_type, Integer):
+        return series.astype('Int64').to_numpy(dtype=object, na_value=None)
+
+    if isinstance(column_type, DateTime):
+        # The timestamps are parsed once here instead of being cast by every report query
+        timestamps = pd.to_datetime(series, utc=True, format=ISO_TIMESTAMP_FORMAT)
+        values = np.array(timestamps.dt.to_pydatetime(), dtype=object)
+        values[timestamps.isna().to_numpy()] = None
+        return values
+
+    return series.astype(object).where(series.notna(), None).to_numpy()
+
+def iter_dataframe_records(file_type: str, df: pd.DataFrame, batch_size: int = RECORDS_BATCH_SIZE):
+    """
+    Build the records of the file_type model from the validated DataFrame, converting whole columns
+    of batch_size rows at a time instead of boxing every row, the records are produced lazily.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    df (pd.DataFrame): The validated content of the uploaded file.
+    batch_size (int): Number of rows converted at once.
+
+    Yields: A dictionary with the DB-ready values of each row.
+    """
+    table = get_file_type_model(file_type).__table__
+    names = [column.name for column in table.columns]
+
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        values = [column_to_db_values(batch[column.name], column.type) for column in table.columns]
+
+        for row in zip(*values):
+            yield dict(zip(names, row))
+
+def bulk_upsert_data_to_db(file_type: str, db: Session, df: pd.DataFrame, loader: str = 'insert', commit: bool = True) -> dict:
+    """
+    Upsert the validated rows of a file with the chosen loader. Without commit the rows are left
+    in the transaction of the caller, which raises the database errors and invalidates the cached reports.
+
+    Returns:
+    dict: The number of records inserted, updated and unchanged, None if the upsert was rolled back.
+    """
+    if loader == 'copy':
+        # Stream the rows with COPY into a staging table and merge them into the target table
+        upserted = copy_upsert_dataframe(get_file_type_model(file_type), df, db, commit)
+
+    else:
+        # The records are built while the upsert consumes them
+        records = iter_dataframe_records(file_type, df)
+
+        if file_type == 'jobs':    
+            upserted = Jobs.create_jobs(Jobs, records, db, commit)
+        elif file_type == 'employees':    
+            upserted = Employees.create_employees(Employees, employees=records, db=db, commit=commit)
+        else:
+            upserted = Departments.create_departments(Departments, records, db, commit)
+
+    if commit and upserted and (upserted["inserted"] or upserted["updated"]):
+        # The cached reports were computed with the previous data
+        generation = report_cache.bump_generation()
+
+        if ANALYTICS_ENGINE:
+            # The snapshot of the reports of this worker gets the committed rows without reloading it
+            from .analytics import analytics_engine
+            analytics_engine.apply_upload(file_type, df, generation)
+
+    return upserted
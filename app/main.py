@@ -1,11 +1,47 @@
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+import logging
+import os
 from .router import router
-from .database import Base, engine
+from .database import ANALYTICS_ENGINE
+
+# Minimum bytes of a response compressed with gzip when the client accepts it, -1 disables the compression
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024))
+
+# Level of the gzip compression of the responses, the reports are compressed while they are streamed
+RESPONSE_COMPRESSION_LEVEL = int(os.environ.get('RESPONSE_COMPRESSION_LEVEL', 6))
 
 app = FastAPI()
 
+if RESPONSE_COMPRESSION_MIN_SIZE >= 0:
+    # Compress the responses of the clients sending Accept-Encoding: gzip
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=RESPONSE_COMPRESSION_MIN_SIZE,
+        compresslevel=RESPONSE_COMPRESSION_LEVEL
+    )
+
 # Include the router from .router in the main app.
 app.include_router(router)
 
-# Create all declared schemas in the database
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+# The schema is created and migrated by the bootstrap command (python -m app.migrations) before the workers start,
+# importing the app doesn't connect to the database
+
+
+@app.on_event("startup")
+async def load_analytics_snapshot():
+    """
+    Load the snapshot of the analytics engine when it's enabled, so the first report doesn't wait for it.
+    A database unreachable on start only defers the load to the first report.
+    """
+    if not ANALYTICS_ENGINE:
+        return
+
+    from .analytics import analytics_engine
+
+    try:
+        await run_in_threadpool(analytics_engine.get_snapshot)
+    except SQLAlchemyError:
+        logging.getLogger(__name__).warning("The analytics snapshot will be loaded by the first report", exc_info=True)
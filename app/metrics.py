@@ -0,0 +1,238 @@
+from contextlib import contextmanager
+from threading import Lock
+import io
+import time
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(name, escape_label_value(value)) for name, value in labels.items()) + "}"
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    A metric with a value per combination of its labels.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _label_values(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError("The labels of {} are {}".format(self.name, self.labelnames))
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Yields: Tuples (suffix, labels, value) of every sample of the metric.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type)
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, format_labels(labels), format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    """
+    A value that only increases.
+    """
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        for key, value in values:
+            yield "_total", dict(zip(self.labelnames, key)), value
+
+class Histogram(Metric):
+    """
+    Distribution of observed values, counted in cumulative buckets.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds spent in the block, even if it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels) -> int:
+        counts, total = self._values.get(self._label_values(labels), ([0] * len(self.buckets), 0.0))
+        return counts[-1]
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", {**labels, "le": format_value(float(bound))}, count
+            yield "_sum", labels, total
+            yield "_count", labels, counts[-1]
+
+class MetricsRegistry:
+    """
+    The metrics exposed by the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError("The metric {} is already registered".format(metric.name))
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        return "".join(metric.render() for metric in self._metrics.values())
+
+class CountingReader(io.RawIOBase):
+    """
+    Binary reader counting the bytes read from the underlying file, to be wrapped in a io.BufferedReader.
+    """
+
+    def __init__(self, file, on_read=None):
+        self.file = file
+        self.on_read = on_read
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        content = self.file.read(len(buffer))
+        if isinstance(content, str):
+            content = content.encode()
+
+        size = len(content)
+        buffer[:size] = content
+        self.bytes_read += size
+        if self.on_read is not None:
+            self.on_read(size)
+
+        return size
+
+def counting_reader(file, on_read=None) -> io.BufferedReader:
+    """
+    Wrap a binary file so every byte read from it is reported to on_read.
+    """
+    return io.BufferedReader(CountingReader(file, on_read))
+
+async def time_first_batch(histogram: Histogram, batches, **labels):
+    """
+    Yield the batches of a streamed query, observing the seconds until its first batch,
+    the time the database takes to compute the result.
+    """
+    start = time.perf_counter()
+    observed = False
+
+    try:
+        async for rows in batches:
+            if not observed:
+                histogram.observe(time.perf_counter() - start, **labels)
+                observed = True
+            yield rows
+    finally:
+        if not observed:
+            histogram.observe(time.perf_counter() - start, **labels)
+
+# Metrics of this worker
+registry = MetricsRegistry()
+
+ingest_stage_seconds = registry.histogram(
+    "ingest_stage_seconds",
+    "Seconds spent in each stage of the ingestion of an upload (or of a chunk of it).",
+    ("file_type", "stage")
+)
+ingest_rows = registry.counter(
+    "ingest_rows",
+    "Rows loaded into the database.",
+    ("file_type",)
+)
+ingest_seconds = registry.counter(
+    "ingest_seconds",
+    "Seconds spent ingesting the loaded rows, rate(ingest_rows_total) / rate(ingest_seconds_total) is the throughput.",
+    ("file_type",)
+)
+ingest_bytes_read = registry.counter(
+    "ingest_bytes_read",
+    "Bytes read from the uploaded files.",
+    ("file_type",)
+)
+ingest_errors = registry.counter(
+    "ingest_errors",
+    "Uploads failed, by the stage where they failed.",
+    ("file_type", "stage")
+)
+report_query_seconds = registry.histogram(
+    "report_query_seconds",
+    "Seconds until a report query returns its first rows.",
+    ("report",)
+)
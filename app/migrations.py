@@ -0,0 +1,142 @@
+"""
+Migrations of the challenge_app schema. Every migration is idempotent, it checks the current state
+of the database before changing it, so they can run on every start of the application.
+
+Usage:
+    python -m app.migrations
+"""
+from sqlalchemy import text, select, exists, true
+from sqlalchemy.engine import Connection, Engine
+import logging
+from .database import Base, engine
+from .db_models import HiringSummary, select_hires_by_summary_key, add_hires_to_summary
+from .partitions import partition_employees_table
+
+# Pattern of the hire dates accepted by the uploads (ISO_TIMESTAMP_PATTERN), in the PostgreSQL regex syntax
+ISO_TIMESTAMP_SQL_PATTERN = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$'
+
+# Number of ids of the discarded hire dates written to the log of the migration
+INVALID_HIRE_DATES_LOGGED = 20
+
+
+def get_column_data_type(connection: Connection, table: str, column: str) -> str:
+    """
+    Get the PostgreSQL data type of a column of the challenge_app schema, None if it doesn't exist.
+    """
+    return connection.execute(
+        text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_schema = :schema AND table_name = :table AND column_name = :column"
+        ),
+        {"schema": Base.metadata.schema, "table": table, "column": column}
+    ).scalar()
+
+def migrate_employees_datetime_to_timestamptz(connection: Connection):
+    """
+    The hire date of the employees was stored as the uploaded ISO string, convert the existing
+    values to timestamptz so the reports don't need to cast every row. The strings stored before the uploads
+    were validated that aren't ISO timestamps of an existing date are set to NULL, and their ids are logged,
+    instead of failing the cast of the whole column.
+    """
+    if get_column_data_type(connection, "employees", "datetime") != "character varying":
+        return
+
+    # Cast a string to timestamptz only when it has the format of the uploads and the date exists, NULL otherwise
+    connection.execute(text(
+        "CREATE OR REPLACE FUNCTION pg_temp.cast_iso_timestamp(value varchar, pattern text) RETURNS timestamptz AS $$ "
+        "BEGIN "
+        "IF value !~ pattern THEN RETURN NULL; END IF; "
+        "RETURN value::timestamptz; "
+        "EXCEPTION WHEN invalid_datetime_format OR datetime_field_overflow THEN RETURN NULL; "
+        "END $$ LANGUAGE plpgsql STABLE"
+    ))
+
+    invalid_ids = connection.execute(
+        text(
+            "SELECT id FROM challenge_app.employees "
+            "WHERE NULLIF(datetime, '') IS NOT NULL AND pg_temp.cast_iso_timestamp(datetime, :pattern) IS NULL "
+            "ORDER BY id"
+        ),
+        {"pattern": ISO_TIMESTAMP_SQL_PATTERN}
+    ).scalars().all()
+
+    if invalid_ids:
+        logging.getLogger(__name__).warning(
+            "%d hire dates of the employees aren't ISO timestamps and are set to NULL, employee ids: %s",
+            len(invalid_ids), invalid_ids[:INVALID_HIRE_DATES_LOGGED]
+        )
+        connection.execute(
+            text("UPDATE challenge_app.employees SET datetime = NULL WHERE id = ANY(:ids)"),
+            {"ids": invalid_ids}
+        )
+
+    connection.execute(text(
+        "ALTER TABLE challenge_app.employees "
+        "ALTER COLUMN datetime TYPE timestamptz USING NULLIF(datetime, '')::timestamptz"
+    ))
+
+def backfill_hiring_summary(connection: Connection):
+    """
+    Fill the hiring summary from the employees loaded before it existed.
+    """
+    if connection.execute(select(exists().select_from(HiringSummary))).scalar():
+        return
+
+    add_hires_to_summary(select_hires_by_summary_key(true()), connection)
+
+def make_employees_foreign_keys_deferrable(connection: Connection):
+    """
+    The foreign keys of the employees were created not deferrable, the dataset uploads defer them
+    to the commit of the transaction loading every file.
+    """
+    constraints = connection.execute(text(
+        "SELECT conname FROM pg_constraint "
+        "WHERE conrelid = 'challenge_app.employees'::regclass AND contype = 'f' AND NOT condeferrable"
+    )).scalars().all()
+
+    for constraint in constraints:
+        connection.execute(text(
+            'ALTER TABLE challenge_app.employees ALTER CONSTRAINT "{}" DEFERRABLE INITIALLY IMMEDIATE'.format(constraint)
+        ))
+
+def drop_employees_datetime_index(connection: Connection):
+    """
+    The employees were indexed by hire date for the year filters of the reports, which read the hiring
+    summary instead, the index only slowed down the uploads.
+    """
+    connection.execute(text("DROP INDEX IF EXISTS challenge_app.ix_employees_datetime"))
+
+def create_declared_indexes(connection: Connection):
+    """
+    Create the indexes declared by the models that don't exist yet, create_all only creates the indexes
+    of the tables it creates. The indexes of the partitioned employees are created on every partition.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+# Migrations applied in order after creating the missing tables
+MIGRATIONS = [
+    migrate_employees_datetime_to_timestamptz,
+    backfill_hiring_summary,
+    make_employees_foreign_keys_deferrable,
+    partition_employees_table,
+    drop_employees_datetime_index,
+    create_declared_indexes,
+]
+
+def run_migrations(bind: Engine = engine):
+    """
+    Create the declared tables that don't exist yet and apply every migration in a single transaction.
+    Params:
+    bind (Engine): The engine of the database to migrate.
+    """
+    with bind.begin() as connection:
+        Base.metadata.create_all(bind=connection)
+
+        for migration in MIGRATIONS:
+            migration(connection)
+
+
+if __name__ == "__main__":
+    run_migrations()
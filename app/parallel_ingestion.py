@@ -0,0 +1,281 @@
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import multiprocessing
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from .copy_loader import get_staging_table, prepare_dataframe_for_copy, copy_dataframe_to_table, merge_staging_table
+from .database import ANALYTICS_ENGINE
+from .db_models import get_upsert_counts
+from .queries import get_file_type_model
+from .report_cache import report_cache
+from .ingestion import INTEGRITY_ERRORS, get_integrity_error_detail, count_bytes_read
+from .ingestion_jobs import INGEST_SPOOL_DIR
+from .metrics import ingest_rows, ingest_seconds, ingest_errors
+from .upload_file_utils import (
+    get_file_schema,
+    read_comma_separated_no_header,
+    assign_columns_no_header_file,
+    decompress_upload,
+    get_validation_report,
+    ValidationReport
+)
+
+# Number of processes parsing, validating and loading the byte ranges of a file, each one with its own connection
+PARALLEL_INGEST_WORKERS = int(os.environ.get('PARALLEL_INGEST_WORKERS', os.cpu_count() or 1))
+
+# Minimum size of the byte ranges, smaller files are split in fewer ranges
+PARALLEL_INGEST_MIN_RANGE_BYTES = int(os.environ.get('PARALLEL_INGEST_MIN_RANGE_BYTES', 8 * 1024 * 1024))
+
+_process_pool = None
+_process_pool_lock = Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool of the parallel ingestion, started on its first use. The processes are spawned
+    instead of forked, forking the multithreaded server could copy locks held by other threads.
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_INGEST_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+        return _process_pool
+
+def split_byte_ranges(path: str, parts: int, min_range_bytes: int = PARALLEL_INGEST_MIN_RANGE_BYTES) -> list:
+    """
+    Split a file in at most parts byte ranges of similar size, every range ends right after a newline
+    so each one contains whole rows. The values containing quoted newlines aren't supported.
+    Params:
+    path (str): Path of the file.
+    parts (int): Maximum number of ranges.
+    min_range_bytes (int): Minimum size of the ranges.
+
+    Returns:
+    list: Tuples (start, end) of the byte ranges, covering the whole file in order.
+    """
+    size = os.path.getsize(path)
+    parts = max(1, min(parts, size // max(min_range_bytes, 1)))
+
+    boundaries = [0]
+    with open(path, "rb") as file:
+        for part in range(1, parts):
+            target = max(size * part // parts, boundaries[-1])
+            if target > 0:
+                # Move the boundary after the end of the row containing the target
+                file.seek(target - 1)
+                file.readline()
+            boundaries.append(min(file.tell(), size))
+    boundaries.append(size)
+
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def read_byte_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start)
+
+def parse_and_validate_range(file_type: str, path: str, start: int, end: int):
+    """
+    Parse and validate the rows of a byte range of a comma separated file without headers.
+
+    Returns:
+    tuple: The DataFrame of the range and its ValidationReport, with the rows numbered from the start of the range.
+    """
+    schema = get_file_schema(file_type)
+
+    df = read_comma_separated_no_header(UploadFile(io.BytesIO(read_byte_range(path, start, end))))
+    assign_columns_no_header_file(df, schema)
+
+    return df, get_validation_report(schema, df)
+
+def process_byte_range(file_type: str, path: str, start: int, end: int, staging_table_name: str) -> dict:
+    """
+    Parse and validate a byte range in a worker process and, when it's valid, COPY its rows into the
+    shared staging table using a connection of the worker.
+
+    Returns:
+    dict: The rows of the range, its ValidationReport (rows numbered from the start of the range)
+        and the status code and detail of the errors stopping the processing of the range.
+    """
+    # Imported in the worker processes only, the connections can't be shared between processes
+    from .database import engine
+
+    try:
+        df, errors = parse_and_validate_range(file_type, path, start, end)
+    except HTTPException as e:
+        return {"rows": 0, "errors": ValidationReport(), "failure": {"status_code": e.status_code, "detail": e.detail}}
+
+    if not errors.error_count:
+        table = get_file_type_model(file_type).__table__
+        staging_table = get_staging_table(table, staging_table_name, table.schema)
+
+        connection = engine.raw_connection()
+        try:
+            copy_dataframe_to_table(connection.cursor(), staging_table.fullname, prepare_dataframe_for_copy(table, df))
+            connection.commit()
+        finally:
+            connection.close()
+
+    return {"rows": len(df), "errors": errors, "failure": None}
+
+def number_errors_from_file_start(results: list) -> ValidationReport:
+    """
+    Merge the validation reports of every range renumbering their errors from the start of the file,
+    adding the rows of the previous ranges. At most VALIDATION_MAX_ERRORS errors are kept for the whole file.
+    Params:
+    results (list): The results of process_byte_range, in the order of the ranges.
+    """
+    report = ValidationReport()
+    offset = 0
+    for result in results:
+        report.extend(result["errors"], offset)
+        offset += result["rows"]
+
+    return report
+
+def apply_file_to_analytics(file_type: str, path: str, generation: int):
+    """
+    Apply the rows of a file committed by the parallel ingestion to the analytics snapshot of this worker.
+    The rows were only parsed by the worker processes, the file is read again without validating it.
+    Params:
+    file_type (str): Type of the file uploaded.
+    path (str): Path of the file spooled to disk.
+    generation (int): The data generation started by the commit of the file.
+    """
+    from .analytics import analytics_engine
+
+    with open(path, "rb") as file:
+        df = read_comma_separated_no_header(UploadFile(file))
+    assign_columns_no_header_file(df, get_file_schema(file_type))
+
+    analytics_engine.apply_upload(file_type, df, generation)
+
+def ingest_csv_parallel(file_type: str, path: str, db: Session, workers: int = PARALLEL_INGEST_WORKERS) -> dict:
+    """
+    Read, validate and upsert a comma separated file without headers, splitting it at newline aligned
+    byte ranges processed in parallel by the process pool. Every process COPYs its valid range into
+    a shared UNLOGGED staging table with its own connection, then the staging table is merged into the target
+    table and committed at once: either every row of the file is loaded or none of them.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    path (str): Path of the file spooled to disk.
+    db (Session): The database session merging the staging table.
+    workers (int): Maximum number of ranges processed in parallel.
+
+    Returns:
+    dict: The rows loaded, the number of records inserted, updated and unchanged, the number of ranges and the seconds spent.
+    """
+    start_time = time.perf_counter()
+    model = get_file_type_model(file_type)
+    table = model.__table__
+
+    ranges = split_byte_ranges(path, workers)
+    if not ranges:
+        raise HTTPException(
+            status_code=400,
+            detail="The file provided was empty, please verify the uploaded file!"
+        )
+
+    # The staging table is shared by the connections of the workers, it's a regular table without WAL
+    staging_table = get_staging_table(table, "ingest_staging_{}".format(uuid.uuid4().hex), table.schema)
+    bind = db.get_bind()
+    with bind.begin() as connection:
+        connection.execute(text(
+            "CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS)".format(staging_table.fullname, table.fullname)
+        ))
+
+    try:
+        pool = get_process_pool()
+        futures = [
+            pool.submit(process_byte_range, file_type, path, start, end, staging_table.name)
+            for start, end in ranges
+        ]
+        results = [future.result() for future in futures]
+
+        # The first range failing to be read or to match the columns fails the whole file
+        for result in results:
+            if result["failure"] is not None:
+                ingest_errors.inc(file_type=file_type, stage="read")
+                raise HTTPException(**result["failure"])
+
+        report = number_errors_from_file_start(results)
+        if report.error_count:
+            ingest_errors.inc(file_type=file_type, stage="validate")
+            raise HTTPException(
+                status_code=400,
+                detail=report.detail()
+            )
+
+        # Merge every range at once, a single commit makes the whole file visible
+        try:
+            inserted, updated = merge_staging_table(model, staging_table, db)
+            db.commit()
+        except INTEGRITY_ERRORS as e:
+            db.rollback()
+            ingest_errors.inc(file_type=file_type, stage="load")
+            raise HTTPException(status_code=400, detail=get_integrity_error_detail(e))
+        except SQLAlchemyError:
+            db.rollback()
+            ingest_errors.inc(file_type=file_type, stage="load")
+            raise HTTPException(
+                status_code=500,
+                detail="The file could not be loaded into the database"
+            )
+
+    finally:
+        with bind.begin() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS {}".format(staging_table.fullname)))
+
+    rows = sum(result["rows"] for result in results)
+    if inserted or updated:
+        # The cached reports were computed with the previous data
+        generation = report_cache.bump_generation()
+
+        if ANALYTICS_ENGINE:
+            # The snapshot of the reports of this worker gets the committed rows without reloading it
+            apply_file_to_analytics(file_type, path, generation)
+
+    seconds = time.perf_counter() - start_time
+    ingest_rows.inc(rows, file_type=file_type)
+    ingest_seconds.inc(seconds, file_type=file_type)
+
+    return {
+        "rows": rows,
+        **get_upsert_counts(rows, inserted, updated),
+        "ranges": len(ranges),
+        "seconds": seconds
+    }
+
+def ingest_upload_parallel(file_type: str, file: UploadFile, db: Session, workers: int = PARALLEL_INGEST_WORKERS) -> dict:
+    """
+    Spool the uploaded file to disk, where the worker processes read their byte ranges, and ingest it in parallel.
+    Params:
+    file_type (str): Type of the file being uploaded.
+    file (UploadFile): The .csv file (optionally compressed) uploaded by the user.
+    db (Session): The database session.
+    workers (int): Maximum number of ranges processed in parallel.
+    """
+    spool = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".csv", dir=INGEST_SPOOL_DIR, delete=False)
+
+    try:
+        # The compressed files are decompressed while spooled, the byte ranges split the CSV content
+        # and the metrics count the bytes uploaded, as the other uploads do
+        with spool:
+            shutil.copyfileobj(decompress_upload(count_bytes_read(file_type, file)).file, spool)
+
+        return ingest_csv_parallel(file_type, spool.name, db, workers)
+    finally:
+        os.remove(spool.name)
@@ -0,0 +1,222 @@
+"""
+Range partitioning of the employees by the year of their hire date. Enabled with EMPLOYEES_PARTITIONED,
+the migrations then convert the employees table into a partitioned table, and the partition of every year
+is created when the first employee hired in it is loaded. The employees without hire date are kept in
+the default partition.
+
+Old years can be vacuumed, archived or detached without touching the partitions of the current years:
+
+Usage:
+    python -m app.partitions list
+    python -m app.partitions create 2024 2025
+    python -m app.partitions detach 2019
+"""
+from sqlalchemy import text, select, and_
+from sqlalchemy.engine import Connection
+from datetime import datetime, timezone
+import argparse
+import os
+from .database import Base, engine
+
+# Partition the employees by the year of their hire date
+EMPLOYEES_PARTITIONED = os.environ.get('EMPLOYEES_PARTITIONED', 'false').lower() in ('1', 'true', 'yes')
+
+# Key of the advisory lock serializing the creation of the partitions
+PARTITIONS_LOCK_KEY = "challenge_app.employees partitions"
+
+EMPLOYEES_TABLE = "{}.employees".format(Base.metadata.schema)
+
+
+def get_year_partition_name(year: int) -> str:
+    return "employees_y{}".format(year)
+
+def get_year_bounds(year: int) -> tuple:
+    """
+    Bounds of the partition of a year, the hire dates are partitioned in UTC as the hiring summary groups them.
+    """
+    return "{}-01-01 00:00:00+00".format(year), "{}-01-01 00:00:00+00".format(year + 1)
+
+def is_employees_partitioned(connection) -> bool:
+    return connection.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"
+    ), {"table": EMPLOYEES_TABLE}).scalar() or False
+
+def get_year_partitions(connection) -> dict:
+    """
+    Get the partitions of the employees attached to a year.
+
+    Returns:
+    dict: The name of the partition of each year.
+    """
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:table)"
+    ), {"table": EMPLOYEES_TABLE}).scalars().all()
+
+    return {int(name[len("employees_y"):]): name for name in names if name.startswith("employees_y")}
+
+def create_year_partitions(connection, years) -> list:
+    """
+    Create the partitions of the years that don't have one yet, in the current transaction.
+    Params:
+    connection (Session or Connection): The database session.
+    years (iterable): The hire years of the employees about to be loaded.
+
+    Returns:
+    list: The years whose partition was created.
+    """
+    missing = set(years) - set(get_year_partitions(connection))
+    if not missing:
+        return []
+
+    # Another load could be creating the same partitions, check them again once the lock is held
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": PARTITIONS_LOCK_KEY})
+    missing = sorted(missing - set(get_year_partitions(connection)))
+
+    for year in missing:
+        start, end = get_year_bounds(year)
+        connection.execute(text(
+            "CREATE TABLE {schema}.{partition} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')".format(
+                schema=Base.metadata.schema,
+                partition=get_year_partition_name(year),
+                table=EMPLOYEES_TABLE,
+                start=start,
+                end=end
+            )
+        ))
+
+    return missing
+
+def create_staged_year_partitions(connection, staging_table):
+    """
+    Create the partitions of the hire years of the employees loaded into a staging table.
+    """
+    years = connection.execute(text(
+        "SELECT DISTINCT extract(year FROM timezone('UTC', datetime))::int FROM {} WHERE datetime IS NOT NULL".format(
+            staging_table.fullname
+        )
+    )).scalars().all()
+
+    return create_year_partitions(connection, years)
+
+def get_partitioned_columns_ddl(table, dialect) -> str:
+    """
+    Get the column definitions of a table to create it partitioned: the columns keep their types, nullability
+    and foreign keys, without the primary key nor the sequence of its id, which the loads provide.
+    Params:
+    table (Table): The table of the model.
+    dialect (Dialect): The dialect of the database.
+    """
+    columns = []
+    for column in table.columns:
+        ddl = "{} {}".format(column.name, column.type.compile(dialect=dialect))
+        if not column.nullable:
+            ddl += " NOT NULL"
+
+        for foreign_key in column.foreign_keys:
+            ddl += " REFERENCES {} ({})".format(foreign_key.column.table.fullname, foreign_key.column.name)
+            if foreign_key.deferrable:
+                ddl += " DEFERRABLE INITIALLY {}".format(foreign_key.initially or "IMMEDIATE")
+        columns.append(ddl)
+
+    return ", ".join(columns)
+
+def partition_employees_table(connection: Connection):
+    """
+    Convert the employees table into a table partitioned by the year of the hire date when EMPLOYEES_PARTITIONED
+    is enabled. The primary key of a partitioned table must contain the hire date, so the ids are indexed
+    without a unique constraint and the loads keep them unique, replacing the changed employees.
+    """
+    if not EMPLOYEES_PARTITIONED or is_employees_partitioned(connection):
+        return
+
+    # Imported here, the models import the partitions
+    from .db_models import Employees
+
+    schema = Base.metadata.schema
+    columns = ", ".join(column.name for column in Employees.__table__.columns)
+    connection.execute(text("ALTER TABLE {} RENAME TO employees_unpartitioned".format(EMPLOYEES_TABLE)))
+    connection.execute(text("CREATE TABLE {} ({}) PARTITION BY RANGE (datetime)".format(
+        EMPLOYEES_TABLE, get_partitioned_columns_ddl(Employees.__table__, connection.dialect)
+    )))
+    connection.execute(text("CREATE TABLE {}.employees_default PARTITION OF {} DEFAULT".format(schema, EMPLOYEES_TABLE)))
+
+    years = connection.execute(text(
+        "SELECT DISTINCT extract(year FROM timezone('UTC', datetime))::int FROM {}.employees_unpartitioned "
+        "WHERE datetime IS NOT NULL".format(schema)
+    )).scalars().all()
+    create_year_partitions(connection, years)
+
+    connection.execute(text(
+        "INSERT INTO {table} ({columns}) SELECT {columns} FROM {schema}.employees_unpartitioned".format(
+            table=EMPLOYEES_TABLE, columns=columns, schema=schema
+        )
+    ))
+    connection.execute(text("DROP TABLE {}.employees_unpartitioned".format(schema)))
+
+    # The indexes are created on every partition
+    connection.execute(text("CREATE INDEX ix_employees_id ON {} (id)".format(EMPLOYEES_TABLE)))
+
+def detach_year_partition(connection: Connection, year: int) -> str:
+    """
+    Detach the partition of a year, its employees are kept in a standalone table that can be archived or dropped.
+    Their hires are subtracted from the hiring summary and the data generation is bumped, the reports count
+    the employees of the attached partitions only. An employee of the detached partition uploaded again
+    is loaded as a new one.
+
+    Returns:
+    str: The name of the detached table.
+    """
+    # Imported here, the models import the partitions
+    from .db_models import (
+        Employees,
+        lock_employees_upserts,
+        select_hires_by_summary_key,
+        subtract_hires_from_summary,
+        report_generation
+    )
+
+    partition = get_year_partitions(connection).get(year)
+    if partition is None:
+        raise ValueError("The employees don't have a partition for {}".format(year))
+
+    # No upsert moves employees in or out of the partition while its hires are subtracted
+    lock_employees_upserts(connection)
+    subtract_hires_from_summary(select_hires_by_summary_key(and_(
+        Employees.datetime >= datetime(year, 1, 1, tzinfo=timezone.utc),
+        Employees.datetime < datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    )), connection)
+
+    connection.execute(text("ALTER TABLE {} DETACH PARTITION {}.{}".format(EMPLOYEES_TABLE, Base.metadata.schema, partition)))
+    # The cached reports and the analytics snapshots of every worker still count the detached hires
+    connection.execute(select(report_generation.next_value()))
+
+    return "{}.{}".format(Base.metadata.schema, partition)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the partitions of every year")
+    create_parser = subparsers.add_parser("create", help="Create the partitions of the years")
+    create_parser.add_argument("years", type=int, nargs="+")
+    detach_parser = subparsers.add_parser("detach", help="Detach the partition of a year")
+    detach_parser.add_argument("year", type=int)
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        if not is_employees_partitioned(connection):
+            parser.error("The employees table isn't partitioned, enable EMPLOYEES_PARTITIONED and run the migrations")
+
+        if args.command == "list":
+            for year, partition in sorted(get_year_partitions(connection).items()):
+                print("{} {}".format(year, partition))
+        elif args.command == "create":
+            for year in create_year_partitions(connection, args.years):
+                print("created {}".format(get_year_partition_name(year)))
+        else:
+            print("detached {}".format(detach_year_partition(connection, args.year)))
+
+
+if __name__ == "__main__":
+    main()
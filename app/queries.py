@@ -1,119 +1,132 @@
-from sqlalchemy import func, extract, cast, TIMESTAMP, case
-from .db_models import Departments, Jobs, Employees
-import pandas as pd
-from sqlalchemy.orm import Session
+from sqlalchemy import func, case, select, and_
+from .db_models import Departments, Jobs, Employees, HiringSummary
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 
-def bulk_upsert_data_to_db(file_type: str, db: Session, df: pd.DataFrame):
-    jobs = []
-    employees = []
-    departments = []
+# Number of rows fetched at once from the server-side cursor of the streamed reports
+REPORT_YIELD_PER = 1000
 
-    for idx, row in df.iterrows():
-        if file_type == 'jobs':
-            jobs.append({'id': int(row['id']), 'job': row['job']})
-            
-        elif file_type == 'employees':
-            employees.append(
-                {
-                "id": int(row['id']), 
-                "name": row['name'], 
-                "datetime": row['datetime'],
-                "department_id": int(row['department_id']) if not pd.isna(row['department_id']) else None, 
-                "job_id": int(row['job_id']) if not pd.isna(row['job_id']) else None
-                }
-            )
-
-        else:
-            departments.append(
-                {'id': int(row['id']), 'department': row['department']}
-            )
+def get_file_type_model(file_type: str):
+    """
+    Get the ORM model loaded by a file_type.
+    """
+    file_type_models = {
+        'jobs': Jobs,
+        'departments': Departments,
+        'employees': Employees
+    }
 
+    return file_type_models[file_type]
 
-    if file_type == 'jobs':    
-        Jobs.create_jobs(Jobs, jobs, db)
-    elif file_type == 'employees':    
-        Employees.create_employees(Employees, employees=employees, db=db)
-    else:
-        Departments.create_departments(Departments, departments, db)
-
-def get_results_sql_employees_per_quarter(db: Session) -> dict:
-    results =  db.query(
+def select_employees_per_quarter(year_from: int, year_to: int):
+    """
+    Statement of the employees hired per quarter between two years (both included), by year, department and job.
+    """
+    return select(
+            HiringSummary.year,
             Departments.department,
             Jobs.job,
             func.sum(
                 case(
-                    (extract('quarter', cast(Employees.datetime, TIMESTAMP)) == '1', 1), 
+                    (HiringSummary.quarter == 1, HiringSummary.hired), 
                     else_= 0
                 )
             ).label("Q1"),
             func.sum(
                 case(
-                    (extract('quarter', cast(Employees.datetime, TIMESTAMP)) == '2', 1), 
+                    (HiringSummary.quarter == 2, HiringSummary.hired), 
                     else_= 0
                 )
             ).label("Q2"),
             func.sum(
                 case(
-                    (extract('quarter', cast(Employees.datetime, TIMESTAMP)) == '3', 1), 
+                    (HiringSummary.quarter == 3, HiringSummary.hired), 
                     else_= 0
                 )
             ).label("Q3"),
             func.sum(
                 case(
-                    (extract('quarter', cast(Employees.datetime, TIMESTAMP)) == '4', 1), 
+                    (HiringSummary.quarter == 4, HiringSummary.hired), 
                     else_= 0
                 )
             ).label("Q4")
-            ).select_from(Employees).join(
-                Jobs, Jobs.id == Employees.job_id
+            ).select_from(HiringSummary).join(
+                Jobs, Jobs.id == HiringSummary.job_id
             ).join(
-                Departments, Departments.id == Employees.department_id
-            ).filter(
-                extract("year", cast(Employees.datetime, TIMESTAMP)) == 2021
+                Departments, Departments.id == HiringSummary.department_id
+            ).where(
+                HiringSummary.year.between(year_from, year_to)
             ).group_by(
-                Departments.department, Jobs.job
+                HiringSummary.year, Departments.department, Jobs.job
             ).order_by(
-                Departments.department, Jobs.job
-            ).all()
-
-    db.close()
+                HiringSummary.year, Departments.department, Jobs.job
+            )
 
-    return results
+def select_hiring_more_than_avg(year_from: int, year_to: int):
+    """
+    Statement of the departments that hired more employees than the average of the departments in the same year,
+    for every year between year_from and year_to (both included). The hires per department and the averages
+    are computed in CTEs, so a single query answers every year.
 
-def get_sql_results_hiring_more_than_avg(db: Session, avg_value: float) -> dict:
-    result2 = db.query(
+    Every year with hires returns at least one row: the years where no department hired more than the average
+    return a single row with null id, department and hired, so the years without any hire can be told apart.
+    """
+    hires = select(
+        HiringSummary.year,
         Departments.id,
         Departments.department,
-        func.count().label("hired")
-    ).select_from(Employees).join(
-        Departments, Departments.id == Employees.department_id
+        func.sum(HiringSummary.hired).label("hired")
+    ).select_from(HiringSummary).join(
+        Departments, Departments.id == HiringSummary.department_id
+    ).where(
+        HiringSummary.year.between(year_from, year_to)
     ).group_by(
-        Departments.id, Departments.department
-    ).having(
-        func.count() > avg_value
-    ).order_by(func.count().desc()).all()
+        HiringSummary.year, Departments.id, Departments.department
+    ).cte("hires")
 
-    db.close()
-    
-    return result2
-
-def get_subquery_avg_hiring_per_department_only2021(db: Session) -> dict:
-    subquery = db.query(
-        Employees.department_id,
-        func.count().label("hiring_count")
-    ).select_from(Employees).join(
-        Departments, Departments.id == Employees.department_id
-    ).filter(
-        extract("year", cast(Employees.datetime, TIMESTAMP)) == 2021
+    averages = select(
+        hires.c.year,
+        func.avg(hires.c.hired).label("avg_hired")
     ).group_by(
-        Employees.department_id
-    ).subquery()
-    
-    return subquery
+        hires.c.year
+    ).cte("averages")
+
+    return select(
+        averages.c.year,
+        hires.c.id,
+        hires.c.department,
+        hires.c.hired
+    ).select_from(
+        averages.outerjoin(
+            hires,
+            and_(hires.c.year == averages.c.year, hires.c.hired > averages.c.avg_hired)
+        )
+    ).order_by(
+        averages.c.year, hires.c.hired.desc()
+    )
+
+async def stream_report_batches(db, stmt, yield_per: int = REPORT_YIELD_PER):
+    """
+    Run a report statement with a server-side cursor and yield its rows in batches of yield_per rows,
+    so the whole result set is never held in memory.
+    Params:
+    db (Session or AsyncSession): The database session, the sync session is used from the threadpool.
+    stmt: The statement of the report.
+    yield_per (int): Number of rows fetched at once from the cursor.
+
+    Yields: Lists of rows.
+    """
+    stmt = stmt.execution_options(yield_per=yield_per)
+
+    if isinstance(db, AsyncSession):
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            yield rows
+        return
 
-def get_avg_all_departments_hiring_subquery(db: Session, subquery) -> float:
-    avg_value = db.query(
-        func.avg(subquery.c.hiring_count)
-    ).all()[0][0]
-    
-    return avg_value
+    result = await run_in_threadpool(db.execute, stmt)
+    try:
+        async for rows in iterate_in_threadpool(result.partitions()):
+            yield rows
+    finally:
+        result.close()
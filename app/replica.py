@@ -0,0 +1,89 @@
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from threading import Lock
+import time
+
+# Seconds the replica is behind the primary, 0 when it replayed everything it received (an idle primary
+# doesn't advance the replay timestamp) or when the server isn't a replica
+REPLICATION_LAG_SQL = text(
+    "SELECT CASE "
+    "WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+
+class ReplicaMonitor:
+    """
+    Decide if the reads can be served by the replica: it must be reachable, its replication lag
+    must be below max_lag_seconds and this worker must not have committed a write in the last
+    read_your_writes_seconds, whose changes could be missing in the replica.
+    The replica is checked at most once every check_interval_seconds.
+    """
+
+    def __init__(self, engine, max_lag_seconds: float, read_your_writes_seconds: float, check_interval_seconds: float):
+        self.engine = engine
+        self.max_lag_seconds = max_lag_seconds
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self.available = False
+        self.lag_seconds = None
+        self.checked_at = None
+        self.last_write_at = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._lock = Lock()
+
+    def check_lag(self) -> float:
+        """
+        Query the replication lag of the replica, raises the errors of the connection.
+        """
+        with self.engine.connect() as connection:
+            return float(connection.execute(REPLICATION_LAG_SQL).scalar())
+
+    def refresh(self):
+        """
+        Check the replica again when the last check is older than the check interval.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.checked_at is not None and now - self.checked_at < self.check_interval_seconds:
+                return
+            self.checked_at = now
+
+        try:
+            lag_seconds = self.check_lag()
+        except SQLAlchemyError:
+            self.available, self.lag_seconds = False, None
+            return
+
+        self.available, self.lag_seconds = lag_seconds <= self.max_lag_seconds, lag_seconds
+
+    def record_write(self):
+        self.last_write_at = time.monotonic()
+
+    def use_replica(self) -> bool:
+        """
+        Check if the next read can be served by the replica, counting where the reads are routed.
+        """
+        if self.last_write_at is not None and time.monotonic() - self.last_write_at < self.read_your_writes_seconds:
+            use_replica = False
+        else:
+            self.refresh()
+            use_replica = self.available
+
+        with self._lock:
+            if use_replica:
+                self.replica_reads += 1
+            else:
+                self.primary_reads += 1
+
+        return use_replica
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "lag_seconds": self.lag_seconds,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads
+        }
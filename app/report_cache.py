@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from threading import Lock
+from sqlalchemy import select, text
+from starlette.concurrency import run_in_threadpool
+import os
+import time
+from .database import engine
+from .db_models import report_generation
+
+# Number of report results kept by the in-process cache, 0 disables the cache
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 128))
+
+# Maximum number of rows of a streamed report kept by the cache, larger results are only streamed
+REPORT_CACHE_MAX_ROWS = int(os.environ.get('REPORT_CACHE_MAX_ROWS', 10000))
+
+# Share the data generation between the workers through the database, otherwise a worker only sees its own uploads
+REPORT_CACHE_SHARED_GENERATION = os.environ.get('REPORT_CACHE_SHARED_GENERATION', 'true').lower() in ('1', 'true', 'yes')
+
+# Seconds a worker reuses the shared data generation read from the database, the results cached by a worker are
+# served at most this long after an upload of another worker, 0 reads it on every report
+REPORT_CACHE_GENERATION_TTL = float(os.environ.get('REPORT_CACHE_GENERATION_TTL', 1))
+
+
+class ReportCacheBackend:
+    """
+    Storage of the report cache. The data generation is kept by the backend so that a backend shared
+    between workers (e.g. Redis) also shares the invalidation done by the uploads of any of them.
+    """
+
+    def get(self, key):
+        """
+        Returns: A tuple (found, value) for the key.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def get_generation(self) -> int:
+        raise NotImplementedError
+
+    def bump_generation(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+class LRUCacheBackend(ReportCacheBackend):
+    """
+    In-process backend keeping the maxsize most recently used results.
+    """
+
+    def __init__(self, maxsize: int = REPORT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_generation(self) -> int:
+        return self._generation
+
+    def bump_generation(self) -> int:
+        with self._lock:
+            self._generation += 1
+            # The results of the previous generations can't be served anymore
+            self._entries.clear()
+            return self._generation
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "evictions": self.evictions
+        }
+
+class DatabaseGenerationBackend(LRUCacheBackend):
+    """
+    In-process backend whose data generation is shared by every worker through a sequence of the database:
+    each upload takes its next value, the workers read its last value at most every ttl seconds.
+    """
+
+    def __init__(self, maxsize: int = REPORT_CACHE_SIZE, bind=engine, ttl: float = REPORT_CACHE_GENERATION_TTL):
+        super().__init__(maxsize)
+        self.bind = bind
+        self.ttl = ttl
+        self._read_at = None
+
+    def read_generation(self) -> int:
+        # The sequence starts uncalled, its last value is only the generation once it was taken
+        with self.bind.connect() as connection:
+            return connection.execute(text(
+                "SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {}.{}".format(
+                    report_generation.schema, report_generation.name
+                )
+            )).scalar()
+
+    def next_generation(self) -> int:
+        with self.bind.begin() as connection:
+            return connection.execute(select(report_generation.next_value())).scalar()
+
+    def set_generation(self, generation: int):
+        with self._lock:
+            self._read_at = time.monotonic()
+            if generation != self._generation:
+                self._generation = generation
+                # The results of the other generations can't be served anymore
+                self._entries.clear()
+
+    def get_generation(self) -> int:
+        if self._read_at is None or time.monotonic() - self._read_at >= self.ttl:
+            self.set_generation(self.read_generation())
+
+        return self._generation
+
+    def bump_generation(self) -> int:
+        generation = self.next_generation()
+        self.set_generation(generation)
+        return generation
+
+class ReportCache:
+    """
+    Cache of the report results. Every entry is tagged with the data generation it was computed in,
+    each successful upload bumps the generation so the results computed before it are never served.
+    """
+
+    def __init__(self, backend: ReportCacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def lookup(self, report: str, *params):
+        """
+        Look up the result of a report in the current generation.
+        Params:
+        report (str): Name of the report.
+        params: Parameters of the report, part of the cache key.
+
+        Returns: A tuple (found, value, key), the key stores the result computed on a miss.
+        """
+        key = (self.backend.get_generation(), report) + params
+
+        found, value = self.backend.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return found, value, key
+
+    def store(self, key, value):
+        self.backend.set(key, value)
+
+    async def get_or_stream(self, report: str, stream, *params, max_rows: int = REPORT_CACHE_MAX_ROWS, store: bool = True):
+        """
+        Yield the batches of rows of a report, from the cache or from the stream. The streamed rows are
+        cached once the stream is exhausted, unless the result has more than max_rows rows.
+        Params:
+        report (str): Name of the report.
+        stream (callable): Function returning an async iterator of lists of rows when the result isn't cached.
+        params: Parameters of the report, part of the cache key.
+        max_rows (int): Maximum number of rows of a cached result.
+        store (bool): Cache the streamed rows, disabled for the rows of a replica, which can predate the
+            current generation.
+        """
+        # The shared generation can be read from the database
+        found, value, key = await run_in_threadpool(self.lookup, report, *params)
+        if found:
+            yield value
+            return
+
+        rows = [] if store else None
+        async for batch in stream():
+            if rows is not None:
+                rows.extend(batch)
+                if len(rows) > max_rows:
+                    rows = None
+            yield batch
+
+        if rows is not None:
+            self.store(key, rows)
+
+    def bump_generation(self) -> int:
+        """
+        Invalidate the cached results, to be called after every change of the data.
+        """
+        return self.backend.bump_generation()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self.backend.get_generation(),
+            **self.backend.stats()
+        }
+
+# Cache shared by the report endpoints, replace its backend to share the results between workers
+report_cache = ReportCache(DatabaseGenerationBackend() if REPORT_CACHE_SHARED_GENERATION else LRUCacheBackend())
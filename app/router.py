@@ -1,12 +1,22 @@
 # api/router.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from .upload_file_utils import *
-from .database import get_db
-from .queries import *
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Request
+from typing import Optional
+import itertools
+from .upload_params import (
+    UPLOAD_CHUNK_SIZE,
+    validate_is_supported_file,
+    validate_is_valid_file_type,
+    validate_is_valid_loader
+)
+from .database import get_write_db, get_report_db, get_pool_stats, is_replica_session, ANALYTICS_ENGINE
+from .queries import select_employees_per_quarter, select_hiring_more_than_avg, stream_report_batches
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from .utils import *
-import pandas as pd
-from fastapi.responses import HTMLResponse
+from .report_cache import report_cache
+from .content_hash import ingest_if_changed, get_upload_message
+from .metrics import registry, report_query_seconds, time_first_batch, PROMETHEUS_CONTENT_TYPE
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 
 router = APIRouter()
 
@@ -21,84 +31,368 @@ def read_root():
     return "Simple application for a Challenge!"
 
 @router.post("/uploadDocument/{file_type}")
-def upload_document(file_type: str, file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_document(
+    file_type: str,
+    file: UploadFile = File(...),
+    stream: bool = False,
+    chunk_size: int = Query(UPLOAD_CHUNK_SIZE, ge=1),
+    loader: str = 'insert',
+    background: bool = False,
+    parallel: bool = False,
+    force: bool = False,
+    dry_run: bool = False,
+    db: Session = Depends(get_write_db)
+):
     """
-    Uploads a .csv document of the specified file_type to the database.
+    Uploads a .csv, Parquet or Arrow IPC document of the specified file_type to the database.
+    The parsing, validation and load run in the ingestion executor, outside of the event loop.
 
     Parameters:
         file_type (str): Type of the file being uploaded.
-        file (UploadFile): The .csv file to be uploaded (form-data, file param).
+        file (UploadFile): The .csv (without header), .parquet or .arrow/.feather/.ipc file to be uploaded
+            (form-data, file param). The columnar files are validated with the types of their columns
+            and always loaded with COPY.
+        stream (bool): Read, validate and load the file in chunks of chunk_size rows.
+        chunk_size (int): Number of rows of each chunk when stream is enabled.
+        loader (str): Strategy used to load the rows, 'insert' (multi-row upsert) or 'copy' (COPY into a staging table).
+        background (bool): Spool the file to disk and process it in chunks in the background,
+            responds 202 with the id of the job to poll at /uploadJobs/{job_id}.
+        parallel (bool): Split the file at newline aligned byte ranges parsed, validated and copied by a process pool,
+            the rows are committed at once. The rows are always loaded with COPY.
+        force (bool): Ingest the file even if it has the same content (SHA-256) as the last file ingested
+            of its file_type, such files are skipped by default.
+        dry_run (bool): Only validate the file in chunks of chunk_size rows without loading it, the full
+            validation report is streamed as NDJSON: a line per error, then a summary line.
         db (Session): The database session.
 
     Returns:
-        dict: A dictionary with a validation status or success message.
+        dict: A dictionary with a validation status or success message, with the number of records
+            inserted, updated and unchanged.
     """
-    # Validate the file provided is a .csv file
-    validate_is_csv_file(file)
+    # Validate the file provided is a .csv, Parquet or Arrow IPC file
+    file_format = validate_is_supported_file(file)
 
     # Validate against allowed files list
     validate_is_valid_file_type(file_type)
 
-    # Get the schema with the restrictions for the file
-    schema = get_file_schema(file_type)
-    
-    # Read a comma separated file without headers
-    df = read_comma_separated_no_header(file)
+    # Validate against allowed loaders list
+    validate_is_valid_loader(loader)
+
+    # The ingestion (pandas, pandas_schema) is imported by the first upload instead of on the start of the workers
+    from .ingestion import ingest_csv, ingest_csv_in_chunks, iter_dry_run_report, run_in_ingest_executor
+    from .ingestion_jobs import ingestion_jobs
+    from .parallel_ingestion import ingest_upload_parallel
+    from .columnar_upload import ingest_columnar_file
+
+    if file_format != 'csv':
+        if stream or parallel or background or dry_run:
+            raise HTTPException(
+                status_code=400,
+                detail="The stream, parallel, background and dry run modes are only available for CSV files"
+            )
+
+        # Validate the typed columns and copy them into the database without parsing text
+        progress = await run_in_ingest_executor(
+            ingest_if_changed, file_type, file, db, ingest_columnar_file, file_format, force=force
+        )
+
+        return {"message": get_upload_message(progress), **progress}
+
+    if dry_run:
+        # Validate the first chunk before responding, the errors reading the file are still reported with a 400
+        report = iter_dry_run_report(file_type, file, chunk_size)
+        first_lines = await run_in_ingest_executor(next, report)
+
+        return StreamingResponse(
+            itertools.chain([first_lines], report),
+            media_type="application/x-ndjson"
+        )
+
+    if background:
+        # Queue the processing of the file, large files would time out inside the request
+        job = await run_in_threadpool(ingestion_jobs.submit, file_type, file, chunk_size, loader, force)
 
-    # Add column names for a file without headers
-    assign_columns_no_header_file(df, schema)
+        return JSONResponse(
+            status_code=202,
+            content={
+                "message": "File accepted for processing",
+                "job_id": job.id,
+                "status_url": "/uploadJobs/{}".format(job.id)
+            }
+        )
+
+    if parallel:
+        # Process the byte ranges of the file in the worker processes and commit them at once
+        progress = await run_in_ingest_executor(
+            ingest_if_changed, file_type, file, db, ingest_upload_parallel, force=force
+        )
 
-    # Validate file content based on the restrictions defined in the schema configuration
-    validate_file_content(schema, df)
+        return {"message": get_upload_message(progress), **progress}
+
+    if stream:
+        # Process the file chunk by chunk keeping the memory bounded
+        progress = await run_in_ingest_executor(
+            ingest_if_changed, file_type, file, db, ingest_csv_in_chunks, chunk_size, loader, force=force
+        )
 
-    df = df.where(pd.notna(df), None)
+        return {"message": get_upload_message(progress), **progress}
 
-    # Load the file content into SQL
-    bulk_upsert_data_to_db(file_type, db, df)
+    # Read, validate and load the whole file
+    progress = await run_in_ingest_executor(ingest_if_changed, file_type, file, db, ingest_csv, loader, force=force)
     
-    return {"message": "File uploaded correctly"}
+    return {"message": get_upload_message(progress), **progress}
 
-@router.get("/employeePerQuarters", response_class=HTMLResponse)
-def get_employee_quarters(db: Session = Depends(get_db)):
+@router.post("/uploadDataset")
+async def upload_dataset(
+    departments: Optional[UploadFile] = File(None),
+    jobs: Optional[UploadFile] = File(None),
+    employees: Optional[UploadFile] = File(None),
+    dataset: Optional[UploadFile] = File(None),
+    loader: str = 'insert',
+    db: Session = Depends(get_write_db)
+):
     """
-    Retrieves the hired employees in 2021 splitted into quarters and presents it as an HTML table.
+    Uploads the departments, jobs and employees .csv documents in a single request. The files are read and validated
+    concurrently, then loaded in foreign key order within one transaction whose commit checks the references
+    of the employees: either every file is loaded or none of them.
 
     Parameters:
+        departments, jobs, employees (UploadFile): The .csv files (without header) of the dataset (form-data),
+            any of them can be omitted.
+        dataset (UploadFile): A .zip file with the .csv files instead of the separate files, each file is identified
+            by the end of its name (e.g. departments.csv, jobs.csv, hired_employees.csv).
+        loader (str): Strategy used to load the rows, 'insert' (multi-row upsert) or 'copy' (COPY into a staging table).
         db (Session): The database session.
+
+    Returns:
+        dict: A success message with the rows and the number of records inserted, updated and unchanged of each file.
+    """
+    # Validate against allowed loaders list
+    validate_is_valid_loader(loader)
+
+    # The ingestion (pandas, pandas_schema) is imported by the first upload instead of on the start of the workers
+    from .dataset_upload import open_dataset_zip, validate_dataset_files, ingest_dataset
+
+    files = {
+        file_type: file
+        for file_type, file in (("departments", departments), ("jobs", jobs), ("employees", employees))
+        if file is not None
+    }
+    if dataset is not None:
+        if files:
+            raise HTTPException(
+                status_code=400,
+                detail="Upload either the dataset .zip file or the separate .csv files, not both"
+            )
+        files = await run_in_threadpool(open_dataset_zip, dataset)
+
+    # Validate the dataset contains .csv files
+    validate_dataset_files(files)
+
+    # Read and validate the files concurrently, then load them with a single commit
+    results = await ingest_dataset(files, db, loader)
+
+    return {"message": "Dataset uploaded correctly", "files": results}
+
+@router.get("/uploadJobs/{job_id}")
+def get_upload_job(job_id: str):
+    """
+    Retrieves the status of an upload processed in the background.
+
+    Parameters:
+        job_id (str): The id returned by /uploadDocument/{file_type} with background enabled.
+
+    Returns:
+        dict: The status and stage (parsing, validating or loading) of the job, the rows processed,
+            the throughput and the validation errors.
+    """
+    from .ingestion_jobs import ingestion_jobs
+
+    return ingestion_jobs.get(job_id)
+
+def validate_year_range(year: int, year_to: Optional[int]) -> int:
+    """
+    Validate the range of years of a report, a single year when year_to isn't provided.
+
+    Returns:
+        int: The last year of the range.
+    """
+    if year_to is None:
+        return year
+
+    if year_to < year:
+        raise HTTPException(
+            status_code=400,
+            detail="The year_to: '{}' can't be lower than the year: '{}'".format(year_to, year)
+        )
+
+    return year_to
+
+async def prefetch_first_batch(batches):
+    """
+    Fetch the first batch of a report before the response starts, so the errors of the query
+    and the empty results can still be answered with an error status.
+
+    Returns:
+        tuple: The first batch (None when there are no rows) and an async iterator of every batch.
     """
     try:
-        
-        results = get_results_sql_employees_per_quarter(db)
+        first_batch = await batches.__anext__()
+    except StopAsyncIteration:
+        return None, batches
 
-        table_html = generate_table_html_employees_per_quarter(results)
+    async def all_batches():
+        yield first_batch
+        async for rows in batches:
+            yield rows
 
-        return table_html
+    return first_batch, all_batches()
+
+@router.get("/employeePerQuarters", response_class=StreamingResponse)
+async def get_employee_quarters(
+    request: Request,
+    year: int = 2021,
+    year_to: Optional[int] = None,
+    format: Optional[str] = None,
+    db = Depends(get_report_db)
+):
+    """
+    Retrieves the hired employees in a year (2021 by default) splitted into quarters. The rows are streamed from a
+    server-side cursor as an HTML table, or as JSON lines, CSV or Arrow IPC negotiated with the Accept header.
+
+    Parameters:
+        year (int): The year of the report, or the first year of the range when year_to is provided.
+        year_to (int): The last year (included) of a multi-year report, the HTML table then includes the year.
+        format (str): Output format overriding the Accept header, 'html', 'jsonl', 'csv' or 'arrow'.
+        db (Session or AsyncSession): The database session.
+    """
+    year_to = validate_year_range(year, year_to)
+    format = negotiate_report_format(request.headers.get("accept"), format)
+
+    # The HTML table shows the year only for the multi-year reports, the other formats always include it
+    include_year = format != 'html' or year_to != year
+    columns = EMPLOYEES_PER_QUARTER_COLUMNS if include_year else EMPLOYEES_PER_QUARTER_COLUMNS[1:]
+    writer = get_report_writer(format, columns)
+
+    if ANALYTICS_ENGINE:
+        # The rows are computed from the in-process snapshot of the employees
+        from .analytics import stream_analytics_report
+        stream = lambda: stream_analytics_report("employees_per_quarter", year, year_to)
+    else:
+        stream = lambda: stream_report_batches(db, select_employees_per_quarter(year, year_to))
+
+    # The rows are streamed from the database only when they aren't cached for the current data, the rows of
+    # the replica aren't cached as they can predate the generation bumped by the last upload
+    batches = report_cache.get_or_stream(
+        "employees_per_quarter",
+        lambda: time_first_batch(report_query_seconds, stream(), report="employees_per_quarter"),
+        year, year_to,
+        store=ANALYTICS_ENGINE or not is_replica_session(db)
+    )
+
+    try:
+        first_batch, batches = await prefetch_first_batch(batches)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/departmentsHiringMoreThanAvg", response_class=HTMLResponse)
-def get_hiring_more_than_avg( db: Session = Depends(get_db)):
+    if not include_year:
+        batches = ([row[1:] for row in rows] async for rows in batches)
+
+    return StreamingResponse(stream_report(writer, batches), media_type=writer.media_type)
+
+@router.get("/departmentsHiringMoreThanAvg", response_class=StreamingResponse)
+async def get_hiring_more_than_avg(
+    request: Request,
+    year: int = 2021,
+    year_to: Optional[int] = None,
+    format: Optional[str] = None,
+    db = Depends(get_report_db)
+):
     """
-    Retrieves departments with hiring counts higher than the average the departments hired in 2021 and presents the results as an HTML table.
+    Retrieves departments with hiring counts higher than the average the departments hired in a year (2021 by default).
+    The averages and the filter are computed in a single query whose rows are streamed as an HTML table,
+    or as JSON lines, CSV or Arrow IPC negotiated with the Accept header.
 
     Parameters:
-        db (Session): The database session.
+        year (int): The year of the report, or the first year of the range when year_to is provided.
+        year_to (int): The last year (included) of a multi-year report, each year is compared with its own average.
+        format (str): Output format overriding the Accept header, 'html', 'jsonl', 'csv' or 'arrow'.
+        db (Session or AsyncSession): The database session.
     """
-    subquery = get_subquery_avg_hiring_per_department_only2021(db)
+    year_to = validate_year_range(year, year_to)
+    format = negotiate_report_format(request.headers.get("accept"), format)
+
+    # The HTML table shows the year only for the multi-year reports, the other formats always include it
+    include_year = format != 'html' or year_to != year
+    columns = HIRING_MORE_THAN_AVG_COLUMNS if include_year else HIRING_MORE_THAN_AVG_COLUMNS[1:]
+    writer = get_report_writer(format, columns)
 
-    # Get the average of all departments 2021
-    avg_value = get_avg_all_departments_hiring_subquery(db, subquery)
+    if ANALYTICS_ENGINE:
+        # The rows are computed from the in-process snapshot of the employees
+        from .analytics import stream_analytics_report
+        stream = lambda: stream_analytics_report("hiring_more_than_avg", year, year_to)
+    else:
+        stream = lambda: stream_report_batches(db, select_hiring_more_than_avg(year, year_to))
 
-    # Check if the average exist
-    if avg_value is None:
+    # The rows are streamed from the database only when they aren't cached for the current data, the rows of
+    # the replica aren't cached as they can predate the generation bumped by the last upload
+    batches = report_cache.get_or_stream(
+        "hiring_more_than_avg",
+        lambda: time_first_batch(report_query_seconds, stream(), report="hiring_more_than_avg"),
+        year, year_to,
+        store=ANALYTICS_ENGINE or not is_replica_session(db)
+    )
+
+    try:
+        first_batch, batches = await prefetch_first_batch(batches)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Check if the average exist, every year with hires returns at least one row
+    if not first_batch:
         raise HTTPException(
             400,
             detail="Data does not contain the values to compute the average!"
         )
 
-    results = get_sql_results_hiring_more_than_avg(db, avg_value)
+    # Discard the rows of the years where no department hired more than the average
+    first_column = 0 if include_year else 1
+    batches = ([row[first_column:] for row in rows if row.id is not None] async for rows in batches)
+
+    return StreamingResponse(stream_report(writer, batches), media_type=writer.media_type)
 
-    table_html = generate_table_html_hiring_more_than_avg(results)
+@router.get("/cacheStats")
+def get_cache_stats():
+    """
+    Retrieves the counters of the report results cache.
 
-    return table_html
+    Returns:
+        dict: The hits, misses and evictions of the cache, its size and the current data generation,
+            with the generation, employees, reloads and deltas of the analytics snapshot when it's enabled.
+    """
+    if ANALYTICS_ENGINE:
+        from .analytics import analytics_engine
+        return {**report_cache.stats(), "analytics": analytics_engine.stats()}
+
+    return report_cache.stats()
+
+@router.get("/poolStats")
+def get_connection_pool_stats():
+    """
+    Retrieves the usage of the database connection pools of this worker.
+
+    Returns:
+        dict: For each engine, the size of the pool, the connections checked in and out, the overflow
+            and the number of checkouts, timeouts and the total, average and maximum seconds waited.
+    """
+    return get_pool_stats()
+
+@router.get("/metrics")
+def get_metrics():
+    """
+    Retrieves the metrics of this worker in the Prometheus text format: the latency of each ingestion stage
+    and report query, the rows, seconds and bytes of the ingestion and the failed uploads by file type.
+    """
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -2,66 +2,101 @@ from pandas_schema import Schema, Column
 from fastapi import HTTPException, UploadFile
 import pandas as pd
 from pandas_schema.validation import CustomSeriesValidation
+from pandas.api.types import infer_dtype, is_bool_dtype, is_integer_dtype, is_float_dtype, is_object_dtype
+from functools import lru_cache
+import numpy as np
+import gzip
+import io
+import os
 import re
+import zlib
+from .upload_params import (
+    UPLOAD_FILE_FORMATS,
+    UPLOAD_COMPRESSIONS,
+    is_allowed_file,
+    is_allowed_loader,
+    validate_is_csv_file,
+    get_upload_file_format,
+    get_upload_compression,
+    validate_is_supported_file,
+    validate_is_valid_file_type,
+    validate_is_valid_loader
+)
+
+
+# Regular expression pattern for ISO format timestamp, compiled once for every validation
+ISO_TIMESTAMP_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$')
+
+# Format of the ISO timestamps, used to parse them into dates
+ISO_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Inferred types of object columns whose values are all strings or nulls
+STRING_INFERRED_TYPES = ('string', 'empty')
+
+# Maximum number of validation errors reported for a file, the columns left are not validated once it's reached
+VALIDATION_MAX_ERRORS = int(os.environ.get('VALIDATION_MAX_ERRORS', 1000))
+
+# Number of rows kept as a sample in the summary of the errors of every column
+VALIDATION_ERROR_SAMPLES = int(os.environ.get('VALIDATION_ERROR_SAMPLES', 5))
 
 
 def is_integer_or_float_with_decimal_zero_or_null(series):
-    try:
-        # Check if each value is an integer, a float (ending with '.0'), or null (NaN)
-        is_int_or_float_with_decimal_zero_or_null = series.apply(
-            lambda x: isinstance(x, (int, float)) and (x.is_integer() if isinstance(x, float) else True) or pd.isna(x)
-        )
-    except AttributeError:
-        # If any value cannot be checked, return False
-        return pd.Series(False, index=series.index)
-    return is_int_or_float_with_decimal_zero_or_null
+    # Check if each value is an integer, a float (ending with '.0'), or null (NaN)
+    return is_integer_or_float_with_decimal_zero(series) | series.isna()
 
 def is_integer_or_float_with_decimal_zero(series):
-    try:
-        # Check if each value is an integer or a float (ending with '.0')
-        is_int_or_float_with_decimal_zero = series.apply(
-            lambda x: isinstance(x, (int, float)) and (x.is_integer() if isinstance(x, float) else True)
-        )
-    except AttributeError:
-        # If any value cannot be checked, return False
+    # Check if each value is an integer or a float (ending with '.0')
+    if is_bool_dtype(series) or is_integer_dtype(series):
+        # Every value is an integer, only the nulls of the nullable integer types fail
+        return series.notna().astype(bool)
+
+    if is_float_dtype(series):
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        return pd.Series(np.isfinite(values) & (np.floor(values) == values), index=series.index)
+
+    if infer_dtype(series, skipna=True) in STRING_INFERRED_TYPES:
+        # Text columns only contain strings and nulls, none of them is a number
         return pd.Series(False, index=series.index)
-    return is_int_or_float_with_decimal_zero
+
+    # Columns mixing numbers and other objects are checked value by value
+    return series.apply(
+        lambda x: isinstance(x, (int, float)) and (x.is_integer() if isinstance(x, float) else True)
+    ).astype(bool)
 
 def is_iso_timestamp(series):
-    try:
-        # Regular expression pattern for ISO format timestamp
-        iso_pattern = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$'
+    # Check if each value matches the ISO format pattern, or if it's a null value (None and NaN)
+    is_null = series.isna()
 
-        # Check if each value matches the ISO format pattern, or if it's a non-string value (including None and NaN)
-        is_iso_timestamp = series.apply(lambda x: pd.isna(x) or (isinstance(x, str) and bool(re.match(iso_pattern, x))))
-    except AttributeError:
-        # If any value cannot be checked, return False
-        return pd.Series(False, index=series.index)
-    return is_iso_timestamp
+    if is_object_dtype(series) or isinstance(series.dtype, pd.StringDtype):
+        if infer_dtype(series, skipna=True) in STRING_INFERRED_TYPES + ('mixed', 'mixed-integer'):
+            # Values that aren't strings never match the pattern
+            matches = series.str.match(ISO_TIMESTAMP_PATTERN, na=False)
+
+            # The timestamps are stored as dates, the matching values must also exist in the calendar (no month 13)
+            dates = pd.to_datetime(series.where(matches), format=ISO_TIMESTAMP_FORMAT, errors='coerce')
+            matches = matches & dates.notna()
+            return (is_null | matches).astype(bool)
+
+    # Columns without strings can only contain valid nulls
+    return is_null.astype(bool)
 
 def is_string(series):
-    try:
-        # Check if each value matches the ISO format pattern, or if it's a non-string value (including None and NaN)
-        is_string = series.apply(lambda x: pd.isna(x) or isinstance(x, str))
-    except AttributeError:
-        # If any value cannot be checked, return False
-        return pd.Series(False, index=series.index)
-    return is_string
+    # Check if each value is a string or a null value (None and NaN)
+    is_null = series.isna()
 
+    if isinstance(series.dtype, pd.StringDtype):
+        return pd.Series(True, index=series.index)
 
-def is_allowed_file(file_type) -> bool:
-    """
-    Return if the file is allowed to start the upload/validation process.
-    Parameters:
-    file_type: str with the file_type provided as upload param
-    """
-    valid_files = [
-        'jobs', 
-        'departments', 
-        'employees'
-    ]
+    if not is_object_dtype(series):
+        # Numeric and datetime columns can only contain valid nulls
+        return is_null.astype(bool)
+
+    if infer_dtype(series, skipna=True) in STRING_INFERRED_TYPES:
+        return pd.Series(True, index=series.index)
+
+    # Columns mixing strings and other objects are checked value by value
+    return series.apply(lambda x: pd.isna(x) or isinstance(x, str)).astype(bool)
 
-    return file_type in valid_files
 
 def get_employees_schema() -> Schema:
     """
@@ -96,6 +131,20 @@ def get_jobs_schema() -> Schema:
         Column('job', [CustomSeriesValidation(is_string, 'Column should contain only strings.')])
     ])
 
+@lru_cache(maxsize=None)
+def get_valid_file_schemas() -> dict:
+    """
+    Build the schemas of every allowed file once per process, they are only read by the validations.
+
+    Returns:
+    dict with the Schema of each file_type.
+    """
+    return {
+        'jobs': get_jobs_schema(),
+        'departments': get_departments_schema(),
+        'employees': get_employees_schema()
+    }
+
 def get_file_schema(file_type) -> Schema:
     """
     Get the correct schema depending on the file_type to validate.
@@ -105,14 +154,8 @@ def get_file_schema(file_type) -> Schema:
     Returns: 
     Schema with the expected columns for the file employees.
     """
-    valid_file_schemas = {
-        'jobs': get_jobs_schema(),
-        'departments': get_departments_schema(),
-        'employees': get_employees_schema()
-    }
-
     try:
-        schema = valid_file_schemas[file_type]
+        schema = get_valid_file_schemas()[file_type]
 
     except KeyError:
         raise HTTPException(
@@ -122,51 +165,196 @@ def get_file_schema(file_type) -> Schema:
 
     return schema
 
-def validate_is_csv_file(file: UploadFile) -> None:
+class ValidationReport:
+    """
+    Collect the validation errors of a file column by column. Every error is counted and summarized
+    by column and message, but only the first max_errors are kept (every one of them when max_errors is None).
+    """
+
+    def __init__(self, max_errors=VALIDATION_MAX_ERRORS, samples: int = VALIDATION_ERROR_SAMPLES):
+        self.max_errors = max_errors
+        self.samples = samples
+        self.errors = []
+        self.error_count = 0
+        self.summaries = {}
+        self.aborted = False
+
+    @property
+    def is_full(self) -> bool:
+        return self.max_errors is not None and self.error_count >= self.max_errors
+
+    def add(self, column, message: str, rows: list):
+        """
+        Add the rows failing a validation of a column.
+        """
+        self.error_count += len(rows)
+
+        summary = self.summaries.setdefault((column, message), {
+            "column": column,
+            "message": message,
+            "count": 0,
+            "sample_rows": []
+        })
+        summary["count"] += len(rows)
+        summary["sample_rows"] += rows[:self.samples - len(summary["sample_rows"])]
+
+        kept = rows if self.max_errors is None else rows[:max(self.max_errors - len(self.errors), 0)]
+        self.errors += [{"row": row, "column": column, "message": message} for row in kept]
+
+    def validate_column(self, column: Column, series: pd.Series):
+        """
+        Run the validations of a schema column on its values, skipping the empty values as pandas-schema
+        when the column allows them.
+        """
+        for validation in column.validations:
+            failed = ~validation.validate(series)
+            if column.allow_empty:
+                if is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+                    failed = failed & series.notna()
+                else:
+                    failed = failed & (series.str.len() > 0)
+
+            rows = series.index[np.asarray(failed, dtype=bool)].tolist()
+            if rows:
+                self.add(column.name, validation.message, rows)
+
+    def extend(self, other: 'ValidationReport', offset: int = 0):
+        """
+        Add the errors of the report of another part of the file, whose rows start at offset.
+        """
+        for summary in other.summaries.values():
+            total = self.summaries.setdefault((summary["column"], summary["message"]), {
+                "column": summary["column"],
+                "message": summary["message"],
+                "count": 0,
+                "sample_rows": []
+            })
+            total["count"] += summary["count"]
+            total["sample_rows"] += [row + offset for row in summary["sample_rows"]][:self.samples - len(total["sample_rows"])]
+
+        kept = other.errors if self.max_errors is None else other.errors[:max(self.max_errors - len(self.errors), 0)]
+        self.errors += [{**error, "row": error["row"] + offset} for error in kept]
+        self.error_count += other.error_count
+        self.aborted = self.aborted or other.aborted
+
+    def detail(self) -> dict:
+        """
+        Returns:
+        dict: The detail of the validation failure, the errors kept sorted by row as pandas-schema reports them.
+        """
+        return {
+            "status": "Upload Failure",
+            "content_validation_error": sorted(self.errors, key=lambda error: error["row"]),
+            "error_count": self.error_count,
+            "errors_truncated": len(self.errors) < self.error_count,
+            "validation_aborted": self.aborted,
+            "column_summaries": list(self.summaries.values())
+        }
+
+def get_validation_report(schema: Schema, df: pd.DataFrame, max_errors=VALIDATION_MAX_ERRORS) -> ValidationReport:
     """
-    Validate a file is .csv
+    Validate the file against its defined Schema column by column, the validation stops
+    before the next column once max_errors errors were found.
     Params:
-    file (Upload File): The file uploaded by the user.
+    schema (Schema): The Schema defined for the file.
+    df (pd.DataFrame):  The pandas DataFrame containing the uploaded file information.
+    max_errors (int): Maximum number of errors found before stopping, None to validate every column.
+
+    Returns:
+    ValidationReport: The errors found.
+    """
+    report = ValidationReport(max_errors)
+
+    if len(df.columns) != len(schema.columns):
+        report.add(None, 'Invalid number of columns. The schema specifies {}, but the data frame has {}'.format(
+            len(schema.columns), len(df.columns)
+        ), [-1])
+        return report
+
+    # The columns of the schema are matched by position, as pandas-schema does
+    for position, column in enumerate(schema.columns):
+        if report.is_full:
+            report.aborted = True
+            break
+        report.validate_column(column, df.iloc[:, position])
+
+    return report
+
+def validate_file_content(schema: Schema, df: pd.DataFrame, max_errors=VALIDATION_MAX_ERRORS):
     """
-    if not file.filename.endswith('.csv'):
+    Validate the file against its defined Schema and potentially defined constraints, 
+    use the validations of the pandas-schema library, reporting at most max_errors errors
+    and a summary of the errors of every column.
+    Params:
+    schema (Schema): The Schema defined for the file.
+    df (pd.DataFrame):  The pandas DataFrame containing the uploaded file information. 
+    max_errors (int): Maximum number of errors found before stopping, None to validate every column.
+    """
+    report = get_validation_report(schema, df, max_errors)
+    if report.error_count > 0:
         raise HTTPException(
             status_code=400,
-            detail="The file format is not allowed, please use CSV files!"
+            detail=report.detail()
         )
 
-def validate_is_valid_file_type(file_type: str):
+def import_zstandard():
     """
-    Validate the file_type provided is in the allowed files provided the logic of is_allowed_file function 
+    Import zstandard, only required by the .csv.zst uploads.
     """
-    if not is_allowed_file(file_type):
+    try:
+        import zstandard
+    except ImportError:
         raise HTTPException(
             status_code=400,
-            detail="File type: '{}' is not valid file".format(file_type)
+            detail="Zstandard compressed files are not supported by this server, please use .csv or .csv.gz files!"
         )
 
-def validate_file_content(schema: Schema, df: pd.DataFrame):
+    return zstandard
+
+class DecompressingReader(io.RawIOBase):
     """
-    Validate the file against its defined Schema and potentially defined constraints, 
-    use the pandas-schema library to perform the validation
+    Read the decompressed content of a stream, the corrupted content fails the upload as a bad request.
+    """
+
+    def __init__(self, stream, errors: tuple):
+        self.stream = stream
+        self.errors = errors
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            data = self.stream.read(len(buffer))
+        except self.errors:
+            raise HTTPException(
+                status_code=400,
+                detail="The compressed file could not be decompressed, please verify the uploaded file!"
+            )
+
+        buffer[:len(data)] = data
+        return len(data)
+
+def decompress_upload(file: UploadFile) -> UploadFile:
+    """
+    Wrap a compressed CSV file (.csv.gz or .csv.zst) so it's decompressed as it's read,
+    the whole decompressed content is never held in memory. The uncompressed files are returned as they are.
     Params:
-    schema (Schema): The Schema defined for the file.
-    df (pd.DataFrame):  The pandas DataFrame containing the uploaded file information. 
+    file (Upload File): The file uploaded by the user.
     """
-    errors = schema.validate(df)
-    if len(errors) > 0:
-        errors = [{
-            "row": error.row, 
-            "column": error.column, 
-            "message": error.message
-        } for error in errors]
-        
-        raise HTTPException(
-            status_code=400,
-            detail={
-                "status": "Upload Failure",
-                "content_validation_error": errors
-            }
-        )
+    compression = get_upload_compression(file.filename or '')
+    if compression is None:
+        return file
+
+    if compression == 'gzip':
+        stream, errors = gzip.GzipFile(fileobj=file.file, mode='rb'), (OSError, EOFError, zlib.error)
+    else:
+        zstandard = import_zstandard()
+        # Files written by parallel compressors contain several frames
+        stream = zstandard.ZstdDecompressor().stream_reader(file.file, read_across_frames=True)
+        errors = (zstandard.ZstdError,)
+
+    return UploadFile(io.BufferedReader(DecompressingReader(stream, errors)), filename=file.filename)
 
 def read_comma_separated_no_header(file: UploadFile):
     """
@@ -189,6 +377,32 @@ def read_comma_separated_no_header(file: UploadFile):
         
     return df
 
+def read_comma_separated_no_header_chunks(file: UploadFile, chunk_size: int):
+    """
+    Read a comma separated file uploaded by the user in chunks of a fixed number of rows,
+    so only one chunk is held in memory at a time. The index of each chunk continues the
+    row numbering of the previous one, keeping the row of validation errors absolute.
+    Params:
+    file (Upload File): The file uploaded by the user.
+    chunk_size (int): Number of rows of each chunk.
+
+    Yields: pandas DataFrames with at most chunk_size rows.
+    """
+    try:
+        with pd.read_csv(file.file, sep=',', header=None, chunksize=chunk_size) as reader:
+            for df in reader:
+                yield df
+    except pd.errors.ParserError as e:
+        raise HTTPException(
+            status_code=400,
+            detail="Parsing error reading the CSV file, please verify the file content!"
+        )
+    except pd.errors.EmptyDataError as e: 
+        raise HTTPException(
+            status_code=400,
+            detail="The file provided was empty, please verify the uploaded file!"
+        )
+
 def assign_columns_no_header_file(df: pd.DataFrame, schema: Schema):
     """
     The files uploaded don't contain a header, therefore we recover the original name of each column based on the schema, 
@@ -0,0 +1,122 @@
+from fastapi import HTTPException, UploadFile
+import os
+
+# Default number of rows read, validated and loaded at once by the streaming ingestion
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 50000))
+
+# Formats of the uploaded files by their extension, the columnar formats require pyarrow
+UPLOAD_FILE_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow'
+}
+
+# Compressions of the uploaded CSV files by their extension (e.g. employees.csv.gz), zstd requires zstandard
+UPLOAD_COMPRESSIONS = {
+    '.gz': 'gzip',
+    '.zst': 'zstd'
+}
+
+
+def is_allowed_file(file_type) -> bool:
+    """
+    Return if the file is allowed to start the upload/validation process.
+    Parameters:
+    file_type: str with the file_type provided as upload param
+    """
+    valid_files = [
+        'jobs', 
+        'departments', 
+        'employees'
+    ]
+
+    return file_type in valid_files
+
+def is_allowed_loader(loader) -> bool:
+    """
+    Return if the loader is one of the available strategies to load the file into the database.
+    Parameters:
+    loader: str with the loader provided as upload param
+    """
+    valid_loaders = [
+        'insert',
+        'copy'
+    ]
+
+    return loader in valid_loaders
+
+def validate_is_csv_file(file: UploadFile) -> None:
+    """
+    Validate a file is .csv
+    Params:
+    file (Upload File): The file uploaded by the user.
+    """
+    if not file.filename.endswith('.csv'):
+        raise HTTPException(
+            status_code=400,
+            detail="The file format is not allowed, please use CSV files!"
+        )
+
+def get_upload_compression(filename: str):
+    """
+    Get the compression of an uploaded CSV file ('gzip' or 'zstd') from its extension, None if it isn't compressed.
+    """
+    for extension, compression in UPLOAD_COMPRESSIONS.items():
+        if filename.lower().endswith('.csv' + extension):
+            return compression
+
+    return None
+
+def get_upload_file_format(filename: str):
+    """
+    Get the format of an uploaded file ('csv', 'parquet' or 'arrow') from its extension, None if it isn't supported.
+    The compressed CSV files (.csv.gz, .csv.zst) are CSV files.
+    """
+    if get_upload_compression(filename) is not None:
+        return 'csv'
+
+    for extension, file_format in UPLOAD_FILE_FORMATS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+
+    return None
+
+def validate_is_supported_file(file: UploadFile) -> str:
+    """
+    Validate a file is .csv (optionally compressed), Parquet or Arrow IPC
+    Params:
+    file (Upload File): The file uploaded by the user.
+
+    Returns:
+    str: The format of the file, 'csv', 'parquet' or 'arrow'.
+    """
+    file_format = get_upload_file_format(file.filename)
+    if file_format is None:
+        raise HTTPException(
+            status_code=400,
+            detail="The file format is not allowed, please use CSV (.csv, .csv.gz or .csv.zst), Parquet or Arrow IPC files!"
+        )
+
+    return file_format
+
+def validate_is_valid_file_type(file_type: str):
+    """
+    Validate the file_type provided is in the allowed files provided the logic of is_allowed_file function 
+    """
+    if not is_allowed_file(file_type):
+        raise HTTPException(
+            status_code=400,
+            detail="File type: '{}' is not valid file".format(file_type)
+        )
+
+def validate_is_valid_loader(loader: str):
+    """
+    Validate the loader provided is in the allowed loaders provided the logic of is_allowed_loader function
+    """
+    if not is_allowed_loader(loader):
+        raise HTTPException(
+            status_code=400,
+            detail="Loader: '{}' is not a valid loader".format(loader)
+        )
@@ -1,50 +1,207 @@
-def generate_table_html_hiring_more_than_avg(results: dict):
+from fastapi import HTTPException
+import csv
+import io
+import json
+
+# Columns of the employees per quarter report: (name, HTML header, Arrow type)
+EMPLOYEES_PER_QUARTER_COLUMNS = [
+    ('year', 'Year', 'int32'),
+    ('department', 'Department', 'string'),
+    ('job', 'Job', 'string'),
+    ('Q1', 'Q1', 'int64'),
+    ('Q2', 'Q2', 'int64'),
+    ('Q3', 'Q3', 'int64'),
+    ('Q4', 'Q4', 'int64')
+]
+
+# Columns of the departments hiring more than the average report: (name, HTML header, Arrow type)
+HIRING_MORE_THAN_AVG_COLUMNS = [
+    ('year', 'year', 'int32'),
+    ('id', 'id', 'int32'),
+    ('department', 'department', 'string'),
+    ('hired', 'hired', 'int64')
+]
+
+# Output formats of the reports by their media type
+REPORT_MEDIA_TYPES = {
+    'html': 'text/html',
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+
+class HTMLTableWriter:
+    """
+    Writes the rows of a report as an HTML table.
+    """
+    media_type = REPORT_MEDIA_TYPES['html']
+
+    def __init__(self, columns: list):
+        self.columns = columns
+
+    def header(self) -> str:
+        headers = "".join(f"<th>{header}</th>" for name, header, arrow_type in self.columns)
+        return f"<table border='1'>\n<tr>{headers}</tr>\n"
+
+    def rows(self, rows) -> str:
+        return "".join(
+            "<tr>" + "".join(f"<td>{value}</td>" for value in row) + "</tr>\n"
+            for row in rows
+        )
+
+    def footer(self) -> str:
+        return "</table>"
+
+class JSONLinesWriter:
+    """
+    Writes the rows of a report as JSON lines, one object per row.
+    """
+    media_type = REPORT_MEDIA_TYPES['jsonl']
+
+    def __init__(self, columns: list):
+        self.names = [name for name, header, arrow_type in columns]
+
+    def header(self) -> str:
+        return ""
+
+    def rows(self, rows) -> str:
+        return "".join(json.dumps(dict(zip(self.names, row)), default=str) + "\n" for row in rows)
+
+    def footer(self) -> str:
+        return ""
+
+class CSVWriter:
+    """
+    Writes the rows of a report as a comma separated file with a header.
+    """
+    media_type = REPORT_MEDIA_TYPES['csv']
+
+    def __init__(self, columns: list):
+        self.names = [name for name, header, arrow_type in columns]
+
+    def header(self) -> str:
+        return self.rows([self.names])
+
+    def rows(self, rows) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue()
+
+    def footer(self) -> str:
+        return ""
+
+class ArrowStreamWriter:
+    """
+    Writes the rows of a report in the Arrow IPC streaming format, one record batch per batch of rows.
+    pyarrow is an optional dependency, only required by this format.
     """
-    Create the response table for the departments hiring more than the 2021 average.
+    media_type = REPORT_MEDIA_TYPES['arrow']
+
+    def __init__(self, columns: list):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.schema = pa.schema([(name, pa.type_for_alias(arrow_type)) for name, header, arrow_type in columns])
+        self._buffer = io.BytesIO()
+        self._writer = pa.ipc.new_stream(self._buffer, self.schema)
+
+    def _flush(self) -> bytes:
+        content = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return content
+
+    def header(self) -> bytes:
+        return self._flush()
+
+    def rows(self, rows) -> bytes:
+        arrays = [
+            self._pa.array(values, type=field.type)
+            for values, field in zip(zip(*rows), self.schema)
+        ] if rows else [self._pa.array([], type=field.type) for field in self.schema]
+        self._writer.write_batch(self._pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self._flush()
+
+    def footer(self) -> bytes:
+        self._writer.close()
+        return self._flush()
+
+REPORT_WRITERS = {
+    'html': HTMLTableWriter,
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'arrow': ArrowStreamWriter
+}
+
+def negotiate_report_format(accept: str, format: str = None) -> str:
+    """
+    Choose the output format of a report, the format parameter when provided, otherwise
+    the supported media type with the highest quality in the Accept header (HTML by default).
     Params:
-    results (dict): Dictionary containing the rows content of the response table
+    accept (str): The Accept header of the request.
+    format (str): The format requested explicitly ('html', 'jsonl', 'csv' or 'arrow').
     """
-    result_list = [
-        {
-                'id': department_id,
-                'department': department,
-                'hired': hired
-            }
-            for department_id, department, hired in results
-        ]
+    if format is not None:
+        if format not in REPORT_MEDIA_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail="Format: '{}' is not valid, use one of {}".format(format, list(REPORT_MEDIA_TYPES))
+            )
+        return format
+
+    if not accept:
+        return 'html'
 
-    # Generate the HTML table
-    table_html = "<table border='1'>\n<tr><th>id</th><th>department</th><th>hired</th></tr>\n"
+    media_ranges = []
+    for position, media_range in enumerate(accept.split(',')):
+        media_type, *parameters = [part.strip() for part in media_range.split(';')]
+        quality = 1.0
+        for parameter in parameters:
+            if parameter.startswith('q='):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        media_ranges.append((-quality, position, media_type.lower()))
 
-    for row in result_list:
-        table_html += f"<tr><td>{row['id']}</td><td>{row['department']}</td><td>{row['hired']}</td></tr>\n"
+    for negative_quality, position, media_type in sorted(media_ranges):
+        if negative_quality == 0:
+            break
+        if media_type in ('*/*', 'text/*'):
+            return 'html'
+        for format, report_media_type in REPORT_MEDIA_TYPES.items():
+            if media_type == report_media_type:
+                return format
 
-    table_html += "</table>"
-    return table_html
+    raise HTTPException(
+        status_code=406,
+        detail="The reports are available as {}".format(list(REPORT_MEDIA_TYPES.values()))
+    )
 
-def generate_table_html_employees_per_quarter(results):
+def get_report_writer(format: str, columns: list):
     """
-    Create the response table for the employees hired per quarter in 2021
+    Create the writer of a report for the negotiated format.
     Params:
-    results (dict): Dictionary containing the rows content of the response table
-    """
-    result_list = [
-        {
-                'job': job_title,
-                'department': department,
-                'Q1': q1_sum,
-                'Q2': q2_sum,
-                'Q3': q3_sum,
-                'Q4': q4_sum
-            }
-            for job_title, department, q1_sum, q2_sum, q3_sum, q4_sum in results
-        ]
-
-        # Generate the HTML table
-    table_html = "<table border='1'>\n<tr><th>Department</th><th>Job</th><th>Q1</th><th>Q2</th><th>Q3</th><th>Q4</th></tr>\n"
-
-    for row in result_list:
-        table_html += f"<tr><td>{row['job']}</td><td>{row['department']}</td><td>{row['Q1']}</td><td>{row['Q2']}</td><td>{row['Q3']}</td><td>{row['Q4']}</td></tr>\n"
-
-    table_html += "</table>"
-    return table_html
+    format (str): The format returned by negotiate_report_format.
+    columns (list): The columns of the report, as (name, HTML header, Arrow type).
+    """
+    try:
+        return REPORT_WRITERS[format](columns)
+    except ImportError:
+        raise HTTPException(
+            status_code=406,
+            detail="The Arrow format is not available, pyarrow is not installed"
+        )
+
+async def stream_report(writer, batches):
+    """
+    Stream a report written by the writer, batch by batch, as they are fetched from the database.
+    Params:
+    writer: The writer of the report format.
+    batches: Async iterable of lists of rows.
+    """
+    yield writer.header()
+    async for rows in batches:
+        yield writer.rows(rows)
+    yield writer.footer()
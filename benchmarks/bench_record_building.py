@@ -0,0 +1,59 @@
+"""
+Microbenchmark of the conversion of a validated employees DataFrame into the upsert records,
+comparing the former df.iterrows() loop with the columnar conversion. It doesn't need a database.
+
+Usage:
+    python -m benchmarks.bench_record_building --rows 1000000
+"""
+import argparse
+import os
+import time
+import pandas as pd
+
+# The engine is created on import but never connected by this benchmark
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/benchmark")
+
+from app.loaders import iter_dataframe_records  # noqa: E402
+from benchmarks.generate_data import generate_dataframe  # noqa: E402
+
+
+def iterrows_records(df: pd.DataFrame) -> list:
+    """
+    The row by row conversion used before the columnar one.
+    """
+    employees = []
+    for idx, row in df.iterrows():
+        employees.append(
+            {
+                "id": int(row['id']),
+                "name": row['name'],
+                "datetime": row['datetime'],
+                "department_id": int(row['department_id']) if not pd.isna(row['department_id']) else None,
+                "job_id": int(row['job_id']) if not pd.isna(row['job_id']) else None
+            }
+        )
+    return employees
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    df = generate_dataframe("employees", args.rows, departments=50, jobs=200, null_share=0.01)
+
+    start = time.perf_counter()
+    expected = iterrows_records(df.where(pd.notna(df), None))
+    iterrows_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = list(iter_dataframe_records("employees", df))
+    columnar_seconds = time.perf_counter() - start
+
+    assert len(records) == len(expected)
+    print("iterrows: {:8.2f}s   columnar: {:8.2f}s   speedup: {:.1f}x".format(
+        iterrows_seconds, columnar_seconds, iterrows_seconds / columnar_seconds
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Generate reproducible departments, jobs and employees files in the format of /uploadDocument
+(comma separated, without header), with a configurable share of null and invalid values.
+The files are written in chunks so even the largest ones (tens of millions of rows) use bounded memory.
+
+Usage:
+    python -m benchmarks.generate_data --rows 1000000 --output-dir /tmp/challenge_data
+    python -m benchmarks.generate_data --file-type employees --rows 50000000 --null-share 0.01 --invalid-share 0.001
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# Number of rows generated and written at once
+GENERATE_CHUNK_SIZE = 1000000
+
+# Bounds of the number of rows of the generated files
+MIN_ROWS = 10000
+MAX_ROWS = 50000000
+
+# Hire dates are spread over these years
+HIRE_YEARS = (2019, 2023)
+
+# Values that fail the validation of each kind of column
+INVALID_VALUES = {
+    "integer": "not-a-number",
+    "string": 1.5,
+    "timestamp": "2021-13-45 25:61:00",
+}
+
+
+def get_chunk_rng(seed: int, chunk_number: int) -> np.random.Generator:
+    """
+    Random generator of a chunk, the content of every chunk only depends on the seed and its position.
+    """
+    return np.random.default_rng([seed, chunk_number])
+
+def apply_shares(df: pd.DataFrame, columns: dict, rng: np.random.Generator, null_share: float, invalid_share: float):
+    """
+    Replace a share of the values of each column with nulls and another share with invalid values.
+    Params:
+    df (pd.DataFrame): The generated rows.
+    columns (dict): The kind ('integer', 'string' or 'timestamp') of each column receiving the nulls and invalid values.
+    rng (np.random.Generator): The random generator of the chunk.
+    null_share (float): Share of nulls of the nullable columns.
+    invalid_share (float): Share of invalid values of every column.
+    """
+    for column, kind in columns.items():
+        if null_share > 0 and column != "id":
+            if kind == "integer":
+                # Nullable integers are written without the decimals of the floats
+                df[column] = df[column].astype("Int64")
+            df.loc[rng.random(len(df)) < null_share, column] = None
+
+        if invalid_share > 0:
+            invalid = rng.random(len(df)) < invalid_share
+            if invalid.any():
+                df[column] = df[column].astype(object)
+                df.loc[invalid, column] = INVALID_VALUES[kind]
+
+def generate_departments_chunk(start: int, rows: int, rng: np.random.Generator,
+                               null_share: float = 0.0, invalid_share: float = 0.0) -> pd.DataFrame:
+    """
+    Generate the departments with ids start + 1 to start + rows.
+    """
+    ids = np.arange(start + 1, start + rows + 1)
+    df = pd.DataFrame({"id": ids, "department": ["Department {}".format(i) for i in ids]})
+    apply_shares(df, {"id": "integer", "department": "string"}, rng, null_share, invalid_share)
+
+    return df
+
+def generate_jobs_chunk(start: int, rows: int, rng: np.random.Generator,
+                        null_share: float = 0.0, invalid_share: float = 0.0) -> pd.DataFrame:
+    """
+    Generate the jobs with ids start + 1 to start + rows.
+    """
+    ids = np.arange(start + 1, start + rows + 1)
+    df = pd.DataFrame({"id": ids, "job": ["Job {}".format(i) for i in ids]})
+    apply_shares(df, {"id": "integer", "job": "string"}, rng, null_share, invalid_share)
+
+    return df
+
+def generate_employees_chunk(start: int, rows: int, rng: np.random.Generator, departments: int = 50, jobs: int = 200,
+                             null_share: float = 0.0, invalid_share: float = 0.0) -> pd.DataFrame:
+    """
+    Generate the employees with ids start + 1 to start + rows, hired between the HIRE_YEARS
+    in the given number of departments and jobs.
+    """
+    ids = np.arange(start + 1, start + rows + 1)
+    first_hire = pd.Timestamp("{}-01-01".format(HIRE_YEARS[0]))
+    seconds = (pd.Timestamp("{}-01-01".format(HIRE_YEARS[1] + 1)) - first_hire).total_seconds()
+    hired = first_hire + pd.to_timedelta(rng.integers(0, int(seconds), rows), unit="s")
+
+    df = pd.DataFrame({
+        "id": ids,
+        "name": ["Employee {}".format(i) for i in ids],
+        "datetime": hired.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "department_id": rng.integers(1, departments + 1, rows),
+        "job_id": rng.integers(1, jobs + 1, rows),
+    })
+    apply_shares(
+        df,
+        {"id": "integer", "name": "string", "datetime": "timestamp", "department_id": "integer", "job_id": "integer"},
+        rng, null_share, invalid_share
+    )
+
+    return df
+
+def iter_chunks(file_type: str, rows: int, seed: int = 0, chunk_size: int = GENERATE_CHUNK_SIZE, **options):
+    """
+    Generate the rows of a file_type chunk by chunk.
+    Params:
+    file_type (str): 'departments', 'jobs' or 'employees'.
+    rows (int): Total number of rows.
+    seed (int): Seed of the random generators, the same seed always generates the same rows.
+    chunk_size (int): Number of rows of each chunk.
+    options: null_share, invalid_share and, for the employees, the number of departments and jobs.
+
+    Yields: pandas DataFrames with at most chunk_size rows.
+    """
+    generate_chunk = {
+        "departments": generate_departments_chunk,
+        "jobs": generate_jobs_chunk,
+        "employees": generate_employees_chunk
+    }[file_type]
+
+    for chunk_number, start in enumerate(range(0, rows, chunk_size)):
+        yield generate_chunk(start, min(chunk_size, rows - start), get_chunk_rng(seed, chunk_number), **options)
+
+def generate_dataframe(file_type: str, rows: int, seed: int = 0, **options) -> pd.DataFrame:
+    """
+    Generate the rows of a file_type in memory, as read from the file by the upload.
+    """
+    return pd.concat(list(iter_chunks(file_type, rows, seed, **options)), ignore_index=True)
+
+def write_csv(path: str, file_type: str, rows: int, seed: int = 0, chunk_size: int = GENERATE_CHUNK_SIZE, **options) -> str:
+    """
+    Write the rows of a file_type to a comma separated file without header, chunk by chunk.
+
+    Returns:
+    str: The path of the file.
+    """
+    with open(path, "w", newline="") as file:
+        for df in iter_chunks(file_type, rows, seed, chunk_size, **options):
+            df.to_csv(file, header=False, index=False)
+
+    return path
+
+def generate_files(output_dir: str, rows: int, departments: int = 50, jobs: int = 200, seed: int = 0,
+                   null_share: float = 0.0, invalid_share: float = 0.0, file_types: tuple = ("departments", "jobs", "employees"),
+                   chunk_size: int = GENERATE_CHUNK_SIZE) -> dict:
+    """
+    Write the files of every file_type into output_dir, the employees reference the generated departments and jobs.
+
+    Returns:
+    dict: The path of the file of each file_type.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sizes = {"departments": departments, "jobs": jobs, "employees": rows}
+    options = {"null_share": null_share, "invalid_share": invalid_share}
+
+    paths = {}
+    for file_type in file_types:
+        file_options = dict(options, departments=departments, jobs=jobs) if file_type == "employees" else options
+        paths[file_type] = write_csv(
+            os.path.join(output_dir, "{}.csv".format(file_type)),
+            file_type, sizes[file_type], seed, chunk_size, **file_options
+        )
+
+    return paths
+
+def share(value: str) -> float:
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise argparse.ArgumentTypeError("The share must be between 0 and 1")
+
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=MIN_ROWS, help="Rows of the employees file")
+    parser.add_argument("--departments", type=int, default=50)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--file-type", choices=["departments", "jobs", "employees"], action="append",
+                        help="Generate only this file type, can be repeated")
+    parser.add_argument("--null-share", type=share, default=0.0, help="Share of nulls of the nullable columns")
+    parser.add_argument("--invalid-share", type=share, default=0.0, help="Share of invalid values of every column")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=GENERATE_CHUNK_SIZE)
+    parser.add_argument("--output-dir", default="benchmark_data")
+    args = parser.parse_args()
+
+    if not MIN_ROWS <= args.rows <= MAX_ROWS:
+        parser.error("--rows must be between {:,} and {:,}".format(MIN_ROWS, MAX_ROWS))
+
+    paths = generate_files(
+        args.output_dir,
+        args.rows,
+        departments=args.departments,
+        jobs=args.jobs,
+        seed=args.seed,
+        null_share=args.null_share,
+        invalid_share=args.invalid_share,
+        file_types=tuple(args.file_type or ("departments", "jobs", "employees")),
+        chunk_size=args.chunk_size
+    )
+    for file_type, path in paths.items():
+        print("{:<12} {}".format(file_type, path))
+
+
+if __name__ == "__main__":
+    main()
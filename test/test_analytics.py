@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+from app.analytics import (
+    AnalyticsEngine,
+    AnalyticsSnapshot,
+    Dictionary,
+    NULL_ID,
+    NULL_TIMESTAMP,
+    HiringMoreThanAvgRow
+)
+
+
+def epoch(timestamp: str) -> int:
+    return int(pd.Timestamp(timestamp).timestamp())
+
+def build_snapshot(generation: int = 0) -> AnalyticsSnapshot:
+    employees = [
+        (1, epoch("2021-01-10T00:00:00Z"), 1, 1),
+        (2, epoch("2021-02-10T00:00:00Z"), 1, 1),
+        (3, epoch("2021-07-10T00:00:00Z"), 1, 2),
+        (4, epoch("2021-12-31T23:59:59Z"), 2, 1),
+        (5, epoch("2022-04-01T00:00:00Z"), 2, 2),
+        (6, NULL_TIMESTAMP, 1, 1),
+        (7, epoch("2021-05-05T00:00:00Z"), 3, NULL_ID),
+        (8, epoch("2021-05-05T00:00:00Z"), NULL_ID, 1)
+    ]
+
+    return AnalyticsSnapshot(
+        *[np.array([employee[i] for employee in employees]) for i in range(4)],
+        Dictionary(np.array([1, 2, 3]), np.array(["Sales", "Engineering", "Support"], dtype=object)),
+        Dictionary(np.array([1, 2]), np.array(["Manager", "Analyst"], dtype=object)),
+        generation
+    )
+
+def test_employees_per_quarter_groups_by_year_department_and_job():
+    rows = build_snapshot().employees_per_quarter(2021, 2022)
+
+    assert [tuple(row) for row in rows] == [
+        (2021, "Engineering", "Manager", 0, 0, 0, 1),
+        (2021, "Sales", "Analyst", 0, 0, 1, 0),
+        (2021, "Sales", "Manager", 2, 0, 0, 0),
+        (2022, "Engineering", "Analyst", 0, 1, 0, 0)
+    ]
+    assert build_snapshot().employees_per_quarter(2030, 2030) == []
+
+def test_hiring_more_than_avg_compares_every_year_with_its_average():
+    rows = build_snapshot().hiring_more_than_avg(2021, 2022)
+
+    # 2021: Sales 3, Engineering 1 and Support 1 hired, the average is 5/3
+    assert rows == [
+        HiringMoreThanAvgRow(2021, 1, "Sales", 3),
+        HiringMoreThanAvgRow(2022, None, None, None)
+    ]
+
+def test_apply_upload_upserts_the_committed_rows():
+    engine = AnalyticsEngine()
+    engine.snapshot = build_snapshot(generation=1)
+
+    engine.apply_upload("jobs", pd.DataFrame({"id": [2, 3], "job": ["Architect", "Intern"]}), generation=2)
+    engine.apply_upload("employees", pd.DataFrame({
+        "id": [5.0, 9.0],
+        "name": ["Ana", "Luis"],
+        "datetime": ["2021-08-01T00:00:00Z", np.nan],
+        "department_id": [2.0, np.nan],
+        "job_id": [3.0, 1.0]
+    }), generation=3)
+
+    snapshot = engine.snapshot
+    assert snapshot.generation == 3
+    assert snapshot.employee_ids.tolist() == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert snapshot.hire_seconds[-1] == NULL_TIMESTAMP
+    assert snapshot.department_ids[-1] == NULL_ID
+    assert [tuple(row)[:3] for row in snapshot.employees_per_quarter(2021, 2021)] == [
+        (2021, "Engineering", "Intern"),
+        (2021, "Engineering", "Manager"),
+        (2021, "Sales", "Architect"),
+        (2021, "Sales", "Manager")
+    ]
+
+def test_apply_upload_discards_a_snapshot_of_another_generation():
+    engine = AnalyticsEngine()
+    engine.snapshot = build_snapshot(generation=1)
+
+    # Another change of the data was committed in between, the snapshot must be reloaded
+    engine.apply_upload("departments", pd.DataFrame({"id": [4], "department": ["Legal"]}), generation=3)
+
+    assert engine.snapshot is None
@@ -0,0 +1,90 @@
+import datetime
+import io
+import numpy as np
+import pytest
+from fastapi import HTTPException, UploadFile
+from app import analytics, columnar_upload
+from app.analytics import AnalyticsEngine, AnalyticsSnapshot, Dictionary
+from app.columnar_upload import (
+    read_columnar_file,
+    validate_columnar_columns,
+    validate_columnar_content,
+    prepare_arrow_table_for_copy,
+    ingest_columnar_file
+)
+from app.db_models import Employees
+from app.report_cache import ReportCache, LRUCacheBackend
+from app.upload_file_utils import get_file_schema
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq  # noqa: E402
+
+
+def employees_table(department_ids):
+    return pa.table({
+        "name": ["Ana", None, "Luis"],
+        "id": pa.array([1, 2, 3], pa.int32()),
+        "datetime": pa.array([datetime.datetime(2021, 1, 1), None, datetime.datetime(2021, 5, 1)], pa.timestamp("us")),
+        "department_id": department_ids,
+        "job_id": pa.array([1, None, 2], pa.int64()),
+    })
+
+def test_read_and_validate_parquet_file():
+    buffer = io.BytesIO()
+    pq.write_table(employees_table(pa.array([1.0, None, 3.0])), buffer)
+    buffer.seek(0)
+
+    table = read_columnar_file(UploadFile(buffer, filename="employees.parquet"), "parquet")
+    validate_columnar_columns(table, get_file_schema("employees"))
+    validate_columnar_content("employees", table)
+
+    prepared = prepare_arrow_table_for_copy(Employees.__table__, table)
+    assert prepared.column_names == ["id", "name", "datetime", "department_id", "job_id"]
+    assert prepared.column("department_id").to_pylist() == [1, None, 3]
+    assert prepared.schema.field("datetime").type.tz == "UTC"
+
+def test_validate_columnar_content_checks_the_untyped_columns():
+    with pytest.raises(HTTPException) as e:
+        validate_columnar_content("employees", employees_table(pa.array([1.5, None, 3.0])))
+
+    assert e.value.detail["content_validation_error"] == [
+        {"row": 0, "column": "department_id", "message": "Column should contain only integers."}
+    ]
+
+def test_read_arrow_stream_and_mismatched_columns():
+    table = pa.table({"id": [1], "job": ["Engineer"], "extra": [1]})
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        writer.write_table(table)
+    buffer.seek(0)
+
+    table = read_columnar_file(UploadFile(buffer, filename="jobs.arrow"), "arrow")
+    with pytest.raises(HTTPException):
+        validate_columnar_columns(table, get_file_schema("jobs"))
+
+def test_ingest_columnar_file_applies_the_rows_to_the_analytics_snapshot(monkeypatch):
+    buffer = io.BytesIO()
+    pq.write_table(employees_table(pa.array([1.0, None, 3.0])), buffer)
+    buffer.seek(0)
+    engine = AnalyticsEngine()
+    engine.snapshot = AnalyticsSnapshot(
+        *[np.array([], dtype=np.int64) for _ in range(4)],
+        Dictionary(np.array([], dtype=np.int32), np.array([], dtype=object)),
+        Dictionary(np.array([], dtype=np.int32), np.array([], dtype=object)),
+        0
+    )
+
+    monkeypatch.setattr(columnar_upload, "copy_upsert_arrow_table", lambda model, arrow_table, db: {
+        "inserted": arrow_table.num_rows, "updated": 0, "unchanged": 0
+    })
+    monkeypatch.setattr(columnar_upload, "report_cache", ReportCache(LRUCacheBackend()))
+    monkeypatch.setattr(columnar_upload, "ANALYTICS_ENGINE", True)
+    monkeypatch.setattr(analytics, "analytics_engine", engine)
+
+    ingest_columnar_file("employees", UploadFile(buffer, filename="employees.parquet"), None, "parquet")
+
+    # The snapshot isn't reloaded by the next report
+    assert engine.snapshot.generation == 1
+    assert engine.snapshot.employee_ids.tolist() == [1, 2, 3]
+    assert engine.snapshot.hire_seconds[0] == int(datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    assert engine.snapshot.department_ids[2] == 3
@@ -0,0 +1,73 @@
+import hashlib
+import io
+from fastapi import UploadFile
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+from app import content_hash
+from app.db_models import Employees, values_changed, get_upsert_counts
+
+
+def test_compute_file_sha256_rewinds_the_file(monkeypatch):
+    monkeypatch.setattr(content_hash, "HASH_BLOCK_SIZE", 4)
+    content = b"1,Ana,2021-11-07T02:48:42Z,1,2\n"
+    file = io.BytesIO(content)
+    file.seek(5)
+
+    assert content_hash.compute_file_sha256(file) == hashlib.sha256(content).hexdigest()
+    assert file.tell() == 0
+
+def test_get_upsert_counts():
+    assert get_upsert_counts(10, 3, 2) == {"inserted": 3, "updated": 2, "unchanged": 5}
+
+def test_values_changed_compares_every_non_key_column():
+    stmt = insert(Employees).values([{"id": 1, "name": "Ana", "datetime": None, "department_id": 1, "job_id": 2}])
+    condition = str(values_changed(Employees.__table__, stmt.excluded).compile(dialect=postgresql.dialect()))
+
+    assert condition == (
+        "(challenge_app.employees.name, challenge_app.employees.datetime, challenge_app.employees.department_id, "
+        "challenge_app.employees.job_id) IS DISTINCT FROM "
+        "(excluded.name, excluded.datetime, excluded.department_id, excluded.job_id)"
+    )
+
+def test_ingest_if_changed_skips_the_last_ingested_file(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(content_hash, "get_ingested_file_rows", lambda db, file_type, sha256: 2)
+    monkeypatch.setattr(content_hash, "record_ingested_file", lambda *args: recorded.append(args))
+
+    def ingest(file_type, file, db):
+        raise AssertionError("The file should be skipped")
+
+    result = content_hash.ingest_if_changed("jobs", UploadFile(io.BytesIO(b"1,Manager\n2,Engineer\n")), None, ingest)
+
+    assert result["skipped"]
+    assert (result["inserted"], result["updated"], result["unchanged"]) == (0, 0, 2)
+    assert recorded == []
+
+def test_ingest_if_changed_records_the_ingested_file(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(content_hash, "get_ingested_file_rows", lambda db, file_type, sha256: None)
+    monkeypatch.setattr(content_hash, "record_ingested_file", lambda *args: recorded.append(args))
+    content = b"1,Manager\n2,Engineer\n"
+
+    def ingest(file_type, file, db, loader):
+        assert file.file.read() == content
+        return {"rows": 2, "inserted": 1, "updated": 0, "unchanged": 1}
+
+    result = content_hash.ingest_if_changed("jobs", UploadFile(io.BytesIO(content)), None, ingest, "copy")
+
+    assert not result["skipped"]
+    assert result["inserted"] == 1
+    assert recorded == [(None, "jobs", hashlib.sha256(content).hexdigest(), 2)]
+
+def test_ingest_if_changed_with_force_ignores_the_last_ingested_file(monkeypatch):
+    monkeypatch.setattr(content_hash, "get_ingested_file_rows", lambda db, file_type, sha256: 2)
+    monkeypatch.setattr(content_hash, "record_ingested_file", lambda *args: None)
+
+    result = content_hash.ingest_if_changed(
+        "jobs", UploadFile(io.BytesIO(b"1,Manager\n")), None,
+        lambda file_type, file, db: {"rows": 1, "inserted": 0, "updated": 1, "unchanged": 0},
+        force=True
+    )
+
+    assert not result["skipped"]
+    assert result["updated"] == 1
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import zipfile
+import pytest
+from fastapi import HTTPException, UploadFile
+from app import analytics, dataset_upload
+from app.dataset_upload import get_dataset_file_type, open_dataset_zip, read_dataset_files, load_dataset
+from app.report_cache import ReportCache, LRUCacheBackend
+
+
+def zip_upload(members: dict) -> UploadFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    buffer.seek(0)
+
+    return UploadFile(buffer, filename="dataset.zip")
+
+class CommitSession:
+    """
+    Session accepting the statements and the commit of a dataset load.
+    """
+    def execute(self, stmt):
+        pass
+
+    def commit(self):
+        pass
+
+def test_get_dataset_file_type():
+    assert get_dataset_file_type("departments.csv") == "departments"
+    assert get_dataset_file_type("data/hired_employees.CSV") == "employees"
+    assert get_dataset_file_type("jobs.txt") is None
+    assert get_dataset_file_type("salaries.csv") is None
+    assert get_dataset_file_type("hired_employees.csv.gz") == "employees"
+    assert get_dataset_file_type("jobs.csv.zst") == "jobs"
+    assert get_dataset_file_type("jobs.gz") is None
+
+def test_open_dataset_zip():
+    files = open_dataset_zip(zip_upload({
+        "dataset/departments.csv": "1,Sales\n",
+        "dataset/hired_employees.csv": "1,Ana,2021-11-07T02:48:42Z,1,1\n",
+        "README.txt": "Challenge dataset"
+    }))
+
+    assert sorted(files) == ["departments", "employees"]
+    assert files["departments"].file.read() == b"1,Sales\n"
+
+def test_open_dataset_zip_rejects_repeated_file_types():
+    with pytest.raises(HTTPException) as e:
+        open_dataset_zip(zip_upload({"jobs.csv": "1,Manager\n", "old/jobs.csv": "1,Manager\n"}))
+
+    assert e.value.status_code == 400
+
+def test_read_dataset_files_reports_the_errors_of_every_file():
+    files = {
+        "departments": UploadFile(io.BytesIO(b"1,Sales\n2,Marketing\n"), filename="departments.csv"),
+        "jobs": UploadFile(io.BytesIO(b"1,Manager\nx,Engineer\n"), filename="jobs.csv"),
+        "employees": UploadFile(io.BytesIO(b"1,Ana,2021-13-45T02:48:42Z,1,1\n"), filename="employees.csv")
+    }
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_dataset_files(files))
+
+    assert e.value.status_code == 400
+    assert sorted(e.value.detail["files"]) == ["employees", "jobs"]
+
+def test_read_dataset_files():
+    dataset = asyncio.run(read_dataset_files({
+        "departments": UploadFile(io.BytesIO(b"1,Sales\n2,Marketing\n"), filename="departments.csv")
+    }))
+
+    df, sha256 = dataset["departments"]
+    assert list(df["department"]) == ["Sales", "Marketing"]
+    assert len(sha256) == 64
+
+
+def test_load_dataset_applies_the_changed_files_to_the_analytics_snapshot(monkeypatch):
+    dataset = asyncio.run(read_dataset_files({
+        "departments": UploadFile(io.BytesIO(b"1,Sales\n"), filename="departments.csv"),
+        "jobs": UploadFile(io.BytesIO(b"1,Manager\n"), filename="jobs.csv"),
+        "employees": UploadFile(io.BytesIO(b"1,Ana,2021-11-07T02:48:42Z,1,1\n"), filename="employees.csv")
+    }))
+    applied = []
+
+    def bulk_upsert_data_to_db(file_type, db, df, loader='insert', commit=True):
+        # The jobs were already loaded
+        changed = 0 if file_type == "jobs" else len(df)
+        return {"inserted": changed, "updated": 0, "unchanged": len(df) - changed}
+
+    monkeypatch.setattr(dataset_upload, "bulk_upsert_data_to_db", bulk_upsert_data_to_db)
+    monkeypatch.setattr(dataset_upload, "record_ingested_file", lambda *args: None)
+    monkeypatch.setattr(dataset_upload, "report_cache", ReportCache(LRUCacheBackend()))
+    monkeypatch.setattr(dataset_upload, "ANALYTICS_ENGINE", True)
+    monkeypatch.setattr(analytics.analytics_engine, "apply_upload", lambda file_type, df, generation: applied.append((file_type, generation)))
+
+    load_dataset(dataset, CommitSession())
+
+    assert applied == [("departments", 1), ("employees", 2)]
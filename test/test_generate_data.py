@@ -0,0 +1,32 @@
+from fastapi import HTTPException, UploadFile
+import pytest
+from app.upload_file_utils import get_file_schema, validate_file_content, read_comma_separated_no_header, assign_columns_no_header_file
+from benchmarks.generate_data import generate_files
+
+
+def read_generated_file(file_type: str, path: str):
+    with open(path, "rb") as file:
+        df = read_comma_separated_no_header(UploadFile(file))
+    assign_columns_no_header_file(df, get_file_schema(file_type))
+    return df
+
+def test_generated_files_are_reproducible_and_valid(tmp_path):
+    paths = generate_files(str(tmp_path / "a"), 10000, null_share=0.05, seed=1, chunk_size=3000)
+    same_paths = generate_files(str(tmp_path / "b"), 10000, null_share=0.05, seed=1, chunk_size=3000)
+
+    for file_type, path in paths.items():
+        with open(path) as file, open(same_paths[file_type]) as same_file:
+            assert file.read() == same_file.read()
+
+        df = read_generated_file(file_type, path)
+        validate_file_content(get_file_schema(file_type), df)
+
+    employees = read_generated_file("employees", paths["employees"])
+    assert len(employees) == 10000
+    assert employees["job_id"].isna().any()
+
+def test_generated_invalid_values_fail_the_validation(tmp_path):
+    paths = generate_files(str(tmp_path), 10000, invalid_share=0.01, file_types=("employees",))
+
+    with pytest.raises(HTTPException):
+        validate_file_content(get_file_schema("employees"), read_generated_file("employees", paths["employees"]))
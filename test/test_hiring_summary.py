@@ -0,0 +1,103 @@
+import datetime
+import threading
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.database import Base
+from app.db_models import Employees, Departments, Jobs, HiringSummary, maintain_hiring_summary
+from app.migrations import run_migrations
+
+
+def hired_at(year: int, month: int) -> datetime.datetime:
+    return datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+
+def employee(id: int, hired, department_id=1, job_id=1) -> dict:
+    return {"id": id, "name": "Employee {}".format(id), "datetime": hired, "department_id": department_id, "job_id": job_id}
+
+def get_summary(db) -> list:
+    return [tuple(row) for row in db.execute(
+        select(HiringSummary.department_id, HiringSummary.job_id, HiringSummary.year, HiringSummary.quarter, HiringSummary.hired)
+        .order_by(HiringSummary.department_id, HiringSummary.job_id, HiringSummary.year, HiringSummary.quarter)
+    )]
+
+def test_maintain_hiring_summary_locks_the_upserts_before_reading_the_previous_hires(recording_session):
+    db = recording_session
+
+    with maintain_hiring_summary(Employees.id == 1, db):
+        db.execute(select(text("'upsert'")))
+
+    assert "pg_advisory_xact_lock" in db.statements[0]
+    assert db.statements[1].startswith("UPDATE challenge_app.hiring_summary")
+    assert db.statements[2].startswith("DELETE FROM challenge_app.hiring_summary")
+    assert "'upsert'" in db.statements[3]
+    assert db.statements[4].startswith("INSERT INTO challenge_app.hiring_summary")
+
+@pytest.fixture(scope="module")
+def summary_engine(test_database_url):
+    engine = create_engine(test_database_url)
+    run_migrations(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(summary_engine):
+    with summary_engine.begin() as connection:
+        connection.execute(text("TRUNCATE {} CASCADE".format(", ".join(
+            table.fullname for table in Base.metadata.sorted_tables
+        ))))
+
+    with Session(bind=summary_engine) as db:
+        Departments.create_departments(Departments, [{"id": 1, "department": "Sales"}, {"id": 2, "department": "Support"}], db)
+        Jobs.create_jobs(Jobs, [{"id": 1, "job": "Manager"}], db)
+        yield db
+
+def test_upserts_move_the_hires_between_the_summary_keys(db):
+    Employees.create_employees(Employees, [
+        employee(1, hired_at(2021, 1)),
+        employee(2, hired_at(2021, 2)),
+        employee(3, None, department_id=None)
+    ], db)
+    assert get_summary(db) == [(1, 1, 2021, 1, 2), (None, 1, None, None, 1)]
+
+    # Employee 1 moves to another department and quarter, employee 2 is unchanged
+    counts = Employees.create_employees(Employees, [
+        employee(1, hired_at(2021, 7), department_id=2),
+        employee(2, hired_at(2021, 2))
+    ], db)
+
+    assert (counts["inserted"], counts["updated"], counts["unchanged"]) == (0, 1, 1)
+    assert get_summary(db) == [(1, 1, 2021, 1, 1), (2, 1, 2021, 3, 1), (None, 1, None, None, 1)]
+
+def test_rolled_back_upserts_leave_the_summary_unchanged(db):
+    Employees.create_employees(Employees, [employee(1, hired_at(2021, 1))], db)
+
+    # The department 3 doesn't exist, the whole upsert is rolled back
+    with pytest.raises(IntegrityError):
+        Employees.create_employees(Employees, [employee(1, hired_at(2022, 1)), employee(2, None, department_id=3)], db)
+    assert get_summary(db) == [(1, 1, 2021, 1, 1)]
+
+def test_concurrent_upserts_of_the_same_employees_count_them_once(db, summary_engine):
+    employees = [employee(id, hired_at(2021, 1 + id % 12)) for id in range(1, 501)]
+    barrier = threading.Barrier(4)
+
+    def upsert():
+        with Session(bind=summary_engine) as session:
+            barrier.wait()
+            assert Employees.create_employees(Employees, employees, session) is not None
+
+    threads = [threading.Thread(target=upsert) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(row[-1] for row in get_summary(db)) == len(employees)
+    assert get_summary(db) == [tuple(row) for row in db.execute(
+        select(
+            Employees.department_id, Employees.job_id,
+            text("extract(year FROM timezone('UTC', datetime))::int AS year"),
+            text("extract(quarter FROM timezone('UTC', datetime))::int AS quarter"),
+            text("count(*)")
+        ).group_by(text("1, 2, 3, 4")).order_by(text("1, 2, 3, 4"))
+    )]
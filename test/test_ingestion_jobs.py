@@ -0,0 +1,124 @@
+import io
+import os
+import threading
+import pytest
+from fastapi import HTTPException, UploadFile
+from app import ingestion_jobs
+from app.ingestion_jobs import IngestionJobManager
+
+CONTENT = b"1,Manager\n2,Engineer\n"
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """
+    Keep the saved status of the jobs in a dictionary instead of the database.
+    """
+    saved = {}
+    monkeypatch.setattr(ingestion_jobs, "save_ingestion_job", lambda job: saved.setdefault(job.id, []).append(job.to_dict()))
+    monkeypatch.setattr(ingestion_jobs, "get_saved_ingestion_job", lambda job_id: (saved.get(job_id) or [None])[-1])
+    return saved
+
+def run_jobs(monkeypatch, ingest, count: int = 1, **kwargs) -> tuple:
+    """
+    Submit count jobs processed by ingest and wait for them to finish.
+    """
+    monkeypatch.setattr(ingestion_jobs, "ingest_if_changed", ingest)
+    manager = IngestionJobManager(**kwargs)
+    jobs = [manager.submit("jobs", UploadFile(io.BytesIO(CONTENT), filename="jobs.csv"), 1, "copy") for _ in range(count)]
+    manager._executor.shutdown(wait=True)
+
+    return manager, jobs
+
+def test_submit_spools_and_ingests_the_file(monkeypatch, saved):
+    calls = []
+
+    def ingest(file_type, file, db, ingest, chunk_size, loader, progress, force=False):
+        calls.append((file_type, file.filename, file.file.read(), chunk_size, loader, force))
+        return {"rows": 2, "inserted": 2, "updated": 0, "unchanged": 0, "chunks": [{}, {}]}
+
+    manager, [job] = run_jobs(monkeypatch, ingest)
+    status = manager.get(job.id)
+
+    assert calls == [("jobs", "jobs.csv", CONTENT, 1, "copy", False)]
+    assert (status["status"], status["stage"]) == ("succeeded", "done")
+    assert status["result"] == {"rows": 2, "inserted": 2, "updated": 0, "unchanged": 0}
+    assert not os.path.exists(job.path)
+    assert [state["status"] for state in saved[job.id]] == ["queued", "running", "succeeded"]
+
+def test_progress_of_a_running_job(monkeypatch, saved):
+    monkeypatch.setattr(ingestion_jobs, "INGEST_JOB_SAVE_SECONDS", 0)
+    progress_seen = []
+    submitted = threading.Event()
+
+    def ingest(file_type, file, db, ingest, chunk_size, loader, progress, force=False):
+        # The job waits for its id to be known by the test
+        submitted.wait(5)
+        progress("loading", 1)
+        progress_seen.append(manager.get(job.id))
+        progress("parsing", 2)
+        return {"rows": 2, "inserted": 2, "updated": 0, "unchanged": 0}
+
+    monkeypatch.setattr(ingestion_jobs, "ingest_if_changed", ingest)
+    manager = IngestionJobManager(workers=1)
+    job = manager.submit("jobs", UploadFile(io.BytesIO(CONTENT), filename="jobs.csv"), 1, "insert")
+    submitted.set()
+    manager._executor.shutdown(wait=True)
+
+    assert (progress_seen[0]["status"], progress_seen[0]["stage"], progress_seen[0]["rows_processed"]) == ("running", "loading", 1)
+    assert [state["stage"] for state in saved[job.id]] == ["queued", "queued", "loading", "parsing", "done"]
+
+def test_failed_jobs_report_their_errors(monkeypatch, saved):
+    errors = iter([HTTPException(status_code=400, detail={"rows_loaded": 0}), ValueError("Unexpected error")])
+
+    def ingest(*args, **kwargs):
+        raise next(errors)
+
+    manager, jobs = run_jobs(monkeypatch, ingest, count=2, workers=1)
+
+    assert [(manager.get(job.id)["status"], manager.get(job.id)["errors"]) for job in jobs] == [
+        ("failed", {"rows_loaded": 0}),
+        ("failed", "Unexpected error")
+    ]
+    assert not any(os.path.exists(job.path) for job in jobs)
+
+def test_submit_rejects_the_jobs_beyond_the_queue_size(monkeypatch, saved):
+    release = threading.Event()
+
+    def ingest(*args, **kwargs):
+        release.wait(5)
+        return {"rows": 2, "inserted": 0, "updated": 0, "unchanged": 2}
+
+    monkeypatch.setattr(ingestion_jobs, "ingest_if_changed", ingest)
+    manager = IngestionJobManager(workers=1, queue_size=1)
+    manager.submit("jobs", UploadFile(io.BytesIO(CONTENT), filename="jobs.csv"), 1, "insert")
+
+    with pytest.raises(HTTPException) as e:
+        manager.submit("jobs", UploadFile(io.BytesIO(CONTENT), filename="jobs.csv"), 1, "insert")
+    assert e.value.status_code == 503
+
+    release.set()
+    manager._executor.shutdown(wait=True)
+
+def test_finished_jobs_beyond_the_history_are_forgotten(monkeypatch, saved):
+    monkeypatch.setattr(ingestion_jobs, "INGEST_JOB_HISTORY", 2)
+
+    def ingest(*args, **kwargs):
+        return {"rows": 2, "inserted": 0, "updated": 0, "unchanged": 2}
+
+    manager, jobs = run_jobs(monkeypatch, ingest, count=3, workers=1)
+    # The finished jobs are forgotten when the next job is submitted
+    manager._executor = ingestion_jobs.ThreadPoolExecutor(max_workers=1)
+    last_job = manager.submit("jobs", UploadFile(io.BytesIO(CONTENT), filename="jobs.csv"), 1, "insert")
+    manager._executor.shutdown(wait=True)
+
+    assert list(manager._jobs) == [jobs[1].id, jobs[2].id, last_job.id]
+
+def test_get_reads_the_jobs_of_other_workers(saved):
+    manager = IngestionJobManager()
+    saved["other"] = [{"job_id": "other", "status": "running"}]
+
+    assert manager.get("other")["status"] == "running"
+    with pytest.raises(HTTPException) as e:
+        manager.get("missing")
+    assert e.value.status_code == 404
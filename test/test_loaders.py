@@ -0,0 +1,69 @@
+import datetime
+import io
+import pandas as pd
+import pytest
+from fastapi import UploadFile
+from app.loaders import iter_dataframe_records
+from app.upload_file_utils import get_file_schema, read_comma_separated_no_header, assign_columns_no_header_file
+
+EMPLOYEES_CSV = (
+    b"1,Ana,2021-11-07T02:48:42Z,2,96\n"
+    b"2,Luis,2021-01-01T00:00:00Z,,5\n"
+    b"3,,2022-07-27T16:02:08Z,1,\n"
+    b"4,Eva,,,\n"
+)
+
+
+def read_csv(file_type: str, content: bytes) -> pd.DataFrame:
+    df = read_comma_separated_no_header(UploadFile(io.BytesIO(content)))
+    assign_columns_no_header_file(df, get_file_schema(file_type))
+    return df
+
+def iterrows_records(df: pd.DataFrame) -> list:
+    """
+    The row by row conversion of the employees replaced by iter_dataframe_records.
+    """
+    employees = []
+    for idx, row in df.where(pd.notna(df), None).iterrows():
+        employees.append(
+            {
+                "id": int(row['id']),
+                "name": row['name'],
+                "datetime": row['datetime'],
+                "department_id": int(row['department_id']) if not pd.isna(row['department_id']) else None,
+                "job_id": int(row['job_id']) if not pd.isna(row['job_id']) else None
+            }
+        )
+    return employees
+
+def test_employees_records_match_the_iterrows_conversion():
+    df = read_csv("employees", EMPLOYEES_CSV)
+    # The foreign keys with nulls are read as floats
+    assert df["department_id"].dtype == "float64" and df["job_id"].dtype == "float64"
+
+    expected = iterrows_records(df)
+    records = list(iter_dataframe_records("employees", df, batch_size=3))
+
+    # The timestamps are parsed by the columnar conversion instead of being cast by the database
+    for record in expected:
+        if record["datetime"] is not None:
+            record["datetime"] = datetime.datetime.fromisoformat(record["datetime"].replace("Z", "+00:00"))
+
+    assert records == expected
+
+    for record in records:
+        for column in ("id", "department_id", "job_id"):
+            assert record[column] is None or type(record[column]) is int
+        assert record["name"] is None or isinstance(record["name"], str)
+
+@pytest.mark.parametrize("file_type, content", [
+    ("jobs", b"1,Manager\n2,\n3.0,Analyst\n"),
+    ("departments", b"1,Sales\n2,Support\n")
+])
+def test_records_of_the_small_tables(file_type, content):
+    df = read_csv(file_type, content)
+    name = df.columns[1]
+
+    assert list(iter_dataframe_records(file_type, df)) == [
+        {"id": int(row["id"]), name: None if pd.isna(row[name]) else row[name]} for _, row in df.iterrows()
+    ]
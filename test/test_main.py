@@ -1,5 +1,200 @@
 # tests/test_main.py
-# from fastapi.testclient import TestClient
-# from app.main import app
-# 
-# client = TestClient(app)
+import json
+from collections import namedtuple
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import content_hash, ingestion, router
+from app.database import get_write_db, get_report_db
+from app.main import app
+from app.report_cache import ReportCache, LRUCacheBackend
+
+JOBS_CSV = b"1,Manager\n2,Engineer\n3,Analyst\n"
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """
+    Replace the database work of the uploads: no file was ingested before and every load
+    is recorded with its DataFrame and loader instead of being upserted.
+    """
+    loads = []
+
+    def bulk_upsert_data_to_db(file_type, db, df, loader='insert', commit=True):
+        loads.append((file_type, df, loader))
+        return {"inserted": len(df), "updated": 0, "unchanged": 0}
+
+    monkeypatch.setattr(content_hash, "get_ingested_file_rows", lambda db, file_type, sha256: None)
+    monkeypatch.setattr(content_hash, "record_ingested_file", lambda *args: None)
+    monkeypatch.setattr(ingestion, "bulk_upsert_data_to_db", bulk_upsert_data_to_db)
+    app.dependency_overrides[get_write_db] = lambda: None
+    yield loads
+    app.dependency_overrides.clear()
+
+def upload(file_type: str, content: bytes, filename: str = "jobs.csv", **params):
+    return client.post(
+        "/uploadDocument/{}".format(file_type),
+        params=params,
+        files={"file": (filename, content, "text/csv")}
+    )
+
+def test_read_root():
+    response = client.get("/")
+
+    assert response.status_code == 200
+    assert response.json() == "Simple application for a Challenge!"
+
+def test_upload_loads_the_whole_file(loads):
+    response = upload("jobs", JOBS_CSV)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "File uploaded correctly"
+    assert (response.json()["rows"], response.json()["inserted"]) == (3, 3)
+    assert [(file_type, len(df), loader) for file_type, df, loader in loads] == [("jobs", 3, "insert")]
+    assert loads[0][1]["job"].tolist() == ["Manager", "Engineer", "Analyst"]
+
+def test_upload_with_the_copy_loader(loads):
+    response = upload("jobs", JOBS_CSV, loader="copy")
+
+    assert response.status_code == 200
+    assert [loader for _, _, loader in loads] == ["copy"]
+
+def test_upload_streams_the_file_in_chunks(loads):
+    response = upload("jobs", JOBS_CSV, stream=True, chunk_size=2)
+
+    assert response.status_code == 200
+    assert [chunk["rows_loaded"] for chunk in response.json()["chunks"]] == [2, 3]
+    assert [len(df) for _, df, _ in loads] == [2, 1]
+
+def test_upload_rejects_an_invalid_file_without_loading_it(loads):
+    response = upload("jobs", b"1,Manager\nX,Engineer\n")
+
+    assert response.status_code == 400
+    assert loads == []
+
+def test_upload_rejects_an_unknown_file_type_or_loader(loads):
+    assert upload("X", JOBS_CSV).status_code == 400
+    assert upload("jobs", JOBS_CSV, loader="X").status_code == 400
+    assert upload("jobs", JOBS_CSV, filename="jobs.txt").status_code == 400
+    assert loads == []
+
+def test_upload_of_missing_references_fails_with_the_constraint_message(loads, monkeypatch):
+    message = 'insert or update on table "employees" violates foreign key constraint "employees_department_id_fkey"'
+
+    def bulk_upsert_data_to_db(file_type, db, df, loader='insert', commit=True):
+        raise IntegrityError("INSERT INTO challenge_app.employees", {}, Exception(message))
+
+    monkeypatch.setattr(ingestion, "bulk_upsert_data_to_db", bulk_upsert_data_to_db)
+    response = upload("employees", b"1,Ana,2021-11-07T02:48:42Z,99,1\n", filename="employees.csv", loader="copy")
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["suggestion"] == message
+
+def test_upload_dry_run_streams_the_validation_report(loads):
+    response = upload("jobs", b"1,Manager\n2.5,Engineer\n3,Analyst\n", dry_run=True, chunk_size=2)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [error["row"] for error in lines[:-1]] == [1]
+    assert lines[-1]["summary"]["rows"] == 3
+    assert lines[-1]["summary"]["error_count"] == 1
+    assert loads == []
+
+
+EmployeesPerQuarterRow = namedtuple("EmployeesPerQuarterRow", "year department job Q1 Q2 Q3 Q4")
+HiringMoreThanAvgRow = namedtuple("HiringMoreThanAvgRow", "year id department hired")
+
+class StreamedResult:
+    def __init__(self, batches):
+        self.batches = batches
+
+    async def partitions(self):
+        for rows in self.batches:
+            yield rows
+
+class ReportAsyncSession(AsyncSession):
+    """
+    Async session streaming the batches of rows of a report instead of querying the database.
+    """
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+        self.statements = []
+
+    async def stream(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return StreamedResult(self.batches)
+
+@pytest.fixture
+def report_session(monkeypatch):
+    """
+    Serve the reports from an async session with a per test cache, as with ASYNC_DATABASE_URL.
+    """
+    session = ReportAsyncSession([])
+
+    async def get_async_db():
+        yield session
+
+    monkeypatch.setattr(router, "report_cache", ReportCache(LRUCacheBackend()))
+    app.dependency_overrides[get_report_db] = get_async_db
+    yield session
+    app.dependency_overrides.clear()
+
+def test_employees_per_quarter_streams_the_rows_of_the_async_session(report_session):
+    report_session.batches = [
+        [EmployeesPerQuarterRow(2021, "Sales", "Manager", 1, 0, 2, 0)],
+        [EmployeesPerQuarterRow(2021, "Support", "Analyst", 0, 1, 0, 0)]
+    ]
+
+    response = client.get("/employeePerQuarters", params={"year": 2021, "format": "jsonl"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert [(line["department"], line["job"], line["Q3"]) for line in lines] == [("Sales", "Manager", 2), ("Support", "Analyst", 0)]
+    assert "hiring_summary" in str(report_session.statements[0])
+
+    # The second request is served from the cache without querying the session
+    assert client.get("/employeePerQuarters", params={"year": 2021, "format": "jsonl"}).text == response.text
+    assert len(report_session.statements) == 1
+
+def test_reports_of_the_replica_are_not_cached(report_session):
+    report_session.info["replica"] = True
+    report_session.batches = [[EmployeesPerQuarterRow(2021, "Sales", "Manager", 1, 0, 2, 0)]]
+
+    for _ in range(2):
+        assert client.get("/employeePerQuarters", params={"year": 2021, "format": "jsonl"}).status_code == 200
+    assert len(report_session.statements) == 2
+
+def test_hiring_more_than_avg_streams_the_rows_of_the_async_session(report_session):
+    report_session.batches = [[
+        HiringMoreThanAvgRow(2021, 1, "Sales", 5),
+        HiringMoreThanAvgRow(2022, None, None, None)
+    ]]
+
+    response = client.get("/departmentsHiringMoreThanAvg", params={"year": 2021, "year_to": 2022, "format": "jsonl"})
+
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"year": 2021, "id": 1, "department": "Sales", "hired": 5}
+    ]
+
+def test_hiring_more_than_avg_without_hires_of_the_async_session(report_session):
+    response = client.get("/departmentsHiringMoreThanAvg", params={"year": 2030})
+
+    assert response.status_code == 400
+
+def test_reports_answer_the_errors_of_the_first_batch_with_a_500(report_session):
+    async def stream(statement, *args, **kwargs):
+        raise RuntimeError("canceling statement due to statement timeout")
+
+    report_session.stream = stream
+
+    for path in ("/employeePerQuarters", "/departmentsHiringMoreThanAvg"):
+        response = client.get(path, params={"year": 2021})
+
+        assert response.status_code == 500
+        assert response.json()["detail"] == "canceling statement due to statement timeout"
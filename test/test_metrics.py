@@ -0,0 +1,40 @@
+import io
+import pandas as pd
+import pytest
+from app.metrics import MetricsRegistry, counting_reader
+
+
+def test_counter_render():
+    registry = MetricsRegistry()
+    errors = registry.counter("ingest_errors", "Uploads failed.", ("file_type", "stage"))
+    errors.inc(file_type="jobs", stage="validate")
+    errors.inc(2, file_type="jobs", stage="validate")
+
+    assert registry.render() == (
+        "# HELP ingest_errors Uploads failed.\n"
+        "# TYPE ingest_errors counter\n"
+        'ingest_errors_total{file_type="jobs",stage="validate"} 3\n'
+    )
+
+    with pytest.raises(ValueError):
+        errors.inc(file_type="jobs")
+
+def test_histogram_render():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("report_query_seconds", "Query seconds.", ("report",), buckets=(0.1, 1.0))
+    seconds.observe(0.05, report='a "quoted" report')
+    seconds.observe(0.5, report='a "quoted" report')
+
+    lines = registry.render().splitlines()
+    assert 'report_query_seconds_bucket{report="a \\"quoted\\" report",le="0.1"} 1' in lines
+    assert 'report_query_seconds_bucket{report="a \\"quoted\\" report",le="1.0"} 2' in lines
+    assert 'report_query_seconds_bucket{report="a \\"quoted\\" report",le="+Inf"} 2' in lines
+    assert 'report_query_seconds_count{report="a \\"quoted\\" report"} 2' in lines
+
+def test_counting_reader():
+    read_sizes = []
+    content = b"1,Engineer\n2,Staff\n"
+    df = pd.read_csv(counting_reader(io.BytesIO(content), read_sizes.append), header=None)
+
+    assert len(df) == 2
+    assert sum(read_sizes) == len(content)
@@ -0,0 +1,36 @@
+import datetime
+import pytest
+from sqlalchemy import create_engine, text
+from app.migrations import migrate_employees_datetime_to_timestamptz
+
+
+@pytest.fixture
+def connection(test_database_url):
+    """
+    Connection of the test database, every test is rolled back.
+    """
+    engine = create_engine(test_database_url)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        yield connection
+        transaction.rollback()
+    engine.dispose()
+
+def test_migrate_employees_datetime_discards_the_strings_that_are_not_iso_timestamps(connection):
+    # The employees table as created before the hire dates were stored as timestamptz
+    connection.execute(text("DROP SCHEMA IF EXISTS challenge_app CASCADE"))
+    connection.execute(text("CREATE SCHEMA challenge_app"))
+    connection.execute(text("CREATE TABLE challenge_app.employees (id integer PRIMARY KEY, datetime varchar)"))
+    connection.execute(text(
+        "INSERT INTO challenge_app.employees VALUES "
+        "(1, '2021-11-07T02:48:42Z'), (2, ''), (3, NULL), (4, '2021-13-01T00:00:00Z'), "
+        "(5, '2021-02-30T00:00:00Z'), (6, '07/11/2021'), (7, 'yesterday')"
+    ))
+
+    migrate_employees_datetime_to_timestamptz(connection)
+
+    rows = connection.execute(text("SELECT id, datetime FROM challenge_app.employees ORDER BY id")).all()
+    assert rows == [
+        (1, datetime.datetime(2021, 11, 7, 2, 48, 42, tzinfo=datetime.timezone.utc)),
+        (2, None), (3, None), (4, None), (5, None), (6, None), (7, None)
+    ]
@@ -0,0 +1,153 @@
+import functools
+import gzip
+import io
+import json
+import numpy as np
+import pytest
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+from app import analytics, parallel_ingestion
+from app.analytics import AnalyticsEngine, AnalyticsSnapshot, Dictionary
+from app.database import Base
+from app.db_models import Jobs
+from app.migrations import run_migrations
+from app.parallel_ingestion import (
+    split_byte_ranges,
+    parse_and_validate_range,
+    number_errors_from_file_start,
+    apply_file_to_analytics,
+    ingest_csv_parallel,
+    ingest_upload_parallel
+)
+from app.ingestion import iter_dry_run_report
+from app.metrics import ingest_bytes_read
+
+
+def write_jobs_file(path, rows):
+    content = "".join("{},Job {}\n".format(i, i) for i in range(1, rows + 1))
+    path.write_text(content)
+    return content.encode()
+
+def test_split_byte_ranges_at_newlines(tmp_path):
+    path = tmp_path / "jobs.csv"
+    content = write_jobs_file(path, 1000)
+
+    ranges = split_byte_ranges(str(path), 4, min_range_bytes=1)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(content)
+    for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+        assert end == next_start
+        assert content[end - 1:end] == b"\n"
+
+    # Small files aren't split in ranges below the minimum size
+    assert split_byte_ranges(str(path), 4, min_range_bytes=len(content)) == [(0, len(content))]
+
+def test_validation_errors_are_numbered_from_the_file_start(tmp_path):
+    path = tmp_path / "employees.csv"
+    path.write_text("".join(
+        "{},Name,{},1,1\n".format(i, "2021-13-01T00:00:00Z" if i in (2, 5) else "2021-01-01T00:00:00Z")
+        for i in range(6)
+    ))
+
+    results = []
+    for start, end in split_byte_ranges(str(path), 2, min_range_bytes=1):
+        df, errors = parse_and_validate_range("employees", str(path), start, end)
+        results.append({"rows": len(df), "errors": errors})
+
+    assert len(results) == 2
+    assert [error["row"] for error in number_errors_from_file_start(results).errors] == [2, 5]
+
+def test_dry_run_report_streams_every_error_and_a_summary():
+    content = b"".join(
+        "{},Name,{},1,1\n".format(i, "2021-13-01T00:00:00Z" if i % 2 else "2021-01-01T00:00:00Z").encode()
+        for i in range(5)
+    )
+    lines = [
+        json.loads(line)
+        for block in iter_dry_run_report("employees", UploadFile(io.BytesIO(content)), chunk_size=2)
+        for line in block.splitlines()
+    ]
+
+    assert [line["row"] for line in lines[:-1]] == [1, 3]
+    assert lines[-1]["summary"]["rows"] == 5
+    assert lines[-1]["summary"]["error_count"] == 2
+    assert lines[-1]["summary"]["column_summaries"][0]["column"] == "datetime"
+    assert not lines[-1]["summary"]["valid"]
+
+def test_apply_file_to_analytics_applies_the_rows_of_the_file(tmp_path, monkeypatch):
+    path = tmp_path / "jobs.csv"
+    write_jobs_file(path, 3)
+    engine = AnalyticsEngine()
+    engine.snapshot = AnalyticsSnapshot(
+        *[np.array([], dtype=np.int64) for _ in range(4)],
+        Dictionary(np.array([], dtype=np.int32), np.array([], dtype=object)),
+        Dictionary(np.array([1], dtype=np.int32), np.array(["Manager"], dtype=object)),
+        4
+    )
+    monkeypatch.setattr(analytics, "analytics_engine", engine)
+
+    apply_file_to_analytics("jobs", str(path), 5)
+
+    assert engine.snapshot.generation == 5
+    assert engine.snapshot.jobs.ids.tolist() == [1, 2, 3]
+    assert engine.snapshot.jobs.names.tolist() == ["Job 1", "Job 2", "Job 3"]
+
+def test_ingest_upload_parallel_counts_the_compressed_bytes(monkeypatch):
+    content = "".join("{},Job {}\n".format(i, i) for i in range(1, 1001)).encode()
+    compressed = gzip.compress(content)
+    spooled = []
+
+    def ingest_csv_parallel(file_type, path, db, workers):
+        with open(path, "rb") as file:
+            spooled.append(file.read())
+        return {"rows": 1000}
+
+    monkeypatch.setattr(parallel_ingestion, "ingest_csv_parallel", ingest_csv_parallel)
+    bytes_read = ingest_bytes_read.get(file_type="jobs")
+
+    ingest_upload_parallel("jobs", UploadFile(io.BytesIO(compressed), filename="jobs.csv.gz"), None)
+
+    assert spooled == [content]
+    assert ingest_bytes_read.get(file_type="jobs") - bytes_read == len(compressed)
+
+@pytest.fixture
+def parallel_db(monkeypatch, test_database_url):
+    """
+    Session of the migrated test database, whose URL the worker processes of a new pool connect to.
+    """
+    engine = create_engine(test_database_url)
+    run_migrations(engine)
+    with engine.begin() as connection:
+        connection.execute(text("TRUNCATE {} CASCADE".format(", ".join(
+            table.fullname for table in Base.metadata.sorted_tables
+        ))))
+
+    monkeypatch.setenv("DATABASE_URL", test_database_url)
+    monkeypatch.setattr(parallel_ingestion, "_process_pool", None)
+    # Small files are split in several ranges
+    monkeypatch.setattr(parallel_ingestion, "split_byte_ranges", functools.partial(split_byte_ranges, min_range_bytes=1))
+
+    with Session(bind=engine) as db:
+        yield db
+    if parallel_ingestion._process_pool is not None:
+        parallel_ingestion._process_pool.shutdown()
+    engine.dispose()
+
+def test_ingest_csv_parallel_merges_every_range(tmp_path, parallel_db):
+    path = tmp_path / "jobs.csv"
+    write_jobs_file(path, 1000)
+
+    result = ingest_csv_parallel("jobs", str(path), parallel_db, workers=4)
+
+    assert (result["rows"], result["inserted"], result["ranges"]) == (1000, 1000, 4)
+    assert parallel_db.execute(select(Jobs.id).order_by(Jobs.id)).scalars().all() == list(range(1, 1001))
+
+    # A single invalid row of the last range fails the whole file
+    path.write_text(path.read_text().replace("1000,Job 1000", "1000.5,Job 1000"))
+    with pytest.raises(HTTPException) as e:
+        ingest_csv_parallel("jobs", str(path), parallel_db, workers=4)
+
+    assert e.value.status_code == 400
+    assert [error["row"] for error in e.value.detail["content_validation_error"]] == [999]
@@ -0,0 +1,144 @@
+import datetime
+import pytest
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
+from app import partitions
+from app.database import Base
+from app.db_models import (
+    Employees,
+    Departments,
+    Jobs,
+    HiringSummary,
+    get_records_values,
+    execute_replacing_upsert,
+    maintain_hiring_summary,
+    report_generation
+)
+from app.migrations import run_migrations
+from app.partitions import (
+    get_year_partition_name,
+    get_year_bounds,
+    get_partitioned_columns_ddl,
+    detach_year_partition,
+    partition_employees_table,
+    create_year_partitions,
+    is_employees_partitioned
+)
+
+
+def test_year_partitions():
+    assert get_year_partition_name(2021) == "employees_y2021"
+    assert get_year_bounds(2021) == ("2021-01-01 00:00:00+00", "2022-01-01 00:00:00+00")
+
+def test_replacing_upsert_counts_the_deleted_employees_as_updated(recording_session):
+    records = [
+        {"id": 1, "name": "Ana", "datetime": datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+         "department_id": None, "job_id": 2},
+        {"id": 2, "name": "Luis", "datetime": None, "department_id": 1, "job_id": None},
+    ]
+    db = recording_session
+    db.results = [None, None, 1, 2]
+
+    inserted, updated = execute_replacing_upsert(Employees.__table__, get_records_values(Employees.__table__, records), db)
+
+    assert (inserted, updated) == (1, 1)
+    lock_sql, repeated_sql, delete_sql, insert_sql = db.statements
+    # Concurrent upserts of a new id would both insert it
+    assert "pg_advisory_xact_lock" in lock_sql
+    assert "GROUP BY incoming.id \nHAVING count(*) > " in repeated_sql
+    assert delete_sql.startswith("DELETE FROM challenge_app.employees USING")
+    assert "IS DISTINCT FROM" in delete_sql
+    assert insert_sql.startswith("INSERT INTO challenge_app.employees")
+    assert "NOT (EXISTS" in insert_sql
+    # The columns of nulls are typed as the columns of the table
+    assert "CAST(records.department_id AS INTEGER)" in insert_sql
+
+def test_replacing_upsert_rejects_the_repeated_ids(recording_session):
+    records = [
+        {"id": 1, "name": "Ana", "datetime": None, "department_id": None, "job_id": None},
+        {"id": 1, "name": "Luis", "datetime": None, "department_id": None, "job_id": None},
+    ]
+    db = recording_session
+    db.results = [None, 1]
+
+    with pytest.raises(IntegrityError) as e:
+        execute_replacing_upsert(Employees.__table__, get_records_values(Employees.__table__, records), db)
+
+    assert str(e.value.orig) == "The id 1 is repeated in the rows of employees"
+    # Nothing is deleted nor inserted
+    assert len(db.statements) == 2
+
+def test_partitioned_columns_ddl_follows_the_model():
+    ddl = get_partitioned_columns_ddl(Employees.__table__, postgresql.dialect())
+
+    assert [column.split(" ")[0] for column in ddl.split(", ")] == [column.name for column in Employees.__table__.columns]
+    # The ids are provided by the loads, without the sequence of the primary key
+    assert ddl.startswith("id INTEGER NOT NULL, name VARCHAR, datetime TIMESTAMP WITH TIME ZONE, ")
+    assert "department_id INTEGER REFERENCES challenge_app.departments (id) DEFERRABLE INITIALLY IMMEDIATE" in ddl
+    assert "job_id INTEGER REFERENCES challenge_app.jobs (id) DEFERRABLE INITIALLY IMMEDIATE" in ddl
+
+def test_detach_year_partition_subtracts_its_hires_from_the_summary(recording_session):
+    db = recording_session
+    db.results = [["employees_y2019"]]
+
+    assert detach_year_partition(db, 2019) == "challenge_app.employees_y2019"
+
+    _, lock_sql, update_sql, delete_sql, detach_sql, generation_sql = db.statements
+    assert "pg_advisory_xact_lock" in lock_sql
+    assert update_sql.startswith("UPDATE challenge_app.hiring_summary SET hired=(challenge_app.hiring_summary.hired - ")
+    assert "employees.datetime >= %(datetime_1)s AND challenge_app.employees.datetime < %(datetime_2)s" in update_sql
+    assert delete_sql.startswith("DELETE FROM challenge_app.hiring_summary")
+    assert detach_sql == "ALTER TABLE challenge_app.employees DETACH PARTITION challenge_app.employees_y2019"
+    # The reports cached or computed before the detach are invalidated with it
+    assert generation_sql == "SELECT nextval('challenge_app.report_generation') AS next_value_1"
+
+@pytest.fixture
+def connection(test_database_url):
+    """
+    Connection of the migrated test database, every test is rolled back with the partitioning of the employees.
+    """
+    engine = create_engine(test_database_url)
+    run_migrations(engine)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        connection.execute(text("TRUNCATE {} CASCADE".format(", ".join(
+            table.fullname for table in Base.metadata.sorted_tables
+        ))))
+        yield connection
+        transaction.rollback()
+    engine.dispose()
+
+def upsert_partitioned_employees(connection, records: list):
+    with maintain_hiring_summary(Employees.id.in_([record["id"] for record in records]), connection):
+        create_year_partitions(connection, {record["datetime"].year for record in records})
+        return execute_replacing_upsert(Employees.__table__, get_records_values(Employees.__table__, records), connection)
+
+def test_detach_year_partition_of_a_database(connection, monkeypatch):
+    monkeypatch.setattr(partitions, "EMPLOYEES_PARTITIONED", True)
+    partition_employees_table(connection)
+    assert is_employees_partitioned(connection)
+
+    connection.execute(insert(Departments), [{"id": 1, "department": "Sales"}])
+    connection.execute(insert(Jobs), [{"id": 1, "job": "Manager"}])
+    hired = [datetime.datetime(year, 2, 1, tzinfo=datetime.timezone.utc) for year in (2019, 2021, 2019)]
+    records = [
+        {"id": id, "name": "Employee {}".format(id), "datetime": hired[id - 1], "department_id": 1, "job_id": 1}
+        for id in (1, 2, 3)
+    ]
+    assert upsert_partitioned_employees(connection, records) == (3, 0)
+
+    # The repeated ids are rejected before deleting or inserting any row, the loads roll back their transaction
+    with pytest.raises(IntegrityError):
+        with connection.begin_nested():
+            upsert_partitioned_employees(connection, [records[1], dict(records[1], name="Other")])
+
+    generation = connection.execute(select(report_generation.next_value())).scalar()
+    assert detach_year_partition(connection, 2019) == "challenge_app.employees_y2019"
+
+    assert connection.execute(select(Employees.id)).scalars().all() == [2]
+    assert [tuple(row) for row in connection.execute(
+        select(HiringSummary.department_id, HiringSummary.job_id, HiringSummary.year, HiringSummary.quarter, HiringSummary.hired)
+    )] == [(1, 1, 2021, 1, 1)]
+    # The detach bumped the data generation once
+    assert connection.execute(select(report_generation.next_value())).scalar() == generation + 2
@@ -0,0 +1,25 @@
+import sqlite3
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.pool import InstrumentedQueuePool
+
+
+def test_instrumented_queue_pool_stats():
+    pool = InstrumentedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=1, timeout=0.01)
+
+    first = pool.connect()
+    second = pool.connect()
+    stats = pool.stats()
+    assert stats["checked_out"] == 2
+    assert stats["overflow"] == 1
+    assert stats["checkouts"] == 2
+
+    # The pool is exhausted, the checkout waits pool_timeout seconds and fails
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["wait_seconds_max"] >= 0.01
+
+    first.close()
+    second.close()
+    assert pool.stats()["checked_out"] == 0
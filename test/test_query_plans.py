@@ -0,0 +1,102 @@
+import json
+import os
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from app.database import Base
+from app.migrations import run_migrations
+from app.loaders import bulk_upsert_data_to_db
+from app.queries import select_employees_per_quarter, select_hiring_more_than_avg
+from app.upload_file_utils import get_file_schema, read_comma_separated_no_header, assign_columns_no_header_file
+from benchmarks.generate_data import generate_files, HIRE_YEARS
+
+# Rows of the generated employees file
+QUERY_PLAN_ROWS = int(os.environ.get("QUERY_PLAN_ROWS", 100000))
+
+# Maximum shared buffers (hit or read) touched by a report of a single year
+QUERY_PLAN_BUFFER_BUDGET = int(os.environ.get("QUERY_PLAN_BUFFER_BUDGET", 2000))
+
+# Tables that the reports must read through their indexes, the departments and jobs are small enough to be scanned
+INDEXED_TABLES = ("hiring_summary", "employees")
+
+# Report statements whose plans are checked
+REPORT_QUERIES = {
+    "employees_per_quarter": select_employees_per_quarter,
+    "hiring_more_than_avg": select_hiring_more_than_avg
+}
+
+
+@pytest.fixture(scope="module")
+def plans_engine(tmp_path_factory, test_database_url):
+    """
+    Migrate the test database and load a generated dataset with the loaders of the uploads.
+    """
+    engine = create_engine(test_database_url)
+    run_migrations(engine)
+
+    with engine.begin() as connection:
+        connection.execute(text("TRUNCATE {} CASCADE".format(", ".join(
+            table.fullname for table in Base.metadata.sorted_tables
+        ))))
+
+    paths = generate_files(str(tmp_path_factory.mktemp("plans")), QUERY_PLAN_ROWS)
+    with Session(bind=engine) as db:
+        for file_type in ("departments", "jobs", "employees"):
+            with open(paths[file_type], "rb") as file:
+                df = read_comma_separated_no_header(UploadFile(file))
+            assign_columns_no_header_file(df, get_file_schema(file_type))
+            assert bulk_upsert_data_to_db(file_type, db, df, "copy") is not None
+
+    # The statistics and the visibility map are up to date, as autovacuum keeps them in production
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE"))
+
+    yield engine
+    engine.dispose()
+
+def explain_analyze(engine, stmt, enable_seqscan: bool = True) -> dict:
+    """
+    Run a statement with EXPLAIN (ANALYZE, BUFFERS) and get the root node of its plan. Without enable_seqscan
+    a table is only scanned sequentially when none of its indexes can answer the statement, whatever its size.
+    """
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    with engine.begin() as connection:
+        if not enable_seqscan:
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = connection.execute(text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)).scalar()
+
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+def iter_plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+@pytest.mark.parametrize("report", sorted(REPORT_QUERIES))
+def test_report_can_be_answered_by_the_indexes(plans_engine, report):
+    # The planner can prefer a sequential scan of a small table, so the plan only checks the indexes cover the report
+    plan = explain_analyze(plans_engine, REPORT_QUERIES[report](HIRE_YEARS[0], HIRE_YEARS[0]), enable_seqscan=False)
+    nodes = list(iter_plan_nodes(plan))
+
+    seq_scans = [
+        node["Relation Name"] for node in nodes
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in INDEXED_TABLES
+    ]
+    assert seq_scans == [], "{} scans {} sequentially".format(report, seq_scans)
+
+    # The covering index of the years answers the report without reading the rows of the hiring summary
+    summary_scans = [node for node in nodes if node.get("Relation Name") == "hiring_summary"]
+    assert summary_scans and all(
+        node["Node Type"] == "Index Only Scan" and node["Index Name"] == "ix_hiring_summary_year" and node["Heap Fetches"] == 0
+        for node in summary_scans
+    ), "{} doesn't read the hiring summary through ix_hiring_summary_year".format(report)
+
+@pytest.mark.parametrize("report", sorted(REPORT_QUERIES))
+def test_report_plan_within_the_buffer_budget(plans_engine, report):
+    plan = explain_analyze(plans_engine, REPORT_QUERIES[report](HIRE_YEARS[0], HIRE_YEARS[0]))
+
+    # The buffers of the root node include the buffers of every node below it
+    buffers = plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+    assert buffers <= QUERY_PLAN_BUFFER_BUDGET, "{} touched {} buffers".format(report, buffers)
@@ -0,0 +1,50 @@
+import os
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from app.replica import ReplicaMonitor
+
+
+class StubReplicaMonitor(ReplicaMonitor):
+    """
+    Monitor whose replica reports the given lags, None when it's unreachable.
+    """
+
+    def __init__(self, lags, **options):
+        options = {"max_lag_seconds": 5, "read_your_writes_seconds": 0, "check_interval_seconds": 0, **options}
+        super().__init__(None, **options)
+        self.lags = list(lags)
+
+    def check_lag(self) -> float:
+        lag = self.lags.pop(0)
+        if lag is None:
+            raise OperationalError("SELECT 1", {}, Exception("connection refused"))
+        return lag
+
+def test_reads_fall_back_to_the_primary_when_the_replica_lags_or_is_unavailable():
+    monitor = StubReplicaMonitor([0.5, 30, None, 1])
+
+    assert [monitor.use_replica() for _ in range(4)] == [True, False, False, True]
+    assert monitor.stats() == {"available": True, "lag_seconds": 1.0, "replica_reads": 2, "primary_reads": 2}
+
+def test_reads_use_the_primary_after_a_write():
+    monitor = StubReplicaMonitor([0], read_your_writes_seconds=60)
+    monitor.record_write()
+
+    assert not monitor.use_replica()
+    # The replica isn't checked during the read-your-writes window
+    assert monitor.lags == [0]
+
+def test_replica_is_checked_once_per_interval():
+    monitor = StubReplicaMonitor([0], check_interval_seconds=60)
+
+    assert monitor.use_replica()
+    assert monitor.use_replica()
+
+@pytest.mark.skipif("TEST_READ_DATABASE_URL" not in os.environ, reason="TEST_READ_DATABASE_URL isn't set")
+def test_replica_lag_of_a_database():
+    # A second local Postgres stands in for the replica, it isn't in recovery so it doesn't lag
+    monitor = ReplicaMonitor(create_engine(os.environ["TEST_READ_DATABASE_URL"]), 5, 0, 0)
+
+    assert monitor.use_replica()
+    assert monitor.lag_seconds == 0
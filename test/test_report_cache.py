@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from app.report_cache import ReportCache, LRUCacheBackend, DatabaseGenerationBackend
+
+
+def test_report_cache_hits_and_misses():
+    cache = ReportCache(LRUCacheBackend(maxsize=2))
+
+    found, _, key = cache.lookup('report')
+    assert not found
+    cache.store(key, 1)
+
+    assert cache.lookup('report')[:2] == (True, 1)
+    assert cache.lookup('report', 2020)[:2] == (False, None)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+def test_report_cache_generation_invalidates_results():
+    cache = ReportCache(LRUCacheBackend(maxsize=2))
+    cache.store(cache.lookup('report')[2], 'old')
+
+    cache.bump_generation()
+    assert cache.lookup('report')[:2] == (False, None)
+    assert cache.stats()['generation'] == 1
+
+def test_report_cache_counts_concurrent_lookups():
+    cache = ReportCache(LRUCacheBackend(maxsize=2))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda year: cache.lookup('report', year % 2), range(4000)))
+
+    assert cache.stats()['hits'] + cache.stats()['misses'] == 4000
+
+class SequenceGenerationBackend(DatabaseGenerationBackend):
+    """
+    Backend reading the generation of a counter instead of the sequence of the database.
+    """
+    def __init__(self, ttl: float):
+        super().__init__(maxsize=2, bind=None, ttl=ttl)
+        self.sequence = 0
+        self.reads = 0
+
+    def read_generation(self) -> int:
+        self.reads += 1
+        return self.sequence
+
+    def next_generation(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+def test_database_generation_backend_sees_the_bumps_of_other_workers():
+    backend = SequenceGenerationBackend(ttl=0)
+    backend.set(('key',), 'old')
+
+    # Another worker bumped the shared generation
+    backend.sequence = 4
+    assert backend.get_generation() == 4
+    assert backend.get(('key',)) == (False, None)
+
+    assert backend.bump_generation() == 5
+    assert backend.get_generation() == 5
+
+def test_database_generation_backend_reuses_the_generation_within_the_ttl():
+    backend = SequenceGenerationBackend(ttl=3600)
+
+    assert backend.get_generation() == 0
+    backend.sequence = 4
+    assert backend.get_generation() == 0
+    assert backend.reads == 1
+
+    # The bumps of the worker are seen at once
+    assert backend.bump_generation() == 5
+    assert backend.get_generation() == 5
+    assert backend.reads == 1
+
+def test_lru_cache_backend_evictions():
+    backend = LRUCacheBackend(maxsize=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.get('a')
+    backend.set('c', 3)
+
+    assert backend.get('b') == (False, None)
+    assert backend.get('a') == (True, 1)
+    assert backend.stats()['evictions'] == 1
+
+    disabled = LRUCacheBackend(maxsize=0)
+    disabled.set('a', 1)
+    assert disabled.get('a') == (False, None)
+
+def test_report_cache_get_or_stream():
+    cache = ReportCache(LRUCacheBackend(maxsize=2))
+
+    async def stream():
+        yield [1, 2]
+        yield [3]
+
+    async def collect(**kwargs):
+        return [batch async for batch in cache.get_or_stream('report', stream, 2021, **kwargs)]
+
+    assert asyncio.run(collect()) == [[1, 2], [3]]
+    assert asyncio.run(collect()) == [[1, 2, 3]]
+
+    # The results larger than max_rows are streamed without being cached
+    assert asyncio.run(collect(max_rows=2)) == [[1, 2, 3]]
+    cache.bump_generation()
+    assert asyncio.run(collect(max_rows=2)) == [[1, 2], [3]]
+    assert asyncio.run(collect(max_rows=2)) == [[1, 2], [3]]
+
+    # The rows of a replica are streamed without being cached
+    assert asyncio.run(collect(store=False)) == [[1, 2], [3]]
+    assert asyncio.run(collect(store=False)) == [[1, 2], [3]]
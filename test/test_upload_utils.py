@@ -1,3 +1,4 @@
+import gzip
 import io
 from app.upload_file_utils import *
 from fastapi import HTTPException
@@ -115,3 +116,116 @@ def test_validate_is_csv_file():
     with pytest.raises(HTTPException) as e:
         read_comma_separated_no_header(UploadFile(binary_io, filename=""))
 
+
+def test_read_comma_separated_no_header_chunks():
+    binary_data = b"1,Sales\n2,Marketing\n3,Finance\n4,Legal\n5,Support"
+    binary_io = io.BytesIO(binary_data)
+    chunks = list(read_comma_separated_no_header_chunks(UploadFile(binary_io), 2))
+    assert [len(df) for df in chunks] == [2, 2, 1]
+    # The row numbering continues between chunks
+    assert list(chunks[-1].index) == [4]
+
+    binary_io = io.BytesIO(b"")
+    with pytest.raises(HTTPException) as e:
+        list(read_comma_separated_no_header_chunks(UploadFile(binary_io), 2))
+
+def test_validate_is_valid_loader():
+    assert is_allowed_loader('insert')
+    assert is_allowed_loader('copy')
+    assert is_allowed_loader('X') == False
+    assert validate_is_valid_loader('copy') is None
+    with pytest.raises(HTTPException) as e:
+        validate_is_valid_loader("X")
+
+def test_column_validators():
+    ints = pd.Series([1, 2.0, 2.5, None, 'a'], dtype=object)
+    assert list(is_integer_or_float_with_decimal_zero(ints)) == [True, True, False, False, False]
+    assert list(is_integer_or_float_with_decimal_zero_or_null(ints)) == [True, True, False, True, False]
+    assert list(is_integer_or_float_with_decimal_zero(pd.Series([1.0, 1.5, float('nan')]))) == [True, False, False]
+    assert list(is_integer_or_float_with_decimal_zero(pd.Series(['1', '2']))) == [False, False]
+
+    timestamps = pd.Series(['2021-07-27T16:02:08Z', '2021-07-27 16:02:08', None, 1], dtype=object)
+    assert list(is_iso_timestamp(timestamps)) == [True, False, True, False]
+    assert list(is_iso_timestamp(pd.Series([1.0, float('nan')]))) == [False, True]
+
+    strings = pd.Series(['engineer', None, 1], dtype=object)
+    assert list(is_string(strings)) == [True, True, False]
+    assert list(is_string(pd.Series([1, 2]))) == [False, False]
+
+def test_get_file_schema_is_built_once():
+    assert get_file_schema('employees') is get_file_schema('employees')
+
+def test_is_iso_timestamp_requires_calendar_dates():
+    timestamps = pd.Series(['2021-02-28T00:00:00Z', '2021-02-30T00:00:00Z', '2021-13-01T00:00:00Z'])
+    assert list(is_iso_timestamp(timestamps)) == [True, False, False]
+
+def test_get_upload_file_format():
+    assert get_upload_file_format("jobs.csv") == "csv"
+    assert get_upload_file_format("jobs.PARQUET") == "parquet"
+    assert get_upload_file_format("jobs.feather") == "arrow"
+    assert get_upload_file_format("jobs.xlsx") is None
+    assert get_upload_file_format("jobs.csv.gz") == "csv"
+    assert get_upload_file_format("jobs.CSV.ZST") == "csv"
+    assert get_upload_file_format("jobs.parquet.gz") is None
+
+def test_decompress_upload_reads_gzip_files_in_chunks():
+    file = UploadFile(io.BytesIO(gzip.compress(b"1,Sales\n2,Marketing\n3,Finance\n")), filename="departments.csv.gz")
+
+    chunks = list(read_comma_separated_no_header_chunks(decompress_upload(file), 2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[1].iloc[0, 1] == "Finance"
+
+def test_decompress_upload_rejects_corrupted_files():
+    content = gzip.compress(b"1,Sales\n")
+    file = UploadFile(io.BytesIO(content[:-8]), filename="departments.csv.gz")
+
+    with pytest.raises(HTTPException) as e:
+        read_comma_separated_no_header(decompress_upload(file))
+    assert e.value.status_code == 400
+
+def test_decompress_upload_reads_zstd_files():
+    zstandard = pytest.importorskip("zstandard")
+    file = UploadFile(io.BytesIO(zstandard.ZstdCompressor().compress(b"1,Sales\n")), filename="departments.csv.zst")
+
+    assert read_comma_separated_no_header(decompress_upload(file)).iloc[0, 1] == "Sales"
+
+def invalid_jobs(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({'id': ['x'] * rows, 'job': [1] * rows})
+
+def test_validate_file_content_stops_at_max_errors():
+    with pytest.raises(HTTPException) as e:
+        validate_file_content(get_file_schema('jobs'), invalid_jobs(10), max_errors=3)
+
+    detail = e.value.detail
+    assert [error["row"] for error in detail["content_validation_error"]] == [0, 1, 2]
+    assert detail["error_count"] == 10
+    assert detail["errors_truncated"]
+    # The job column isn't validated once the id column reached the maximum
+    assert detail["validation_aborted"]
+    assert detail["column_summaries"] == [{
+        "column": "id",
+        "message": "Column should contain only integers.",
+        "count": 10,
+        "sample_rows": [0, 1, 2, 3, 4]
+    }]
+
+def test_validate_file_content_reports_every_column_below_max_errors():
+    with pytest.raises(HTTPException) as e:
+        validate_file_content(get_file_schema('jobs'), invalid_jobs(2))
+
+    detail = e.value.detail
+    assert [(error["row"], error["column"]) for error in detail["content_validation_error"]] == [
+        (0, "id"), (0, "job"), (1, "id"), (1, "job")
+    ]
+    assert not detail["errors_truncated"] and not detail["validation_aborted"]
+    assert [(summary["column"], summary["count"]) for summary in detail["column_summaries"]] == [("id", 2), ("job", 2)]
+
+def test_validation_report_extend_renumbers_the_rows():
+    report = ValidationReport(max_errors=3)
+    for offset in (0, 2):
+        report.extend(get_validation_report(get_file_schema('jobs'), invalid_jobs(2).assign(job='a')), offset)
+
+    assert [error["row"] for error in report.errors] == [0, 1, 2]
+    assert report.error_count == 4
+    assert report.summaries[("id", "Column should contain only integers.")]["sample_rows"] == [0, 1, 2, 3]
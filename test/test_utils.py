@@ -0,0 +1,48 @@
+import pytest
+from app.utils import *
+
+
+def test_html_table_writer():
+    writer = HTMLTableWriter(EMPLOYEES_PER_QUARTER_COLUMNS[1:])
+    table_html = writer.header() + writer.rows([('Staff', 'Engineer', 1, 0, 2, 3)]) + writer.footer()
+    assert "<tr><td>Staff</td><td>Engineer</td><td>1</td><td>0</td><td>2</td><td>3</td></tr>" in table_html
+    assert "Year" not in table_html
+
+    writer = HTMLTableWriter(HIRING_MORE_THAN_AVG_COLUMNS[1:])
+    assert writer.header() + writer.rows([(1, 'Staff', 10)]) + writer.footer() == (
+        "<table border='1'>\n<tr><th>id</th><th>department</th><th>hired</th></tr>\n"
+        "<tr><td>1</td><td>Staff</td><td>10</td></tr>\n</table>"
+    )
+
+def test_report_writers():
+    columns = HIRING_MORE_THAN_AVG_COLUMNS
+    rows = [(2021, 1, 'Staff', 10), (2021, 2, 'Sales, EU', 8)]
+
+    writer = JSONLinesWriter(columns)
+    assert writer.rows(rows).splitlines()[0] == '{"year": 2021, "id": 1, "department": "Staff", "hired": 10}'
+
+    writer = CSVWriter(columns)
+    assert writer.header() + writer.rows(rows) == 'year,id,department,hired\n2021,1,Staff,10\n2021,2,"Sales, EU",8\n'
+
+def test_arrow_stream_writer():
+    pa = pytest.importorskip("pyarrow")
+    writer = ArrowStreamWriter(HIRING_MORE_THAN_AVG_COLUMNS)
+    content = writer.header() + writer.rows([(2021, 1, 'Staff', 10)]) + writer.rows([]) + writer.footer()
+
+    table = pa.ipc.open_stream(content).read_all()
+    assert table.column_names == ['year', 'id', 'department', 'hired']
+    assert table.to_pylist() == [{'year': 2021, 'id': 1, 'department': 'Staff', 'hired': 10}]
+
+def test_negotiate_report_format():
+    assert negotiate_report_format(None) == 'html'
+    assert negotiate_report_format('*/*') == 'html'
+    assert negotiate_report_format('text/csv;q=0.5, application/x-ndjson') == 'jsonl'
+    assert negotiate_report_format('text/html', format='arrow') == 'arrow'
+
+    with pytest.raises(HTTPException) as e:
+        negotiate_report_format('image/png, text/csv;q=0')
+    assert e.value.status_code == 406
+
+    with pytest.raises(HTTPException) as e:
+        negotiate_report_format(None, format='xml')
+    assert e.value.status_code == 400